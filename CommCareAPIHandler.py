@@ -1,19 +1,63 @@
-import boto3
 from botocore.exceptions import ClientError
+from clients import get_s3_client
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
+from itertools import chain
+import copy
 import json
-import requests
-from const import CASE
-from util import APIError, APILimitCalculator, process_response
+import math
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode
+from log import PayloadSummary, get_logger, truncate
+from const import (
+    API_LIMIT_MAX_GROWTH_FACTOR,
+    CASE,
+    DEFAULT_MAX_PENDING_UPLOADS,
+    DEFAULT_MAX_THROTTLE_RETRIES,
+    DEFAULT_RETRY_ATTEMPTS,
+    DEFAULT_PARQUET_ROW_GROUP_SIZE,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_PUSH_CONCURRENCY,
+    DEFAULT_TARGET_FILE_SIZE_MB,
+    PULL_COMPLETE,
+    PULL_NOT_STARTED,
+    PULL_PARTIAL,
+    PUSH_ENTITY_KEY_FIELDS,
+    PUSH_PREFETCH_COUNT,
+    S3_LIST_MAX_KEYS,
+)
+from output import (
+    COMPRESSION_SUFFIXES,
+    CONTENT_TYPES,
+    FILE_EXTENSIONS,
+    JSON,
+    PARQUET,
+    FileRoller,
+    ParquetEncoder,
+    encode_file,
+    file_meta,
+    resolve_compression,
+    resolve_output_format,
+)
+from metrics import BYTES, MeteredClient, MetricsRecorder
+from page import Page
+from ratelimit import THROTTLE_STATUS_CODES, ConcurrencyLimit, get_rate_limiter, get_retry_after_seconds
+from retry import IDEMPOTENT_METHODS, RETRYABLE_STATUS_CODES, RetryingClient, RetryPolicy
+from state import MissingStateError, StateManifest
+from transport import CONNECT_ERRORS, TRANSIENT_REQUEST_ERRORS, get_transport
+from uploader import BackgroundUploader, InlineUploader
+from util import APIError, APILimitCalculator, invalidate_api_token, process_response
 
 main_bucket_name = 'commcare-snowflake-data-sync'
 base_commcare_url = 'https://www.commcarehq.org'
 base_staging_url = 'https://staging.commcarehq.org'
 
-s3 = boto3.client('s3')
-
 class CommCareAPIHandler:
-    def __init__(self, is_staging, domain, api_token_for_domain, event_time, request_limit=100, custom_date_range_config=None, test_mode=False, use_lag=False):
+    def __init__(self, is_staging, domain, api_token_for_domain, event_time, request_limit=100, custom_date_range_config=None, test_mode=False, use_lag=False,
+                 transport=None, pool_size=DEFAULT_POOL_SIZE, request_timeout=None, requests_per_second=None, max_throttle_retries=DEFAULT_MAX_THROTTLE_RETRIES,
+                 retry_attempts=DEFAULT_RETRY_ATTEMPTS, metrics=None):
         self.is_staging = is_staging
         self.domain = domain
         self.api_token = api_token_for_domain
@@ -24,6 +68,21 @@ class CommCareAPIHandler:
         self.APIErrorMax = 3
         self.custom_date_range_config = custom_date_range_config
         self.test_mode = test_mode
+        self.logger = get_logger('CommCareAPIHandler', domain=domain)
+        self.transport = transport or get_transport(pool_size)
+        self.request_timeout = request_timeout
+        # Paces requests to CommCareHQ, shared with every other handler for the same host
+        self.rate_limiter = get_rate_limiter(base_staging_url if is_staging else base_commcare_url, requests_per_second)
+        # Lowers the number of requests in flight while CommCareHQ is throttling them
+        self.concurrency_limit = ConcurrencyLimit(pool_size)
+        self.max_throttle_retries = max_throttle_retries
+        # Retries transient failures of requests to CommCareHQ and of S3 calls
+        self.retry_policy = RetryPolicy(retry_attempts)
+        self.retry_count = 0
+        # Latency and size of every call made to CommCareHQ and S3, emitted as CloudWatch metrics
+        self.metrics = metrics or MetricsRecorder(domain)
+        # Guards the request and error counters, which are shared when data types are processed concurrently
+        self._lock = threading.Lock()
 
     def __str__(self):
         attribute_strings = [f"{key}={value}" for key, value in vars(self).items()]
@@ -41,18 +100,101 @@ class CommCareAPIHandler:
     def api_call_headers(self):
         return {'Content-Type':'application/json', 'Authorization' : f'ApiKey {self.api_token}'}
 
+    def _count_request(self):
+        """
+            Reserves one request from the handler's request budget, which is shared by every data type
+            processed by this handler. Returns the number of the request, for logging.
+        """
+        with self._lock:
+            if self.request_count >= self.request_limit:
+                raise Exception(f"Request limit reached for API Handler: {self}.")
+            self.request_count += 1
+            return self.request_count
+
+    def _count_retry(self, counts_as_request=True):
+        """
+            Records a retry. Retried requests to CommCareHQ take from the request budget like any other request.
+        """
+        if counts_as_request:
+            self._count_request()
+        with self._lock:
+            self.retry_count += 1
+        self.metrics.record('Retries', 1)
+
+    def _get_s3_client(self):
+        return RetryingClient(MeteredClient(get_s3_client(), self.metrics, 'S3'), self.retry_policy, on_retry=lambda: self._count_retry(counts_as_request=False))
+
+    def _get_retry_delay(self, response, error, attempt, idempotent):
+        """
+            Decides whether a request that has been made attempt times should be made again, given its response
+            or the error it failed with, and returns how many seconds to wait before doing so, or None.
+            Throttled responses (429, and 503 for idempotent requests) wait out their Retry-After, which holds
+            back every request to the host. Transient failures (other 5xx and connection errors) back off
+            under the retry policy. Requests that are not idempotent are never retried once CommCareHQ may
+            have processed them.
+        """
+        if response is not None and response.status_code in THROTTLE_STATUS_CODES:
+            if attempt > self.max_throttle_retries or (response.status_code != 429 and not idempotent):
+                return None
+            retry_after_seconds = get_retry_after_seconds(response)
+            self.logger.warning("Request throttled by CommCareHQ. Code: %s. Retry %s of %s in %s seconds...", response.status_code, attempt, self.max_throttle_retries, retry_after_seconds)
+            self.rate_limiter.pause(retry_after_seconds)
+            delay_seconds = 0
+        elif error is not None or response.status_code in RETRYABLE_STATUS_CODES:
+            if not self.retry_policy.allows_retry(attempt) or not (idempotent or isinstance(error, CONNECT_ERRORS)):
+                return None
+            delay_seconds = self.retry_policy.get_delay_seconds(attempt)
+            self.logger.warning("Request failed with a transient error: %s. Retry %s of %s in %.2f seconds...", error or response.status_code, attempt, self.retry_policy.max_attempts - 1, delay_seconds)
+        else:
+            return None
+        self._count_retry()
+        return delay_seconds
+
+    def _send(self, send_request, idempotent=True):
+        """
+            Sends a request through the host's rate limiter and the adaptive concurrency limit, retrying it
+            as _get_retry_delay decides. Returns the last response, which process_response turns into an
+            APIError if it still failed, or raises the last connection error.
+        """
+        attempt = 1
+        while True:
+            self.rate_limiter.acquire()
+            self.concurrency_limit.acquire()
+            response, error = None, None
+            try:
+                response = send_request()
+            except TRANSIENT_REQUEST_ERRORS as e:
+                error = e
+            finally:
+                self.concurrency_limit.release(response is not None and response.status_code in THROTTLE_STATUS_CODES)
+            delay_seconds = self._get_retry_delay(response, error, attempt, idempotent)
+            if delay_seconds is None:
+                if error is not None:
+                    raise error
+                return response
+            time.sleep(delay_seconds)
+            attempt += 1
+
     def _perform_method(self, method, *args):
         try:
             method(*args)
         except APIError as e:
-            print({
-                "ERROR making request to API": str(e),
-                "domain": self.domain,
-                "data_type": args[0]
-            })
+            self._handle_api_error(e, args[0])
+
+    def _handle_api_error(self, error, data_type):
+        """
+            Records an API error, re-raising it once the handler has reached its maximum number of API errors.
+        """
+        data_type_name = data_type.get('name') if isinstance(data_type, dict) else data_type
+        self.logger.error("Error making request to API: %s", truncate(error), extra={'data_type': data_type_name})
+        if error.error_code == 401:
+            # The token may have been rotated since it was cached; read it again on the next invocation
+            invalidate_api_token(self.api_token)
+        with self._lock:
             self.APIErrorCount +=1
-            if self.APIErrorCount >= self.APIErrorMax:
-                raise
+            error_max_reached = self.APIErrorCount >= self.APIErrorMax
+        if error_max_reached:
+            raise error
 
 
 class CommCareAPIHandlerPull(CommCareAPIHandler):
@@ -62,11 +204,26 @@ class CommCareAPIHandlerPull(CommCareAPIHandler):
         requests as files in S3.
     """
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, pipeline_uploads=False, max_pending_uploads=DEFAULT_MAX_PENDING_UPLOADS, data_type_concurrency=1, deadline=None, **kwargs):
         super().__init__(*args, **kwargs)
+        self.pipeline_uploads = pipeline_uploads
+        self.max_pending_uploads = max_pending_uploads
+        self.data_type_concurrency = data_type_concurrency
+        # Pagination stops before a page that would not finish before the deadline, if one is given
+        self.deadline = deadline
+        # Status of each data type's pull: complete, partial (stopped at the deadline) or not_started
+        self.data_type_statuses = {}
+        # Latest API limit per data type for data types with an automatically-determined limit
+        self.api_limits = {}
+        # Latest compressed / uncompressed size ratio per data type for data types with compressed files
+        self.compression_ratios = {}
+        # Parquet encoders (and so their cached schemas) per data type for data types with Parquet files
+        self.parquet_encoders = {}
+        # Stored parameters of every data type, read from S3 on first use (see _get_state)
+        self.state = None
         if kwargs['use_lag']:
             self.event_time = self.event_time - timedelta(hours=0, minutes=5)
-            print("Added a 5 minute lag.")
+            self.logger.info("Added a 5 minute lag.")
 
     def filepath(self, data_type):
         path_beginning = f"{self.domain}/snowflake-copy/"
@@ -78,82 +235,134 @@ class CommCareAPIHandlerPull(CommCareAPIHandler):
         """
         return f"{self.domain}/snowflake-copy/{data_type_name}" + ("-test" if self.test_mode else "") + f"/{stored_parameter_name}.txt"
 
-    def _get_stored_param_from_s3(self, stored_parameter_name, data_type_name):
+    def _get_state_filepath(self):
+        """
+            Example file path: "co-carecoordination-test/snowflake-copy/state.json"
+        """
+        return f"{self.domain}/snowflake-copy/state" + ("-test" if self.test_mode else "") + ".json"
+
+    def _get_state(self):
         """
-            Get a parameter that's stored as a .txt file with the given name, in S3.
+            Gets the domain's state manifest, which is read from S3 the first time a stored parameter is needed.
         """
-        return s3.get_object(Bucket=main_bucket_name, Key=self._get_stored_param_filepath(stored_parameter_name, data_type_name))['Body'].read().decode("utf-8")
+        with self._lock:
+            if self.state is None:
+                self.state = StateManifest(self._get_s3_client(), main_bucket_name, self._get_state_filepath(), self._get_stored_param_filepath)
+            return self.state
+
+    def _save_state(self):
+        """
+            Writes every stored parameter changed by this handler to S3, in a single write of the state manifest.
+        """
+        if self.state is not None:
+            self.state.save()
 
     def _get_last_job_success_time(self, data_type_name):
         """
             Gets the time the Lambda function was last successfully excecuted for the given data type.
         """
-        print(f"Loading last successful job time for {data_type_name} run on domain {self.domain}...")
-        last_successful_job_time = self._get_stored_param_from_s3('last_successful_job_time', data_type_name)
-        print(f"Load successful. Last successful job time was: {last_successful_job_time}.")
+        self.logger.debug("Loading last successful job time...", extra={'data_type': data_type_name})
+        last_successful_job_time = self._get_state().get(data_type_name, 'last_successful_job_time')
+        if last_successful_job_time is None:
+            raise MissingStateError(f"No last successful job time stored for data type: {data_type_name}.")
+        self.logger.info("Last successful job time was: %s.", last_successful_job_time, extra={'data_type': data_type_name})
         return last_successful_job_time
 
     def _get_current_api_limit(self, data_type_name):
         """
-            Gets the stored API limit for this data type from S3, if there is one saved.
+            Gets the stored API limit for this data type, if there is one saved.
         """
-        print(f"Loading current API limit for {data_type_name} run on domain {self.domain}...")
-        api_limit = self._get_stored_param_from_s3('api_limit', data_type_name)
-        print(f"Load successful. Current API limit is: {api_limit}.")
+        api_limit = self._get_state().get(data_type_name, 'api_limit')
+        self.logger.debug("Current API limit is: %s.", api_limit, extra={'data_type': data_type_name})
         return api_limit
 
     def _save_run_time(self, data_type_name, time):
         """
-            Save the last successful run time for this data type in S3.
+            Save the last successful run time for this data type in the state manifest.
         """
-        filepath = self._get_stored_param_filepath('last_successful_job_time', data_type_name)
-        print(f"Saving run time of {data_type_name} pull on domain {self.domain} with filename: {filepath}. Run time: {str(time)}...")
-        s3.put_object(Body=str(time), Bucket=main_bucket_name, Key=filepath)
-        print(f"Run time saved.")
+        self._get_state().set(data_type_name, 'last_successful_job_time', str(time))
+        self.logger.info("Run time set to: %s.", time, extra={'data_type': data_type_name})
 
     def _save_api_limit(self, data_type_name, limit):
         """
-            Save the calculated API limit for this data type in S3.
+            Save the calculated API limit for this data type in the state manifest.
         """
-        filepath = self._get_stored_param_filepath('api_limit', data_type_name)
-        print(f"Saving new API limit of {data_type_name} pull on domain {self.domain} with filename: {filepath}...")
-        s3.put_object(Body=str(limit), Bucket=main_bucket_name, Key=filepath)
-        print(f"API limit saved. New value: {limit}.")
+        self._get_state().set(data_type_name, 'api_limit', int(limit))
+        self.logger.info("API limit set to: %s.", limit, extra={'data_type': data_type_name})
 
-    def _get_api_limit(self, data_type, start_time, end_time):
+    def _get_checkpoint(self, data_type, last_successful_job_time):
         """
-            Tests an existing API limit and returns a new appropriate API limit for the given data type,
-            utilizing the APILimitCalculator helper class.
+            Gets the checkpoint saved by a previous run of this data type that did not finish, if there is one.
+            A checkpoint saved before the last successful job time was updated is out of date and is ignored.
         """
-        print(f"Verifying api limit for {data_type['name']} run on domain {self.domain}...")
-        current_limit = data_type['limit']
-        try:
-            current_limit = self._get_current_api_limit(data_type['name'])
-        except ClientError as e:
-            if e.response['Error']['Code'] == 'NoSuchKey':
-                print(f"No stored api limit found (no .txt file).")
-            else:
-                raise
-        size_of_test_request_in_bytes = self._test_api_limit(data_type, current_limit, start_time, end_time)
-        new_limit = APILimitCalculator.determine_new_api_limit(current_limit, size_of_test_request_in_bytes)
-        self._save_api_limit(data_type['name'], new_limit)
+        data_type_name = data_type['name']
+        checkpoint = self._get_state().get(data_type_name, 'checkpoint')
+        if checkpoint is None:
+            self.logger.debug("No stored checkpoint found.", extra={'data_type': data_type_name})
+            return None
+        if isinstance(checkpoint, str):
+            # Checkpoints read from a legacy .txt file are still JSON-encoded
+            checkpoint = json.loads(checkpoint)
+        if checkpoint['last_successful_job_time'] != last_successful_job_time:
+            self.logger.info("Ignoring out of date checkpoint: %s.", checkpoint, extra={'data_type': data_type_name})
+            return None
+        self.logger.info("Resuming from checkpoint: %s.", checkpoint, extra={'data_type': data_type_name})
+        return copy.deepcopy(checkpoint)
+
+    def _save_checkpoint(self, data_type_name, checkpoint):
+        """
+            Save the point a data type's pagination has reached, so that a run that times out can be resumed
+            from there. Unlike other stored parameters, checkpoints are written to S3 straight away.
+        """
+        self.logger.debug("Saving checkpoint: %s...", checkpoint, extra={'data_type': data_type_name})
+        self._get_state().set(data_type_name, 'checkpoint', copy.deepcopy(checkpoint))
+        self._save_state()
+
+    def _clear_checkpoint(self, data_type_name):
+        self._get_state().delete(data_type_name, 'checkpoint')
+        self.logger.debug("Checkpoint cleared.", extra={'data_type': data_type_name})
+
+    def _get_api_limit(self, data_type):
+        """
+            Gets the API limit to start paginating the given data type with: the limit saved by the previous
+            run if there is one, otherwise the data type's configured limit. The limit is then adapted page by
+            page as the data comes in (see _adapt_api_limit).
+        """
+        current_limit = self._get_current_api_limit(data_type['name'])
+        if current_limit is None:
+            self.logger.debug("No stored API limit found. Using the configured limit.", extra={'data_type': data_type['name']})
+            current_limit = data_type['limit']
+        self.api_limits[data_type['name']] = int(current_limit)
+        return int(current_limit)
+
+    def _adapt_api_limit(self, data_type, current_limit, page_size_in_bytes, object_count):
+        """
+            Calculates the API limit for the next page from the size of the page that was just received,
+            utilizing the APILimitCalculator helper class. The limit grows by at most API_LIMIT_MAX_GROWTH_FACTOR
+            at a time. A page holding fewer objects than the limit (such as the last page) is scaled up to the
+            size a full page would have been, but can only shrink the limit: a few objects say too little about
+            the size of a full page to grow it. The limit saved at the end of the pull is the last one
+            calculated from a full page, or from a page that shrank it.
+        """
+        full_page_size_in_bytes = page_size_in_bytes * current_limit / object_count
+        compression_ratio = 1.0
+        if data_type.get('size_limit_after_compression'):
+            compression_ratio = self.compression_ratios.get(data_type['name'], 1.0)
+        new_limit = APILimitCalculator.determine_new_api_limit(current_limit, full_page_size_in_bytes, compression_ratio)
+        new_limit = min(new_limit, current_limit * API_LIMIT_MAX_GROWTH_FACTOR)
+        if object_count < current_limit and new_limit >= current_limit:
+            return current_limit
+        self.api_limits[data_type['name']] = new_limit
         return new_limit
 
-    def _test_api_limit(self, data_type, current_limit, start_time, end_time):
+    def _set_cursor_limit(self, cursor, limit):
         """
-            Performs an initial test request of an api limit, returning the size in bytes.
+            Replaces the limit in a "next" cursor query string, if it has one.
         """
-        print(f"Testing current api limit: {current_limit}...")
-        api_url = self.api_base_url(data_type)
-        params = {
-            "limit": current_limit
-        }
-        params = self._get_indexing_params(params, data_type, start_time, end_time)
-        print(f"Making request to URL: {api_url} with parameters: {params}.")
-        response = requests.get(api_url, headers=self.api_call_headers(), params=params)
-        response_data = process_response(response)
-        size_in_bytes = len(json.dumps(response_data).encode('utf-8'))
-        return size_in_bytes
+        query = parse_qsl(cursor.lstrip('?'), keep_blank_values=True)
+        if not any(key == 'limit' for key, _ in query):
+            return cursor
+        return '?' + urlencode([(key, limit if key == 'limit' else value) for key, value in query])
 
     def get_date_range(self, data_type):
         if self.custom_date_range_config:
@@ -168,7 +377,7 @@ class CommCareAPIHandlerPull(CommCareAPIHandler):
         params = {}
         if data_type.get('auto_determine_limit'):
             params.update({
-                'limit': self._get_api_limit(data_type, start_time, end_time)
+                'limit': self._get_api_limit(data_type)
             })
         else:
             params.update({
@@ -199,131 +408,554 @@ class CommCareAPIHandlerPull(CommCareAPIHandler):
                 })
         return params
     
-    def store_in_s3(self, cc_api_data_type, response_data, filename):
-        print(f"Storing file of {cc_api_data_type['name']} type with filename: {filename}...")
-        s3.put_object(Body=json.dumps(response_data), Bucket=main_bucket_name, Key=(self.filepath(cc_api_data_type['name']) + filename))
-        print(f"{cc_api_data_type['name']} file stored.")
+    def _get_parquet_encoder(self, data_type):
+        with self._lock:
+            if data_type['name'] not in self.parquet_encoders:
+                self.parquet_encoders[data_type['name']] = ParquetEncoder(
+                    flatten=bool(data_type.get('parquet_flatten')),
+                    row_group_size=int(data_type.get('parquet_row_group_size', DEFAULT_PARQUET_ROW_GROUP_SIZE)),
+                    compression=data_type.get('compression')
+                )
+            return self.parquet_encoders[data_type['name']]
+
+    def store_in_s3(self, cc_api_data_type, pages, filename):
+        """
+            Writes one or more pages to S3 as a single file named filename plus its extension. The file is
+            written in the data type's "output_format" ("json", the default, "ndjson" or "parquet") and
+            compressed when the data type sets "compression" ("gzip" or "zstd"). JSON and NDJSON files get a
+            matching key suffix and ContentEncoding; Parquet files use the setting as their internal codec.
+            Data types that set "meta_sidecar" also get the file's meta block written next to it.
+        """
+        data_type_name = cc_api_data_type['name']
+        output_format = resolve_output_format(cc_api_data_type.get('output_format', JSON))
+        key = self.filepath(data_type_name) + filename + FILE_EXTENSIONS[output_format]
+        if output_format == PARQUET:
+            body = self._get_parquet_encoder(cc_api_data_type).encode(pages)
+            put_object_args = {'ContentType': CONTENT_TYPES[output_format]}
+        else:
+            compression = resolve_compression(cc_api_data_type.get('compression'))
+            body = encode_file(pages, output_format, compression)
+            put_object_args = {'ContentType': CONTENT_TYPES[output_format]}
+            if compression:
+                self.compression_ratios[data_type_name] = body.getbuffer().nbytes / sum(page.size_in_bytes for page in pages)
+                put_object_args['ContentEncoding'] = compression
+                key += COMPRESSION_SUFFIXES[compression]
+        body_size = body.getbuffer().nbytes
+        self.logger.info("Storing file with key: %s (%s bytes)...", key, body_size, extra={'data_type': data_type_name})
+        self.metrics.record('Files', 1, data_type_name=data_type_name)
+        self.metrics.record('FileBytes', body_size, BYTES, data_type_name)
+        self._get_s3_client().put_object(Body=body, Bucket=main_bucket_name, Key=key, **put_object_args)
+        if cc_api_data_type.get('meta_sidecar'):
+            self._get_s3_client().put_object(Body=json.dumps({'meta': file_meta(pages)}), Bucket=main_bucket_name, Key=self.filepath(data_type_name) + filename + '.meta.json', ContentType='application/json')
+        self.logger.debug("File stored.", extra={'data_type': data_type_name})
+
+    def _get_uploader(self):
+        """
+            Returns the uploader used to hand pages to store_in_s3. With pipelined uploads, S3 writes run
+            in the background while the next page is being fetched.
+        """
+        if self.pipeline_uploads:
+            return BackgroundUploader(self.store_in_s3, max_pending=self.max_pending_uploads)
+        return InlineUploader(self.store_in_s3)
 
-    def pull_data(self, data_type):
+    def _parse_indexed_on(self, indexed_on):
+        try:
+            return datetime.strptime(indexed_on, "%Y-%m-%dT%H:%M:%S.%fZ").isoformat()
+        except ValueError:
+            return datetime.strptime(indexed_on, "%Y-%m-%dT%H:%M:%S.%f").isoformat()
+
+    def _uses_shards(self, data_type):
+        return bool(data_type.get('uses_indexed_on')) and int(data_type.get('shard_count', 1)) > 1
+
+    def _get_shard_ranges(self, data_type, params, start_time, end_time):
+        """
+            Splits [start_time, end_time] into evenly sized sub-ranges that can be paginated concurrently.
+            The number of shards (at most the data type's "shard_count") is sized from the total_count of a
+            cheap probe request with a limit of 1, so small windows are not split into near-empty shards.
+        """
+        if not self._uses_shards(data_type):
+            return [(start_time, end_time)]
+        probe_page = self._request_page(data_type, self.api_base_url(data_type), dict(params, limit=1))
+        return self._split_date_range(data_type, params, start_time, end_time, probe_page.meta['total_count'])
+
+    def _split_date_range(self, data_type, params, start_time, end_time, total_count):
+        shard_count = min(int(data_type.get('shard_count', 1)), math.ceil(total_count / int(params['limit'])))
+        if shard_count <= 1:
+            return [(start_time, end_time)]
+        range_start = datetime.fromisoformat(start_time)
+        shard_length = (datetime.fromisoformat(end_time) - range_start) / shard_count
+        boundaries = [start_time] + [(range_start + shard_length * i).isoformat() for i in range(1, shard_count)] + [end_time]
+        self.logger.info("Splitting %s items into %s shards.", total_count, shard_count, extra={'data_type': data_type['name']})
+        return list(zip(boundaries[:-1], boundaries[1:]))
+
+    def _get_resumed_shards(self, checkpoint):
+        """
+            Gets the checkpoints of the shards that a previous, sharded run did not finish, or None if the
+            previous run was not sharded. A resumed pull keeps the previous run's shards rather than splitting
+            its date range again.
+        """
+        if checkpoint is None or not checkpoint.get('shards'):
+            return None
+        return [shard for shard in checkpoint['shards'] if shard['start_time'] != shard['end_time']]
+
+    def _start_shards(self, checkpoint, shard_ranges):
+        """
+            Gets a checkpoint for each shard of the given ranges, or None if the date range was not split.
+            With a checkpoint, the shard checkpoints are kept in it under "shards", so that saving it saves the
+            point every shard has reached.
+        """
+        if len(shard_ranges) <= 1:
+            return None
+        shards = [{'start_time': start, 'end_time': end, 'cursor': None, 'files_written': 0} for start, end in shard_ranges]
+        if checkpoint is not None:
+            checkpoint['shards'] = shards
+        return shards
+
+    def _get_shard_params(self, params, shard):
+        return dict(params, indexed_on_start=shard['start_time'], indexed_on_end=shard['end_time'])
+
+    def _finish_shard(self, shard, completed):
+        # A finished shard is moved to the end of its range, so that a resumed pull skips it
+        if completed:
+            shard['start_time'] = shard['end_time']
+        return completed
+
+    def _get_file_roller(self, data_type, submit, file_count=0):
+        """
+            Returns the roller that groups pages into files, passing each file to submit. Data types that set
+            "roll_files" have their pages coalesced into files of up to "target_file_size_mb"; otherwise every
+            page is its own file. file_count is the number of files already written by a resumed pull.
+        """
         data_type_name = data_type['name']
-        initial_start_time, initial_end_time = self.get_date_range(data_type)
-        params = self.get_initial_parameters_for_data_type(data_type, initial_start_time, initial_end_time)
-        api_url = self.api_base_url(data_type)
-    
-        print(f"Starting {data_type_name} processing for domain: {self.domain}. Storing in bucket: {main_bucket_name} with filepath: {self.filepath(data_type_name)}.")
-        more_items_remain = True
-        if not data_type.get('uses_indexed_on'):
-            data_type_request_count = 0 # Record request count to add to filename if needed
-        while more_items_remain:
-            ## Make request
-            print(f"Making request to URL: {api_url} with parameters: {params}.")
-            if self.request_count < self.request_limit:
-                response = requests.get(api_url, headers=self.api_call_headers(), params=params)
-                self.request_count += 1
+
+        def submit_file(pages, start, end):
+            if data_type.get('uses_indexed_on'):
+                filename = f"{data_type_name}_{start}_{end}"
             else:
-                raise Exception(f"Request limit reached for API Handler: {self}.")
-            response_data = process_response(response)
-            print(f"Request successful.")
+                filename = f"{data_type_name}_{start}_{end}_{roller.file_count}"
+            submit(data_type, pages, filename)
+
+        target_size_in_bytes = None
+        if data_type.get('roll_files'):
+            target_size_in_bytes = float(data_type.get('target_file_size_mb', DEFAULT_TARGET_FILE_SIZE_MB)) * 1000000
+        roller = FileRoller(submit_file, target_size_in_bytes, file_count)
+        return roller
 
-            ## Prepare next request (if needed)
+    def _get_file_size_in_bytes(self, data_type, page):
+        """
+            Gets the size a page will take up in its file, which is its compressed size if the data type's
+            size limit applies after compression.
+        """
+        if data_type.get('size_limit_after_compression'):
+            return page.size_in_bytes * self.compression_ratios.get(data_type['name'], 1.0)
+        return page.size_in_bytes
+
+    def _request_page(self, data_type, api_url, params):
+        request_number = self._count_request()
+        log_fields = {'data_type': data_type['name'], 'request_number': request_number}
+        self.logger.debug("Making request to URL: %s with parameters: %s.", api_url, params, extra=log_fields)
+        with self.metrics.time('ApiRequestLatency', data_type['name']):
+            response = self._send(lambda: self.transport.get(api_url, headers=self.api_call_headers(), params=params, timeout=self.request_timeout))
+        page = Page.from_response(response, raw=data_type.get('raw_passthrough'))
+        self._record_page_metrics(data_type, page)
+        self.logger.info("Request successful. Received %s objects (%s bytes).", page.object_count, page.size_in_bytes, extra=log_fields)
+        return page
+
+    def _record_page_metrics(self, data_type, page):
+        self.metrics.record('Pages', 1, data_type_name=data_type['name'])
+        self.metrics.record('PageObjects', page.object_count, data_type_name=data_type['name'])
+        self.metrics.record('PageBytes', page.size_in_bytes, BYTES, data_type['name'])
+
+    def _prepare_next_request(self, data_type, page, params, initial_start_time, initial_end_time):
+        """
+            Works out the request for the page after the given one, adapting the API limit to the size of the
+            page if needed. Returns the next request's URL and parameters (a URL of None once pagination has
+            ended), along with the start and end of the span covered by the given page, for its filename.
+        """
+        data_type_name = data_type['name']
+        api_url = self.api_base_url(data_type)
+
+        ## Adapt the limit for the next page to the size of this one
+        next_limit = None
+        if data_type.get('auto_determine_limit') and page.object_count:
+            next_limit = self._adapt_api_limit(data_type, int(page.meta['limit']), page.size_in_bytes, page.object_count)
+
+        if data_type.get('uses_indexed_on'):
+            indexed_on_start_of_last_request = params.get('indexed_on_start')
+        if page.meta['next']:
             if data_type.get('uses_indexed_on'):
-                indexed_on_start_of_last_request = params.get('indexed_on_start')
-            if response_data['meta']['next']:
-                if data_type.get('uses_indexed_on'):
-                    limit = response_data['meta']['limit']
-                    last_item = response_data['objects'][limit - 1]
-                    try:
-                        request_end_boundary = datetime.strptime(last_item['indexed_on'], "%Y-%m-%dT%H:%M:%S.%fZ").isoformat()
-                    except ValueError:
-                        request_end_boundary = datetime.strptime(last_item['indexed_on'], "%Y-%m-%dT%H:%M:%S.%f").isoformat()
-                    params['indexed_on_start'] = request_end_boundary
-                    print(f"Continuing to next page, with new indexed_on start: {request_end_boundary}...")
-                else:
-                    cursor = response_data['meta']['next']
-                    api_url = self.api_base_url(data_type) + cursor
-                    params = None
+                request_end_boundary = self._parse_indexed_on(page.last_indexed_on)
+                params['indexed_on_start'] = request_end_boundary
+                if next_limit:
+                    params['limit'] = next_limit
+                self.logger.debug("Continuing to next page, with new indexed_on start: %s...", request_end_boundary, extra={'data_type': data_type_name})
             else:
-                if data_type.get('uses_indexed_on'):
-                    request_end_boundary = params.get('indexed_on_end')
-                more_items_remain = False
-                print(f"Reached end of {data_type_name} pagination.")
+                cursor = page.meta['next']
+                if next_limit:
+                    cursor = self._set_cursor_limit(cursor, next_limit)
+                api_url = self.api_base_url(data_type) + cursor
+                params = None
+        else:
+            if data_type.get('uses_indexed_on'):
+                request_end_boundary = params.get('indexed_on_end')
+            api_url = None
+            self.logger.info("Reached end of pagination.", extra={'data_type': data_type_name})
+
+        if data_type.get('uses_indexed_on'):
+            return api_url, params, indexed_on_start_of_last_request, request_end_boundary
+        return api_url, params, initial_start_time, initial_end_time
+
+    def _paginate(self, data_type, params, uploader, initial_start_time, initial_end_time, checkpoint=None, parent_checkpoint=None):
+        """
+            Requests every page for the given starting parameters, handing each non-empty page to the uploader
+            through a file roller. With a checkpoint, pagination starts from the checkpoint's cursor if it has
+            one, and the checkpoint is saved every "checkpoint_every" pages once the pages before it are in S3.
+            A shard's checkpoint is saved by saving the data type's checkpoint it is kept in (parent_checkpoint).
+
+            Returns False if pagination stopped early because the next page would not finish before the
+            deadline, after saving the checkpoint (if there is one) so that the next run picks up from there.
+        """
+        api_url = self.api_base_url(data_type)
+        if checkpoint and checkpoint['cursor']:
+            api_url, params = api_url + checkpoint['cursor'], None
+        roller = self._get_file_roller(data_type, uploader.submit, checkpoint['files_written'] if checkpoint else 0)
+        page_count = 0
+        while api_url:
+            if self._is_deadline_reached():
+                self.logger.warning("Stopping pagination, as the next page would not finish before the deadline.", extra={'data_type': data_type['name']})
+                roller.flush()
+                uploader.flush()
+                if checkpoint is not None:
+                    self._update_checkpoint(data_type, checkpoint, api_url, params, roller)
+                    self._save_checkpoint(data_type['name'], parent_checkpoint or checkpoint)
+                return False
+            page_start_time = time.monotonic()
+            page = self._request_page(data_type, api_url, params)
+            api_url, params, file_start, file_end = self._prepare_next_request(data_type, page, params, initial_start_time, initial_end_time)
+            if page.object_count:
+                roller.add(page, file_start, file_end, self._get_file_size_in_bytes(data_type, page))
+            page_count += 1
+            if self._is_checkpoint_due(data_type, checkpoint, api_url, page_count):
+                roller.flush()
+                uploader.flush()
+                self._update_checkpoint(data_type, checkpoint, api_url, params, roller)
+                self._save_checkpoint(data_type['name'], parent_checkpoint or checkpoint)
+            self._record_page_time(page_start_time)
+        roller.flush()
+        return True
+
+    def _paginate_shard(self, data_type, params, uploader, initial_start_time, initial_end_time, checkpoint, shard):
+        completed = self._paginate(data_type, self._get_shard_params(params, shard), uploader, initial_start_time, initial_end_time, shard if checkpoint is not None else None, checkpoint)
+        return self._finish_shard(shard, completed)
+
+    def _update_checkpoint(self, data_type, checkpoint, api_url, params, roller):
+        """
+            Moves a checkpoint on to the request that pagination will make next. Every page before that
+            request must already be written to S3.
+        """
+        if data_type.get('uses_indexed_on'):
+            checkpoint['start_time'] = params['indexed_on_start']
+            checkpoint['end_time'] = params['indexed_on_end']
+        else:
+            checkpoint['cursor'] = api_url[len(self.api_base_url(data_type)):]
+        checkpoint['files_written'] = roller.file_count
 
-            ## Put data in S3
+    def _is_checkpoint_due(self, data_type, checkpoint, api_url, page_count):
+        checkpoint_every = data_type.get('checkpoint_every')
+        return checkpoint is not None and api_url is not None and bool(checkpoint_every) and page_count % int(checkpoint_every) == 0
+
+    def _is_deadline_reached(self):
+        return self.deadline is not None and not self.deadline.allows_next_page()
+
+    def _record_page_time(self, page_start_time):
+        if self.deadline is not None:
+            self.deadline.record_page(time.monotonic() - page_start_time)
+
+    @property
+    def resume_needed(self):
+        return any(status != PULL_COMPLETE for status in self.data_type_statuses.values())
+
+    def _start_pull(self, data_type):
+        """
+            Gets the date range, starting parameters and checkpoint to pull the given data type with. Data types
+            that set "checkpoint_every", and every data type when there is a deadline, get a checkpoint. It
+            resumes the previous run if that run did not finish:
+            indexed_on data types pick up from the last indexed_on reached, and others from the last cursor
+            reached within the previous run's date range, and sharded data types pick up every unfinished shard
+            from the last indexed_on it reached. Runs with a custom date range do not checkpoint.
+        """
+        initial_start_time, initial_end_time = self.get_date_range(data_type)
+        checkpoint = None
+        if (data_type.get('checkpoint_every') or self.deadline) and not self.custom_date_range_config:
+            checkpoint = self._get_checkpoint(data_type, initial_start_time) or {
+                'last_successful_job_time': initial_start_time,
+                'start_time': initial_start_time,
+                'end_time': initial_end_time,
+                'cursor': None,
+                'files_written': 0
+            }
             if data_type.get('uses_indexed_on'):
-                filename = f"{data_type_name}_{indexed_on_start_of_last_request}_{request_end_boundary}.json"
+                initial_start_time = checkpoint['start_time']
             else:
-                data_type_request_count += 1
-                filename = f"{data_type_name}_{initial_start_time}_{initial_end_time}_{data_type_request_count}.json"
-            if len(response_data['objects']):
-                self.store_in_s3(data_type, response_data, filename)
-    
-        print(f"Data type {data_type_name} processing for domain: {self.domain} finished. API handler has made {self.request_count} requests in total.")
+                initial_start_time, initial_end_time = checkpoint['start_time'], checkpoint['end_time']
+        params = self.get_initial_parameters_for_data_type(data_type, initial_start_time, initial_end_time)
+        return initial_start_time, initial_end_time, params, checkpoint
+
+    def _finish_pull(self, data_type, initial_end_time, checkpoint, completed):
+        """
+            Saves the stored parameters of a pull. The run time is only moved on, and the checkpoint cleared,
+            once the data type has been pulled completely; a pull stopped at the deadline keeps its checkpoint,
+            which is saved again in case any shards finished after others had saved it.
+        """
+        data_type_name = data_type['name']
+        if data_type.get('auto_determine_limit'):
+            self._save_api_limit(data_type_name, self.api_limits[data_type_name])
+        if not completed:
+            self.logger.warning("Processing stopped at the deadline. Resume needed.", extra={'data_type': data_type_name})
+            if checkpoint is not None:
+                self._save_checkpoint(data_type_name, checkpoint)
+            self.data_type_statuses[data_type_name] = PULL_PARTIAL
+            return
         if not self.custom_date_range_config:
-            self._save_run_time(data_type_name, self.event_time.isoformat())
+            self._save_run_time(data_type_name, initial_end_time)
+        if checkpoint is not None:
+            self._clear_checkpoint(data_type_name)
+        self.data_type_statuses[data_type_name] = PULL_COMPLETE
+
+    def pull_data(self, data_type):
+        data_type_name = data_type['name']
+        if self._is_deadline_reached():
+            self.logger.warning("Not starting processing, as there is not enough time left before the deadline.", extra={'data_type': data_type_name})
+            self.data_type_statuses[data_type_name] = PULL_NOT_STARTED
+            return
+        initial_start_time, initial_end_time, params, checkpoint = self._start_pull(data_type)
+    
+        self.logger.info("Starting processing. Storing in bucket: %s with filepath: %s.", main_bucket_name, self.filepath(data_type_name), extra={'data_type': data_type_name})
+        with self._get_uploader() as uploader:
+            shards = self._get_resumed_shards(checkpoint)
+            if shards is None:
+                shard_ranges = [(initial_start_time, initial_end_time)]
+                if not (checkpoint and checkpoint['cursor']):
+                    shard_ranges = self._get_shard_ranges(data_type, params, initial_start_time, initial_end_time)
+                shards = self._start_shards(checkpoint, shard_ranges)
+            if shards is not None:
+                with ThreadPoolExecutor(max_workers=max(len(shards), 1), thread_name_prefix=f"{data_type_name}-shard") as executor:
+                    futures = [
+                        executor.submit(self._paginate_shard, data_type, params, uploader, initial_start_time, initial_end_time, checkpoint, shard)
+                        for shard in shards
+                    ]
+                completed = all([future.result() for future in futures])
+            else:
+                completed = self._paginate(data_type, params, uploader, initial_start_time, initial_end_time, checkpoint)
+            uploader.flush()
+    
+        self.logger.info("Processing finished. API handler has made %s requests in total.", self.request_count, extra={'data_type': data_type_name})
+        self._finish_pull(data_type, initial_end_time, checkpoint, completed)
+
+    def _pull_data_type(self, data_type_name, data_type):
+        try:
+            with self.metrics.time('PullDuration', data_type_name):
+                self._perform_method(self.pull_data, data_type)
+        except (ClientError, MissingStateError) as e:
+            self._handle_client_error(e, data_type_name)
+
+    def _handle_client_error(self, error, data_type_name):
+        if isinstance(error, MissingStateError) or error.response['Error']['Code'] == 'NoSuchKey':
+            self.logger.warning("Missing stored parameter (i.e. last successful job time, api limit). Skipping processing...", extra={'data_type': data_type_name})
+        else:
+            raise error
 
     def pull_data_for_domain(self, api_details):
-        for data_type_name in api_details.keys():
+        """
+            Pulls every data type in api_details. With a data_type_concurrency above 1, data types are pulled
+            concurrently on a worker pool; they share this handler's request budget and API error count, and
+            the first error raised by any data type is re-raised once all of them have finished.
+
+            The stored parameters of every data type are written once at the end, even if a data type failed.
+        """
+        try:
+            if self.data_type_concurrency > 1 and len(api_details) > 1:
+                max_workers = min(self.data_type_concurrency, len(api_details))
+                self.logger.info("Pulling %s data types with %s workers...", len(api_details), max_workers)
+                with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='data-type') as executor:
+                    futures = [executor.submit(self._pull_data_type, data_type_name, api_details[data_type_name]) for data_type_name in api_details.keys()]
+                for future in futures:
+                    future.result()
+            else:
+                for data_type_name in api_details.keys():
+                    self._pull_data_type(data_type_name, api_details[data_type_name])
+        finally:
             try:
-                self._perform_method(self.pull_data, api_details[data_type_name])
-            except ClientError as e:
-                if e.response['Error']['Code'] == 'NoSuchKey':
-                    print(f"Missing stored parameter (i.e. last successful job time, api limit) txt file. Skipping processing for data_type: {data_type_name}...")
-                else:
-                    raise
+                self._save_state()
+            finally:
+                self.metrics.emit()
 
 class CommCareAPIHandlerPush(CommCareAPIHandler):
+
+    """
+        Pushes the payloads stored in S3 for a specifier to CommCareHQ. Payloads are downloaded as they are
+        pushed, so the first is pushed without waiting for the rest. With a push_concurrency above 1, payloads
+        are pushed concurrently, except that payloads changing the same entity are pushed in order.
+    """
+
+    def __init__(self, *args, push_concurrency=DEFAULT_PUSH_CONCURRENCY, **kwargs):
+        # Every worker needs a pooled connection of its own
+        kwargs.setdefault('pool_size', max(DEFAULT_POOL_SIZE, push_concurrency))
+        super().__init__(*args, **kwargs)
+        self.push_concurrency = push_concurrency
+        # Payloads that failed to push concurrently, per specifier, reported in the lambda_handler response
+        self.push_failures = {}
+
     def filepath(self, specifier):
         path = f"""{self.domain}/payload/{specifier}/{self.event_time.strftime('%Y')}/{self.event_time.strftime('%m')}/{self.event_time.strftime('%d')}/{self.event_time.strftime('%H')}/"""
         return path
 
-    def _get_request_content(self, specifier):
+    def _list_payload_keys(self, specifier):
+        """
+            Yields the key of every object stored for the specifier, one page of the listing at a time, so that
+            folders holding more than S3_LIST_MAX_KEYS objects are listed in full.
+        """
         full_path = self.filepath(specifier)
-        print(f"S3 file path: {full_path}...")
-        request_data_arr = []
-        # Parse all files in filepath, add each to post_data_arr as json
-        s3_objects_response = s3.list_objects(Bucket=main_bucket_name, Prefix=full_path)
-        try:
-            folder_contents = s3_objects_response['Contents']
-        except KeyError:
-            print("Folder not found. Likely that the data is intentionally empty.")
+        self.logger.debug("S3 file path: %s...", full_path)
+        list_parameters = {'Bucket': main_bucket_name, 'Prefix': full_path, 'MaxKeys': S3_LIST_MAX_KEYS}
+        while True:
+            s3_objects_response = self._get_s3_client().list_objects_v2(**list_parameters)
+            for object_dict in s3_objects_response.get('Contents', []):
+                yield object_dict['Key']
+            if not s3_objects_response.get('IsTruncated'):
+                return
+            list_parameters['ContinuationToken'] = s3_objects_response['NextContinuationToken']
+
+    def _get_payload(self, key):
+        obj = self._get_s3_client().get_object(Bucket=main_bucket_name, Key=key)
+        if not obj['ContentLength']:
+            self.logger.warning("Found an empty object in folder. This is normal if you created the folder manually in the AWS console.")
             return None
-        for object_dict in folder_contents:
-            obj = s3.get_object(Bucket=main_bucket_name, Key=object_dict['Key'])
-            if not obj['ContentLength']:
-                print("WARNING: Found an empty object in folder. This is normal if you created the folder manually in the AWS console.")
-                continue
-            request_data_arr.append(json.load(obj['Body']))
-        return request_data_arr
+        return json.load(obj['Body'])
 
-    def _make_request(self, data, data_type_name, api_url, request_method):
-        print(f"Data: {data}")
-        response = requests.request(request_method, api_url, headers=self.api_call_headers(), json=data)
+    def _get_request_content(self, specifier):
+        """
+            Yields the payloads stored for the specifier, in the order they are listed, as they are downloaded.
+            Up to PUSH_PREFETCH_COUNT payloads are downloaded ahead of the one being yielded, so that no more
+            than that are held in memory however many files the folder holds.
+        """
+        keys = self._list_payload_keys(specifier)
+        with ThreadPoolExecutor(max_workers=PUSH_PREFETCH_COUNT, thread_name_prefix='prefetch') as executor:
+            downloads = deque(executor.submit(self._get_payload, key) for _, key in zip(range(PUSH_PREFETCH_COUNT), keys))
+            while downloads:
+                data = downloads.popleft().result()
+                key = next(keys, None)
+                if key is not None:
+                    downloads.append(executor.submit(self._get_payload, key))
+                if data is not None:
+                    yield data
+
+    def _make_request(self, data, data_type_name, api_url, request_method, log_fields=None):
+        self.logger.debug("Request data: %s", PayloadSummary(data), extra=log_fields)
+        with self.metrics.time('ApiRequestLatency', data_type_name):
+            response = self._send(lambda: self.transport.request(request_method, api_url, headers=self.api_call_headers(), json=data, timeout=self.request_timeout),
+                                  idempotent=request_method.upper() in IDEMPOTENT_METHODS)
         response_data = process_response(response)
-        print(f"{request_method} successful.")
         if data_type_name == CASE:
-            print(f"Form ID: {response_data.get('form_id')}")
-        print(f"Response data: {response_data}")
+            self.logger.info("%s successful. Form ID: %s", request_method, response_data.get('form_id'), extra=log_fields)
+        else:
+            self.logger.info("%s successful.", request_method, extra=log_fields)
+        self.logger.debug("Response data: %s", PayloadSummary(response_data), extra=log_fields)
 
     def _push_data(self, data_type, specifier):
         data_type_name = data_type['name']
-        print(f"**Beginning data push of data type {data_type_name} for domain: {self.domain}; specifier: {specifier}...")
+        log_fields = {'data_type': data_type_name, 'specifier': specifier}
+        self.logger.info("Beginning data push...", extra=log_fields)
         api_url = self.api_base_url(data_type)
 
-        print(f"Getting data to inculde in request...")
-        request_data_arr = self._get_request_content(specifier)
-        if not request_data_arr:
-            print("Could not find S3 data. Ending processing of data push...")
+        request_content = self._get_request_content(specifier)
+        first_data = next(request_content, None)
+        if first_data is None:
+            self.logger.info("Could not find S3 data. Ending processing of data push...", extra=log_fields)
             return
-        print("Content loaded from S3.")
+        self.logger.info("Starting requests to url: %s", api_url, extra=log_fields)
+        payloads = enumerate(chain([first_data], request_content), start=1)
 
-        print(f"Starting requests to url: {api_url}")
-        request_count = 1
         request_method = data_type['method']
-        for data in request_data_arr:
-            print(f"Making {request_method} request #{request_count} of {len(request_data_arr)}...")
-            self._make_request(data, data_type_name, api_url, request_method)
-            request_count += 1
-        print(f"**All requests done. Processing finished for domain {self.domain}; specifier: {specifier}.")
+        if self.push_concurrency > 1:
+            self.push_failures[specifier] = self._push_concurrently(payloads, data_type_name, api_url, request_method, log_fields)
+            self.logger.info("All requests done. Processing finished with %s failed payloads.", len(self.push_failures[specifier]), extra=log_fields)
+            return
+        request_count = 0
+        for request_count, data in payloads:
+            self.logger.debug("Making %s request #%s...", request_method, request_count, extra=log_fields)
+            self._make_request(data, data_type_name, api_url, request_method, dict(log_fields, request_number=request_count))
+        self.logger.info("All %s requests done. Processing finished.", request_count, extra=log_fields)
+
+    def _get_entity_keys(self, data):
+        """
+            Returns the (field, value) pairs of the cases a payload changes, along with those of the cases its
+            indices point to, so that a child case is pushed after the payload that creates its parent.
+        """
+        keys = []
+        for item in data if isinstance(data, list) else [data]:
+            if not isinstance(item, dict):
+                continue
+            indices = item.get('indices')
+            references = [item] + [index for index in indices.values() if isinstance(index, dict)] if isinstance(indices, dict) else [item]
+            keys.extend((field, reference[field]) for reference in references for field in PUSH_ENTITY_KEY_FIELDS if reference.get(field))
+        return keys
+
+    def _push_concurrently(self, payloads, data_type_name, api_url, request_method, log_fields):
+        """
+            Pushes the (payload number, payload) pairs given as they are read, with up to push_concurrency
+            payloads being pushed at once and as many more read ahead of them. Each payload waits for the pushes
+            of the earlier payloads that change the same entity, so that changes to an entity are never applied
+            out of order. A failed payload does not stop the others, but the later payloads for its entity are
+            skipped. Returns the failures, by payload number.
+        """
+        self.logger.info("Pushing payloads with %s workers...", self.push_concurrency, extra=log_fields)
+        failures = []
+        failures_lock = threading.Lock()
+        # The push of the latest payload read for each entity key
+        last_push_by_key = {}
+
+        def push(number, data, earlier_pushes):
+            """
+                Returns the number of the payload that failed, if this one failed or was skipped because of it.
+            """
+            failed_numbers = [earlier_push.result() for earlier_push in earlier_pushes if earlier_push.result() is not None]
+            if failed_numbers:
+                failure = {'payload': number, 'error': f"Skipped, as payload #{min(failed_numbers)} for the same entity failed."}
+                with failures_lock:
+                    failures.append(failure)
+                return min(failed_numbers)
+            try:
+                self._make_request(data, data_type_name, api_url, request_method, dict(log_fields, request_number=number))
+            except (APIError, *TRANSIENT_REQUEST_ERRORS) as e:
+                self.logger.error("Payload #%s failed to push: %s", number, truncate(e), extra=log_fields)
+                if isinstance(e, APIError) and e.error_code == 401:
+                    invalidate_api_token(self.api_token)
+                with failures_lock:
+                    failures.append({'payload': number, 'error': truncate(e)})
+                return number
+            return None
+
+        with ThreadPoolExecutor(max_workers=self.push_concurrency, thread_name_prefix='push') as executor:
+            pending_pushes = set()
+            for number, data in payloads:
+                entity_keys = self._get_entity_keys(data)
+                earlier_pushes = {last_push_by_key[key] for key in entity_keys if key in last_push_by_key}
+                # A push only waits for pushes submitted before it, which the pool starts first, so it cannot deadlock
+                pending_push = executor.submit(push, number, data, earlier_pushes)
+                for key in entity_keys:
+                    last_push_by_key[key] = pending_push
+                pending_pushes.add(pending_push)
+                if len(pending_pushes) >= self.push_concurrency * 2:
+                    done_pushes, pending_pushes = wait(pending_pushes, return_when=FIRST_COMPLETED)
+                    for done_push in done_pushes:
+                        done_push.result()
+            for pending_push in pending_pushes:
+                pending_push.result()
+        return sorted(failures, key=lambda failure: failure['payload'])
 
     def push_data_for_domain(self, data_type, specifier):
-         self._perform_method(self._push_data, data_type, specifier)
+        try:
+            self._perform_method(self._push_data, data_type, specifier)
+        finally:
+            self.metrics.emit()
@@ -0,0 +1,361 @@
+import asyncio
+import json
+import time
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from requests.exceptions import JSONDecodeError
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from CommCareAPIHandler import CommCareAPIHandlerPull, main_bucket_name
+from const import DEFAULT_CONNECT_TIMEOUT, DEFAULT_MAX_CONCURRENCY, DEFAULT_MAX_PENDING_UPLOADS, DEFAULT_POOL_SIZE, DEFAULT_READ_TIMEOUT, PULL_NOT_STARTED
+from page import Page
+from ratelimit import THROTTLE_STATUS_CODES, AdaptiveConcurrency
+from state import MissingStateError
+from transport import TRANSIENT_REQUEST_ERRORS, get_transport
+from util import APIError
+
+# TRANSIENT_REQUEST_ERRORS, along with the errors raised by AsyncCommCareTransport. The asyncio transport, uploader and
+#   concurrency limit are kept in this module so that the synchronous pull never imports asyncio or aiohttp.
+ASYNC_TRANSIENT_REQUEST_ERRORS = TRANSIENT_REQUEST_ERRORS + (asyncio.TimeoutError,) + ((aiohttp.ClientConnectionError,) if aiohttp else ())
+
+
+class AsyncResponse(object):
+
+    """
+        The parts of a requests.Response that process_response and Page rely on, read from an aiohttp response.
+    """
+
+    def __init__(self, status_code, reason, content, headers=None):
+        self.status_code = status_code
+        self.reason = reason
+        self.content = content
+        self.headers = headers or {}
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def json(self):
+        try:
+            return json.loads(self.content)
+        except ValueError as e:
+            raise JSONDecodeError(str(e), self.content.decode('utf-8', errors='replace'), 0)
+
+
+class AsyncCommCareTransport(object):
+
+    """
+        The asyncio counterpart of CommCareTransport, used by CommCareAPIHandlerPullAsync. Requests go
+        through a pooled aiohttp session when aiohttp is installed. Otherwise each request is run on a worker
+        thread through the shared CommCareTransport, so that requests can still overlap.
+
+        aiohttp sessions belong to the event loop they were opened in, so a transport should be closed
+        before the loop that used it finishes.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=(DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._session = None
+        self._sync_transport = None if aiohttp else get_transport(pool_size)
+
+    def _get_session(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                headers={'Accept-Encoding': 'gzip, deflate'}
+            )
+        return self._session
+
+    def _client_timeout(self, timeout):
+        connect_timeout, read_timeout = timeout or self.timeout
+        return aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+
+    async def get(self, url, headers=None, params=None, timeout=None):
+        if self._sync_transport:
+            return await asyncio.to_thread(self._sync_transport.get, url, headers=headers, params=params, timeout=timeout)
+        params = {key: str(value) for key, value in params.items() if value is not None} if params else None
+        async with self._get_session().get(url, headers=headers, params=params, timeout=self._client_timeout(timeout)) as response:
+            return AsyncResponse(response.status, response.reason, await response.read(), response.headers)
+
+    async def request(self, method, url, headers=None, json=None, timeout=None):
+        if self._sync_transport:
+            return await asyncio.to_thread(self._sync_transport.request, method, url, headers=headers, json=json, timeout=timeout)
+        async with self._get_session().request(method, url, headers=headers, json=json, timeout=self._client_timeout(timeout)) as response:
+            return AsyncResponse(response.status, response.reason, await response.read(), response.headers)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class AsyncUploader(object):
+
+    """
+        The asyncio counterpart of BackgroundUploader. Each upload runs on a worker thread, so that the
+        event loop can keep fetching pages while boto3 writes to S3.
+
+        At most max_pending uploads may be in flight at once; submit() waits for a slot before starting
+        another. With max_pending set to 1, submit() waits for each upload to finish, which keeps the uploads
+        of one data type in order. The first upload error is re-raised on the next submit() or flush().
+    """
+
+    def __init__(self, upload_function, max_pending=DEFAULT_MAX_PENDING_UPLOADS):
+        self.upload_function = upload_function
+        self.max_pending = max_pending
+        self._slots = asyncio.BoundedSemaphore(max_pending)
+        self._tasks = []
+        self._error = None
+
+    async def _upload(self, *args):
+        try:
+            await asyncio.to_thread(self.upload_function, *args)
+        except Exception as e:
+            if self._error is None:
+                self._error = e
+        finally:
+            self._slots.release()
+
+    def raise_if_failed(self):
+        if self._error is not None:
+            raise self._error
+
+    async def submit(self, *args):
+        self.raise_if_failed()
+        await self._slots.acquire()
+        if self.max_pending == 1:
+            await self._upload(*args)
+            self.raise_if_failed()
+        else:
+            self._tasks.append(asyncio.create_task(self._upload(*args)))
+
+    async def flush(self):
+        """
+            Waits for every submitted upload to finish, raising the first upload error if there was one.
+        """
+        await asyncio.gather(*self._tasks)
+        self._tasks = []
+        self.raise_if_failed()
+
+    async def close(self):
+        await asyncio.gather(*self._tasks)
+        self._tasks = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+class AsyncConcurrencyLimit(AdaptiveConcurrency):
+
+    """
+        An AdaptiveConcurrency shared by the coroutines of a single event loop.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release(self, throttled=False):
+        async with self._condition:
+            self.in_flight -= 1
+            self._record(throttled)
+            self._condition.notify_all()
+
+
+
+
+class CommCareAPIHandlerPullAsync(CommCareAPIHandlerPull):
+
+    """
+        Runs the same pull as CommCareAPIHandlerPull on an asyncio event loop. Every data type, and every shard
+        of a sharded data type, is paginated at the same time, with at most max_concurrency requests to
+        CommCareHQ in flight at once across all of them. That limit is halved whenever CommCareHQ throttles a
+        request, and grows back as requests succeed. S3 reads and writes run on worker threads so that
+        they never hold up the event loop.
+    """
+
+    def __init__(self, *args, max_concurrency=DEFAULT_MAX_CONCURRENCY, async_transport=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_concurrency = max_concurrency
+        self.async_transport = async_transport
+        self._request_slots = None
+
+    async def _gather(self, *coroutines):
+        """
+            Runs the coroutines concurrently and waits for all of them to finish, then raises the first error
+            raised by any of them. Returns their results in order.
+        """
+        results = await asyncio.gather(*coroutines, return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return results
+
+    def _get_async_uploader(self):
+        """
+            Returns the uploader used to hand pages to store_in_s3. Without pipelined uploads, each file is
+            written before the next page of its data type is requested.
+        """
+        return AsyncUploader(self.store_in_s3, max_pending=self.max_pending_uploads if self.pipeline_uploads else 1)
+
+    async def _send_async(self, send_request):
+        """
+            The asyncio counterpart of _send: waits on the host's rate limiter and on the adaptive limit on
+            requests in flight, and retries throttled and transiently failed requests.
+        """
+        attempt = 1
+        while True:
+            await self.rate_limiter.acquire_async()
+            await self._request_slots.acquire()
+            response, error = None, None
+            try:
+                response = await send_request()
+            except ASYNC_TRANSIENT_REQUEST_ERRORS as e:
+                error = e
+            finally:
+                await self._request_slots.release(response is not None and response.status_code in THROTTLE_STATUS_CODES)
+            delay_seconds = self._get_retry_delay(response, error, attempt, idempotent=True)
+            if delay_seconds is None:
+                if error is not None:
+                    raise error
+                return response
+            await asyncio.sleep(delay_seconds)
+            attempt += 1
+
+    async def _request_page_async(self, data_type, api_url, params):
+        request_number = self._count_request()
+        log_fields = {'data_type': data_type['name'], 'request_number': request_number}
+        self.logger.debug("Making request to URL: %s with parameters: %s.", api_url, params, extra=log_fields)
+        with self.metrics.time('ApiRequestLatency', data_type['name']):
+            response = await self._send_async(lambda: self.async_transport.get(api_url, headers=self.api_call_headers(), params=params, timeout=self.request_timeout))
+        page = Page.from_response(response, raw=data_type.get('raw_passthrough'))
+        self._record_page_metrics(data_type, page)
+        self.logger.info("Request successful. Received %s objects (%s bytes).", page.object_count, page.size_in_bytes, extra=log_fields)
+        return page
+
+    async def _get_shard_ranges_async(self, data_type, params, start_time, end_time):
+        if not self._uses_shards(data_type):
+            return [(start_time, end_time)]
+        probe_page = await self._request_page_async(data_type, self.api_base_url(data_type), dict(params, limit=1))
+        return self._split_date_range(data_type, params, start_time, end_time, probe_page.meta['total_count'])
+
+    async def _submit_files(self, uploader, files):
+        while files:
+            await uploader.submit(*files.pop(0))
+
+    async def _paginate_async(self, data_type, params, uploader, initial_start_time, initial_end_time, checkpoint=None, parent_checkpoint=None):
+        api_url = self.api_base_url(data_type)
+        if checkpoint and checkpoint['cursor']:
+            api_url, params = api_url + checkpoint['cursor'], None
+        ready_files = []
+        roller = self._get_file_roller(data_type, lambda *file: ready_files.append(file), checkpoint['files_written'] if checkpoint else 0)
+        page_count = 0
+        while api_url:
+            if self._is_deadline_reached():
+                self.logger.warning("Stopping pagination, as the next page would not finish before the deadline.", extra={'data_type': data_type['name']})
+                roller.flush()
+                await self._submit_files(uploader, ready_files)
+                await uploader.flush()
+                if checkpoint is not None:
+                    self._update_checkpoint(data_type, checkpoint, api_url, params, roller)
+                    await asyncio.to_thread(self._save_checkpoint, data_type['name'], parent_checkpoint or checkpoint)
+                return False
+            page_start_time = time.monotonic()
+            page = await self._request_page_async(data_type, api_url, params)
+            api_url, params, file_start, file_end = self._prepare_next_request(data_type, page, params, initial_start_time, initial_end_time)
+            if page.object_count:
+                roller.add(page, file_start, file_end, self._get_file_size_in_bytes(data_type, page))
+            page_count += 1
+            if self._is_checkpoint_due(data_type, checkpoint, api_url, page_count):
+                roller.flush()
+                await self._submit_files(uploader, ready_files)
+                await uploader.flush()
+                self._update_checkpoint(data_type, checkpoint, api_url, params, roller)
+                await asyncio.to_thread(self._save_checkpoint, data_type['name'], parent_checkpoint or checkpoint)
+            await self._submit_files(uploader, ready_files)
+            self._record_page_time(page_start_time)
+        roller.flush()
+        await self._submit_files(uploader, ready_files)
+        return True
+
+    async def _paginate_shard_async(self, data_type, params, uploader, initial_start_time, initial_end_time, checkpoint, shard):
+        completed = await self._paginate_async(data_type, self._get_shard_params(params, shard), uploader, initial_start_time, initial_end_time, shard if checkpoint is not None else None, checkpoint)
+        return self._finish_shard(shard, completed)
+
+    async def pull_data_async(self, data_type):
+        data_type_name = data_type['name']
+        if self._is_deadline_reached():
+            self.logger.warning("Not starting processing, as there is not enough time left before the deadline.", extra={'data_type': data_type_name})
+            self.data_type_statuses[data_type_name] = PULL_NOT_STARTED
+            return
+        initial_start_time, initial_end_time, params, checkpoint = await asyncio.to_thread(self._start_pull, data_type)
+
+        self.logger.info("Starting processing. Storing in bucket: %s with filepath: %s.", main_bucket_name, self.filepath(data_type_name), extra={'data_type': data_type_name})
+        async with self._get_async_uploader() as uploader:
+            shards = self._get_resumed_shards(checkpoint)
+            if shards is None:
+                shard_ranges = [(initial_start_time, initial_end_time)]
+                if not (checkpoint and checkpoint['cursor']):
+                    shard_ranges = await self._get_shard_ranges_async(data_type, params, initial_start_time, initial_end_time)
+                shards = self._start_shards(checkpoint, shard_ranges)
+            if shards is not None:
+                completed = all(await self._gather(*[
+                    self._paginate_shard_async(data_type, params, uploader, initial_start_time, initial_end_time, checkpoint, shard)
+                    for shard in shards
+                ]))
+            else:
+                completed = await self._paginate_async(data_type, params, uploader, initial_start_time, initial_end_time, checkpoint)
+            await uploader.flush()
+
+        self.logger.info("Processing finished. API handler has made %s requests in total.", self.request_count, extra={'data_type': data_type_name})
+        await asyncio.to_thread(self._finish_pull, data_type, initial_end_time, checkpoint, completed)
+
+    async def _pull_data_type_async(self, data_type_name, data_type):
+        try:
+            with self.metrics.time('PullDuration', data_type_name):
+                await self.pull_data_async(data_type)
+        except APIError as e:
+            self._handle_api_error(e, data_type)
+        except (ClientError, MissingStateError) as e:
+            self._handle_client_error(e, data_type_name)
+
+    async def pull_data_for_domain_async(self, api_details):
+        """
+            Pulls every data type in api_details concurrently. The first error raised by any data type is
+            re-raised once all of them have finished. The stored parameters of every data type are written
+            once at the end.
+        """
+        self._request_slots = AsyncConcurrencyLimit(self.max_concurrency)
+        # Worker threads run S3 calls, and requests too when aiohttp is not installed
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=self.max_concurrency + self.max_pending_uploads, thread_name_prefix='async-pull'))
+        owns_transport = self.async_transport is None
+        if owns_transport:
+            self.async_transport = AsyncCommCareTransport(pool_size=self.max_concurrency)
+        self.logger.info("Pulling %s data types with at most %s requests in flight...", len(api_details), self.max_concurrency)
+        try:
+            await self._gather(*[self._pull_data_type_async(data_type_name, api_details[data_type_name]) for data_type_name in api_details.keys()])
+        finally:
+            if owns_transport:
+                await self.async_transport.close()
+                self.async_transport = None
+            try:
+                await asyncio.to_thread(self._save_state)
+            finally:
+                self.metrics.emit()
+
+    def pull_data_for_domain(self, api_details):
+        asyncio.run(self.pull_data_for_domain_async(api_details))
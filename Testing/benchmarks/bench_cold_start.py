@@ -0,0 +1,144 @@
+"""
+    Measures cold start latency: the time from a fresh Python process importing lambda_function to the first
+    response from CommCareHQ, and to the end of the invocation.
+
+    Each run starts a new interpreter, so nothing is cached between runs, and invokes lambda_handler for a
+    single-page pull. The timed path includes everything before the first request: the API token lookup in
+    SSM and the state manifest read from S3. Clients are created with boto3 as in Lambda, but their calls go
+    to in-process stand-ins, and a local HTTP server stands in for CommCareHQ. "lazy" runs leave the clients to
+    be created on first use, as lambda_handler does; "eager" runs create them right after the import, as the
+    modules used to at import time.
+
+    Usage:
+        py -m testing.benchmarks.bench_cold_start --runs 10 --output bench_output.txt
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from testing.benchmarks.bench_transport import make_server
+
+CHILD_SCRIPT = '''
+import json
+import sys
+import time
+start = time.perf_counter()
+import lambda_function
+imported = time.perf_counter()
+
+import CommCareAPIHandler
+import transport
+from clients import get_s3_client, get_ssm_client, set_client_factory
+from testing.benchmarks.fake_s3 import FakeS3Client
+
+
+class FakeSSMClient(object):
+
+    def get_parameter(self, Name):
+        return {'ResponseMetadata': {'HTTPStatusCode': 200}, 'Parameter': {'Name': Name, 'Value': 'bench-api-key'}}
+
+
+def create_client(service_name):
+    # The real client is created for its cost, but calls go to the stand-in
+    import boto3
+    boto3.client(service_name)
+    return stand_ins[service_name]
+
+
+stand_ins = {'s3': FakeS3Client(), 'ssm': FakeSSMClient()}
+state = {'data_types': {'case': {'last_successful_job_time': '2024-01-01T00:00:00'}}}
+stand_ins['s3'].put_object(Body=json.dumps(state), Bucket=CommCareAPIHandler.main_bucket_name, Key='bench/snowflake-copy/state.json')
+CommCareAPIHandler.base_commcare_url = sys.argv[1]
+first_responses = []
+transport_get = transport.CommCareTransport.get
+
+
+def timed_get(self, *args, **kwargs):
+    response = transport_get(self, *args, **kwargs)
+    first_responses.append(time.perf_counter())
+    return response
+
+
+transport.CommCareTransport.get = timed_get
+set_client_factory(create_client)
+setup_seconds = time.perf_counter() - imported
+
+clients_start = time.perf_counter()
+if sys.argv[2] == 'eager':
+    get_s3_client()
+    get_ssm_client()
+clients_created = time.perf_counter()
+event = {
+    'domain': 'bench',
+    'operation_type': 'cc_to_s3',
+    'use_lag': 0,
+    'log_level': 'WARNING',
+    'api_info': {'case': {'name': 'case', 'version': 'v0.5', 'limit': 1}}
+}
+response = lambda_function.lambda_handler(event, None)
+finished = time.perf_counter()
+assert response['statusCode'] == 200, response
+# The stand-ins are set up between the import and the invocation, so their time is left out
+print(json.dumps({
+    'import_seconds': imported - start,
+    'client_seconds': clients_created - clients_start,
+    'first_request_seconds': first_responses[0] - start - setup_seconds,
+    'handler_seconds': finished - start - setup_seconds
+}))
+'''
+
+
+def time_cold_start(url, mode):
+    # boto3 needs a region to create clients; any region will do, as no AWS call is made
+    env = dict(os.environ, AWS_DEFAULT_REGION=os.environ.get('AWS_DEFAULT_REGION', 'us-east-1'))
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', CHILD_SCRIPT, url, mode], env=env, capture_output=True, text=True, check=True).stdout
+    process_seconds = time.perf_counter() - start
+    # The invocation prints its metrics too; the run's timings are the last line
+    return dict(json.loads(output.strip().splitlines()[-1]), process_seconds=process_seconds)
+
+
+def summarize(timings):
+    return {
+        f"median_{name}": round(statistics.median(timing[name] for timing in timings), 4)
+        for name in ('import_seconds', 'client_seconds', 'first_request_seconds', 'handler_seconds', 'process_seconds')
+    }
+
+
+def run(runs):
+    server = make_server(0, 1000)
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        lazy_timings = [time_cold_start(url, 'lazy') for _ in range(runs)]
+        eager_timings = [time_cold_start(url, 'eager') for _ in range(runs)]
+    finally:
+        server.shutdown()
+    lazy = summarize(lazy_timings)
+    eager = summarize(eager_timings)
+    return {
+        'benchmark': 'cold_start',
+        'runs': runs,
+        'lazy': lazy,
+        'eager': eager,
+        'first_request_seconds_saved': round(eager['median_first_request_seconds'] - lazy['median_first_request_seconds'], 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--output', help="Append the JSON result to this file as well as printing it.")
+    args = parser.parse_args()
+    result = json.dumps(run(args.runs))
+    print(result)
+    if args.output:
+        with open(args.output, 'a') as output_file:
+            output_file.write(result + '\n')
+
+
+if __name__ == '__main__':
+    main()
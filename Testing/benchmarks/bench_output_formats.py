@@ -0,0 +1,101 @@
+"""
+    Compares the bytes written and the conversion cost of each output format and compression for pulled files.
+
+    Pages of synthetic case or form objects are encoded the same way CommCareAPIHandlerPull.store_in_s3 encodes
+    them. Parquet results are only included when pyarrow is installed, and zstd results when zstandard is.
+
+    Usage:
+        py -m testing.benchmarks.bench_output_formats --data-type form --objects 2000 --output bench_output.txt
+"""
+import argparse
+import importlib.util
+import json
+import random
+import time
+
+from output import GZIP, JSON, NDJSON, PARQUET, ZSTD, ParquetEncoder, encode_file
+from page import Page
+
+
+def make_object(data_type_name, index, properties):
+    indexed_on = f"2024-01-01T00:{index // 60 % 60:02d}:{index % 60:02d}.000000Z"
+    values = {f"question_{number}": random.choice(['yes', 'no', str(random.randint(0, 1000)), 'free text ' * 5]) for number in range(properties)}
+    if data_type_name == 'form':
+        return {
+            'id': f"form-{index}",
+            'indexed_on': indexed_on,
+            'received_on': indexed_on,
+            'form': dict(values, meta={'userID': 'user', 'timeStart': indexed_on, 'timeEnd': indexed_on}),
+            'metadata': {'app_build_version': 12, 'deviceID': 'device'},
+        }
+    return {
+        'id': f"case-{index}",
+        'indexed_on': indexed_on,
+        'case_type': 'patient',
+        'closed': False,
+        'properties': values,
+        'indices': {},
+    }
+
+
+def make_pages(data_type_name, object_count, page_size, properties):
+    pages = []
+    for start in range(0, object_count, page_size):
+        objects = [make_object(data_type_name, index, properties) for index in range(start, min(start + page_size, object_count))]
+        data = {'meta': {'limit': page_size, 'next': None, 'total_count': len(objects)}, 'objects': objects}
+        pages.append(Page(data['meta'], len(json.dumps(data).encode('utf-8')), data=data))
+    return pages
+
+
+def run(data_type_name, object_count, page_size, properties, repeat):
+    random.seed(0)
+    pages = make_pages(data_type_name, object_count, page_size, properties)
+    encoders = {
+        f"{JSON}": lambda: encode_file(pages, JSON),
+        f"{JSON}.{GZIP}": lambda: encode_file(pages, JSON, GZIP),
+        f"{NDJSON}": lambda: encode_file(pages, NDJSON),
+        f"{NDJSON}.{GZIP}": lambda: encode_file(pages, NDJSON, GZIP),
+    }
+    if importlib.util.find_spec('zstandard'):
+        encoders[f"{JSON}.{ZSTD}"] = lambda: encode_file(pages, JSON, ZSTD)
+    if importlib.util.find_spec('pyarrow'):
+        encoders[f"{PARQUET}.snappy"] = lambda: ParquetEncoder().encode(pages)
+        encoders[f"{PARQUET}.{ZSTD}"] = lambda: ParquetEncoder(compression=ZSTD).encode(pages)
+        encoders[f"{PARQUET}.flattened.snappy"] = lambda: ParquetEncoder(flatten=True).encode(pages)
+    formats = {}
+    for name, encode in encoders.items():
+        start = time.perf_counter()
+        for _ in range(repeat):
+            body = encode()
+        formats[name] = {
+            'bytes': body.getbuffer().nbytes,
+            'seconds_per_file': round((time.perf_counter() - start) / repeat, 4),
+        }
+    return {
+        'benchmark': 'output_formats',
+        'data_type': data_type_name,
+        'objects': object_count,
+        'page_size': page_size,
+        'input_bytes': sum(page.size_in_bytes for page in pages),
+        'formats': formats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data-type', choices=['case', 'form'], default='case')
+    parser.add_argument('--objects', type=int, default=2000)
+    parser.add_argument('--page-size', type=int, default=500)
+    parser.add_argument('--properties', type=int, default=30, help="Case properties or form questions per object.")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help="Append the JSON result to this file as well as printing it.")
+    args = parser.parse_args()
+    result = json.dumps(run(args.data_type, args.objects, args.page_size, args.properties, args.repeat))
+    print(result)
+    if args.output:
+        with open(args.output, 'a') as output_file:
+            output_file.write(result + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""
+    Measures the throughput of CommCareAPIHandlerPull.pull_data_for_domain, for every combination of the
+    given page sizes and pull modes, against a fake CommCareHQ and an in-process S3 stand-in.
+
+    Modes:
+        sync        data types pulled one after the other, each page uploaded before the next is requested
+        pipelined   as sync, with uploads to S3 running in the background
+        concurrent  data types pulled at the same time on a worker pool
+        sharded     as sync, with the indexed_on range of case and form split into 4 shards
+        async       the async pull engine (CommCareAPIHandlerPullAsync)
+
+    Each case runs in a fresh Python process, so that its peak RSS is its own. Reported per case: pages and
+    MB per second, peak RSS, and the number of S3 PUTs made.
+
+    Usage:
+        py -m testing.benchmarks.bench_pull --objects 20000 --object-bytes 1000 --page-sizes 100,1000 --modes sync,async --output bench_output.txt
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from testing.benchmarks.fake_commcare import DISTRIBUTIONS, make_fake_commcare_server, make_objects
+
+DOMAIN = 'bench'
+MODES = ('sync', 'pipelined', 'concurrent', 'sharded', 'async')
+DATA_TYPE_NAMES = ('case', 'form', 'action_times')
+# The time window pulled: from the last successful job time seeded in the state manifest to the event time
+WINDOW_START = datetime(2024, 1, 1)
+WINDOW_END = datetime(2024, 1, 2)
+
+
+def get_api_info(data_type_names, page_size, mode):
+    api_info = {}
+    for data_type_name in data_type_names:
+        data_type = {'name': data_type_name, 'version': 'v0.5', 'limit': page_size}
+        if data_type_name != 'action_times':
+            data_type['uses_indexed_on'] = True
+            if mode == 'sharded':
+                data_type['shard_count'] = 4
+        api_info[data_type_name] = data_type
+    return api_info
+
+
+def get_peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        # resource is not available on Windows
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, and in kilobytes elsewhere
+    return round(peak_rss / (1000000 if sys.platform == 'darwin' else 1000), 1)
+
+
+def run_case(base_url, mode, page_size, data_type_names):
+    """
+        Runs a single pull in this process. Called in a child process started by run_case_in_subprocess.
+    """
+    import CommCareAPIHandler
+    from clients import set_client_factory
+    from log import configure_logging
+    from testing.benchmarks.fake_s3 import FakeS3Client
+
+    configure_logging('WARNING')
+    CommCareAPIHandler.base_commcare_url = base_url
+    s3 = FakeS3Client()
+    set_client_factory(lambda service_name: s3)
+    state = {'data_types': {name: {'last_successful_job_time': WINDOW_START.isoformat()} for name in data_type_names}}
+    s3.put_object(Body=json.dumps(state), Bucket=CommCareAPIHandler.main_bucket_name, Key=f"{DOMAIN}/snowflake-copy/state.json")
+    s3.call_counts.clear()
+    s3.put_bytes = 0
+
+    options = {'pipeline_uploads': mode == 'pipelined', 'data_type_concurrency': len(data_type_names) if mode == 'concurrent' else 1}
+    handler_class = CommCareAPIHandler.CommCareAPIHandlerPull
+    if mode == 'async':
+        from CommCareAPIHandlerAsync import CommCareAPIHandlerPullAsync
+        handler_class = CommCareAPIHandlerPullAsync
+        options = {}
+    api_handler = handler_class(False, DOMAIN, 'bench-api-key', WINDOW_END, request_limit=1000000, use_lag=False, **options)
+
+    start = time.perf_counter()
+    api_handler.pull_data_for_domain(get_api_info(data_type_names, page_size, mode))
+    seconds = time.perf_counter() - start
+
+    data_type_metrics = api_handler.metrics.summary()['data_types'].values()
+    pages = sum(metrics['Pages']['count'] for metrics in data_type_metrics if 'Pages' in metrics)
+    mb = sum(metrics['PageBytes']['sum'] for metrics in data_type_metrics if 'PageBytes' in metrics) / 1000000
+    return {
+        'mode': mode,
+        'page_size': page_size,
+        'seconds': round(seconds, 4),
+        'requests': api_handler.request_count,
+        'pages': pages,
+        'mb': round(mb, 3),
+        'pages_per_second': round(pages / seconds, 2),
+        'mb_per_second': round(mb / seconds, 3),
+        'peak_rss_mb': get_peak_rss_mb(),
+        's3_put_count': s3.call_counts['put_object'],
+        's3_put_mb': round(s3.put_bytes / 1000000, 3),
+    }
+
+
+def run_case_in_subprocess(base_url, mode, page_size, data_type_names):
+    case = json.dumps({'base_url': base_url, 'mode': mode, 'page_size': page_size, 'data_type_names': data_type_names})
+    output = subprocess.run([sys.executable, '-m', __spec__.name, '--run-case', case], capture_output=True, text=True, check=True).stdout
+    # The pull prints its metrics too; the case's result is the last line
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(object_count, object_bytes, latency_ms, distribution, page_sizes, modes, data_type_names):
+    objects_by_data_type = {
+        data_type_name: make_objects(data_type_name, object_count, object_bytes, WINDOW_START, WINDOW_END, distribution)
+        for data_type_name in data_type_names
+    }
+    server = make_fake_commcare_server(objects_by_data_type, latency_ms / 1000)
+    try:
+        results = [run_case_in_subprocess(server.url, mode, page_size, data_type_names) for page_size in page_sizes for mode in modes]
+    finally:
+        server.shutdown()
+    return {
+        'benchmark': 'pull',
+        'objects_per_data_type': object_count,
+        'object_bytes': object_bytes,
+        'latency_ms': latency_ms,
+        'distribution': distribution,
+        'data_types': data_type_names,
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--objects', type=int, default=5000, help="Number of objects served per data type.")
+    parser.add_argument('--object-bytes', type=int, default=1000)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--distribution', choices=DISTRIBUTIONS, default='uniform')
+    parser.add_argument('--page-sizes', default='100,1000')
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--data-types', default=','.join(DATA_TYPE_NAMES))
+    parser.add_argument('--output', help="Append the JSON result to this file as well as printing it.")
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run_case:
+        print(json.dumps(run_case(**json.loads(args.run_case))))
+        return
+    modes = args.modes.split(',')
+    if any(mode not in MODES for mode in modes):
+        parser.error(f"--modes must be a subset of: {', '.join(MODES)}")
+    result = json.dumps(run(args.objects, args.object_bytes, args.latency_ms, args.distribution,
+                            [int(page_size) for page_size in args.page_sizes.split(',')], modes, args.data_types.split(',')))
+    print(result)
+    if args.output:
+        with open(args.output, 'a') as output_file:
+            output_file.write(result + '\n')
+
+
+if __name__ == '__main__':
+    main()
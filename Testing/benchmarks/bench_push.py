@@ -0,0 +1,159 @@
+"""
+    Measures CommCareAPIHandlerPush.push_data_for_domain: an S3 stand-in is seeded with --payloads payload
+    files of about --payload-bytes each, under the {domain}/payload/{specifier}/Y/m/d/H/ prefix of the hour
+    being pushed, and every push mode pushes them to a fake CommCareHQ with the given latency and error rate.
+
+    Modes:
+        serial      payloads sent one after the other
+        concurrent  payloads sent by 8 workers, with payloads for the same case sent in order
+                    (--payloads-per-case sets how many consecutive payloads update the same case)
+
+    Each mode runs in a fresh Python process, so that its peak RSS is its own (the seeded payloads, which the
+    in-process S3 stand-in holds in memory, are included in it). Reported per mode: requests per second, the
+    latency distribution of push requests (including any retries), peak RSS, and how many payloads were
+    accepted by the fake CommCareHQ.
+
+    Usage:
+        py -m testing.benchmarks.bench_push --payloads 500 --payload-bytes 5000 --latency-ms 50 --error-rate 0.02 --output bench_output.txt
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from testing.benchmarks.bench_pull import get_peak_rss_mb
+from testing.benchmarks.fake_commcare import make_fake_commcare_server
+
+DOMAIN = 'bench'
+SPECIFIER = 'bench-specifier'
+# Options given to CommCareAPIHandlerPush for each push mode
+PUSH_MODES = {
+    'serial': {},
+    'concurrent': {'push_concurrency': 8},
+}
+# The hour whose payloads are pushed
+EVENT_TIME = datetime(2024, 1, 1, 0)
+
+
+def make_payload(index, payload_bytes, payloads_per_case):
+    return {
+        'case_id': f"case-{index // payloads_per_case}",
+        'case_type': 'patient',
+        'case_name': f"Patient {index // payloads_per_case}",
+        'owner_id': 'bench-owner',
+        'properties': {'notes': 'x' * payload_bytes}
+    }
+
+
+def summarize_latencies(latencies_ms):
+    if not latencies_ms:
+        return {}
+    percentiles = statistics.quantiles(latencies_ms, n=100) if len(latencies_ms) > 1 else latencies_ms * 99
+    return {
+        'p50_ms': round(percentiles[49], 2),
+        'p90_ms': round(percentiles[89], 2),
+        'p99_ms': round(percentiles[98], 2),
+        'max_ms': round(max(latencies_ms), 2),
+        'mean_ms': round(statistics.mean(latencies_ms), 2),
+    }
+
+
+def run_mode(base_url, mode, payload_count, payload_bytes, payloads_per_case):
+    """
+        Seeds the payloads and runs a single push in this process. Called in a child process started by
+        run_mode_in_subprocess.
+    """
+    import CommCareAPIHandler
+    from clients import set_client_factory
+    from log import configure_logging
+    from testing.benchmarks.fake_s3 import FakeS3Client
+
+    configure_logging('WARNING')
+    CommCareAPIHandler.base_commcare_url = base_url
+    s3 = FakeS3Client()
+    set_client_factory(lambda service_name: s3)
+    api_handler = CommCareAPIHandler.CommCareAPIHandlerPush(False, DOMAIN, 'bench-api-key', EVENT_TIME, request_limit=1000000, **PUSH_MODES[mode])
+    prefix = api_handler.filepath(SPECIFIER)
+    for index in range(payload_count):
+        s3.put_object(Body=json.dumps(make_payload(index, payload_bytes, payloads_per_case)), Bucket=CommCareAPIHandler.main_bucket_name, Key=f"{prefix}payload_{index:06d}.json")
+
+    error = None
+    start = time.perf_counter()
+    try:
+        api_handler.push_data_for_domain({'name': 'case', 'version': 'v0.6', 'method': 'POST'}, SPECIFIER)
+    except Exception as e:
+        error = str(e)
+    seconds = time.perf_counter() - start
+
+    latencies_ms = api_handler.metrics.values.get('case', {}).get('ApiRequestLatency', [])
+    return {
+        'mode': mode,
+        'seconds': round(seconds, 4),
+        'requests': len(latencies_ms) + api_handler.retry_count,
+        'requests_per_second': round((len(latencies_ms) + api_handler.retry_count) / seconds, 2),
+        'retries': api_handler.retry_count,
+        'latency': summarize_latencies(latencies_ms),
+        'peak_rss_mb': get_peak_rss_mb(),
+        'error': error,
+        'failed_payloads': len(api_handler.push_failures.get(SPECIFIER, [])),
+    }
+
+
+def run_mode_in_subprocess(server, mode, payload_count, payload_bytes, payloads_per_case):
+    push_count = server.push_count
+    case = json.dumps({'base_url': server.url, 'mode': mode, 'payload_count': payload_count, 'payload_bytes': payload_bytes, 'payloads_per_case': payloads_per_case})
+    output = subprocess.run([sys.executable, '-m', __spec__.name, '--run-mode', case], capture_output=True, text=True, check=True).stdout
+    # The push prints its metrics too; the mode's result is the last line
+    return dict(json.loads(output.strip().splitlines()[-1]), payloads_accepted=server.push_count - push_count)
+
+
+def run(payload_count, payload_bytes, payloads_per_case, latency_ms, error_rate, error_status_code, modes, seed):
+    server = make_fake_commcare_server(latency_seconds=latency_ms / 1000, error_rate=error_rate, error_status_code=error_status_code, seed=seed)
+    try:
+        results = [run_mode_in_subprocess(server, mode, payload_count, payload_bytes, payloads_per_case) for mode in modes]
+    finally:
+        server.shutdown()
+    return {
+        'benchmark': 'push',
+        'payloads': payload_count,
+        'payload_bytes': payload_bytes,
+        'payloads_per_case': payloads_per_case,
+        'latency_ms': latency_ms,
+        'error_rate': error_rate,
+        'error_status_code': error_status_code,
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--payloads', type=int, default=200, help="Number of payload files seeded for the hour being pushed.")
+    parser.add_argument('--payload-bytes', type=int, default=2000)
+    parser.add_argument('--payloads-per-case', type=int, default=1, help="Number of consecutive payloads updating the same case.")
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--error-rate', type=float, default=0, help="Share of requests the fake CommCareHQ fails.")
+    parser.add_argument('--error-status-code', type=int, default=429,
+                        help="Status code of failed requests. 429 is retried; 5xx fails the push, as pushes are not idempotent.")
+    parser.add_argument('--modes', default=','.join(PUSH_MODES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Append the JSON result to this file as well as printing it.")
+    parser.add_argument('--run-mode', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run_mode:
+        print(json.dumps(run_mode(**json.loads(args.run_mode))))
+        return
+    modes = args.modes.split(',')
+    if any(mode not in PUSH_MODES for mode in modes):
+        parser.error(f"--modes must be a subset of: {', '.join(PUSH_MODES)}")
+    result = json.dumps(run(args.payloads, args.payload_bytes, args.payloads_per_case, args.latency_ms, args.error_rate, args.error_status_code, modes, args.seed))
+    print(result)
+    if args.output:
+        with open(args.output, 'a') as output_file:
+            output_file.write(result + '\n')
+
+
+if __name__ == '__main__':
+    main()
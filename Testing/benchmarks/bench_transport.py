@@ -0,0 +1,91 @@
+"""
+    Compares bare requests.get calls against the pooled CommCareTransport for a series of page requests.
+
+    A local HTTP/1.1 server stands in for CommCareHQ. Each new connection is delayed by --handshake-ms to
+    model the TCP+TLS setup that a request against commcarehq.org pays when its connection is not reused.
+
+    Usage:
+        py -m testing.benchmarks.bench_transport --pages 200 --handshake-ms 30 --output bench_output.txt
+"""
+import argparse
+import json
+import threading
+import time
+import requests
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from transport import CommCareTransport
+
+
+def make_server(handshake_seconds, page_bytes):
+    body = json.dumps({
+        'meta': {'limit': 1, 'next': None, 'total_count': 1},
+        'objects': [{'indexed_on': '2024-01-01T00:00:00.000000Z', 'padding': 'x' * page_bytes}]
+    }).encode('utf-8')
+
+    class PageHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            time.sleep(handshake_seconds)
+            super().setup()
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), PageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def time_requests(get, url, pages):
+    start = time.perf_counter()
+    for _ in range(pages):
+        get(url).raise_for_status()
+    return time.perf_counter() - start
+
+
+def run(pages, handshake_ms, page_bytes):
+    server = make_server(handshake_ms / 1000, page_bytes)
+    url = f"http://127.0.0.1:{server.server_address[1]}/a/bench/api/v0.5/case/"
+    try:
+        bare_seconds = time_requests(lambda u: requests.get(u, timeout=30), url, pages)
+        pooled_transport = CommCareTransport()
+        pooled_seconds = time_requests(pooled_transport.get, url, pages)
+        pooled_transport.close()
+    finally:
+        server.shutdown()
+    return {
+        'benchmark': 'transport',
+        'pages': pages,
+        'handshake_ms': handshake_ms,
+        'page_bytes': page_bytes,
+        'bare_requests_seconds': round(bare_seconds, 4),
+        'pooled_transport_seconds': round(pooled_seconds, 4),
+        'speedup': round(bare_seconds / pooled_seconds, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--handshake-ms', type=float, default=30)
+    parser.add_argument('--page-bytes', type=int, default=100000)
+    parser.add_argument('--output', help="Append the JSON result to this file as well as printing it.")
+    args = parser.parse_args()
+    result = json.dumps(run(args.pages, args.handshake_ms, args.page_bytes))
+    print(result)
+    if args.output:
+        with open(args.output, 'a') as output_file:
+            output_file.write(result + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+    A local HTTP stand-in for the CommCareHQ case, form and action_times APIs, for benchmarks.
+
+    Each data type serves a fixed set of generated objects, sorted by indexed_on. Requests with an
+    indexed_on_start are answered like CommCareHQ answers them: the objects indexed on or after the start
+    (and up to indexed_on_end), at most limit of them, with a "next" cursor while there are more. Other
+    requests, and requests for a "next" cursor, page through the objects by offset.
+
+    POST, PUT and PATCH requests to any data type's API, as made by pushes, are accepted and answered with
+    a form ID. Every request is delayed by the server's latency, to model the time CommCareHQ takes to
+    answer, and a share of requests (error_rate) can be failed with error_status_code.
+"""
+import bisect
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+INDEXED_ON_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+# Ways objects can be spread over the time window: evenly, or mostly towards its end, as when a burst of
+#   recent changes lands in the last hours before a pull
+DISTRIBUTIONS = ('uniform', 'skewed')
+
+_api_path_pattern = re.compile(r'^/a/(?P<domain>[^/]+)/api/(?P<version>[^/]+)/(?P<data_type>[^/]+)/$')
+
+
+def make_object(data_type_name, index, indexed_on, object_bytes):
+    padding = 'x' * object_bytes
+    indexed_on = indexed_on.strftime(INDEXED_ON_FORMAT)
+    if data_type_name == 'case':
+        return {'id': f"case-{index}", 'case_id': f"case-{index}", 'indexed_on': indexed_on, 'properties': {'case_type': 'patient', 'notes': padding}}
+    if data_type_name == 'form':
+        return {'id': f"form-{index}", 'indexed_on': indexed_on, 'form': {'@name': 'Visit', 'notes': padding}}
+    return {'id': f"action-{index}", 'UTC_start_time': indexed_on, 'indexed_on': indexed_on, 'action': 'visit', 'notes': padding}
+
+
+def make_objects(data_type_name, count, object_bytes, window_start, window_end, distribution='uniform'):
+    """
+        Generates count objects of about object_bytes each, indexed on strictly increasing times between
+        window_start and window_end.
+    """
+    if distribution not in DISTRIBUTIONS:
+        raise ValueError(f"Unsupported distribution: {distribution}. Expected one of: {', '.join(DISTRIBUTIONS)}.")
+    span = (window_end - window_start) - timedelta(microseconds=count)
+    objects = []
+    for index in range(count):
+        position = index / count
+        if distribution == 'skewed':
+            position = 1 - (1 - position) ** 3
+        objects.append(make_object(data_type_name, index, window_start + span * position + timedelta(microseconds=index), object_bytes))
+    return objects
+
+
+class FakeDataType(object):
+
+    def __init__(self, objects):
+        self.indexed_on = [datetime.strptime(obj['indexed_on'], INDEXED_ON_FORMAT) for obj in objects]
+        # Objects are serialized once, so that answering a request only joins bytes
+        self.serialized_objects = [json.dumps(obj).encode('utf-8') for obj in objects]
+
+    def get_page(self, query):
+        limit = int(query.get('limit', 20))
+        if 'indexed_on_start' in query and 'offset' not in query:
+            start = bisect.bisect_left(self.indexed_on, datetime.fromisoformat(query['indexed_on_start'].rstrip('Z')))
+            end = bisect.bisect_right(self.indexed_on, datetime.fromisoformat(query['indexed_on_end'].rstrip('Z'))) if 'indexed_on_end' in query else len(self.indexed_on)
+            offset, cursor_query = start, {'indexed_on_start': query['indexed_on_start']}
+        else:
+            start, end = 0, len(self.indexed_on)
+            offset, cursor_query = start + int(query.get('offset', 0)), {}
+        page_end = min(offset + limit, end)
+        next_cursor = None
+        if page_end < end:
+            next_cursor = '?' + urlencode(dict(cursor_query, limit=limit, offset=page_end - start))
+        meta = {'limit': limit, 'next': next_cursor, 'offset': offset - start, 'total_count': max(end - start, 0)}
+        return b'{"meta": ' + json.dumps(meta).encode('utf-8') + b', "objects": [' + b', '.join(self.serialized_objects[offset:page_end]) + b']}'
+
+
+def make_fake_commcare_server(objects_by_data_type=None, latency_seconds=0, error_rate=0, error_status_code=500, seed=None):
+    """
+        Starts a fake CommCareHQ serving the given objects per data type name on a free local port. The
+        server's url attribute is the base URL to use in place of https://www.commcarehq.org. Its
+        request_count, error_count and push_count attributes count the requests it has answered, failed,
+        and accepted as pushes.
+    """
+    data_types = {name: FakeDataType(objects) for name, objects in (objects_by_data_type or {}).items()}
+    # Decides which requests fail; seeded so that runs can be compared
+    error_random = random.Random(seed)
+
+    class FakeCommCareHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body are written separately; without this, delayed ACKs add 40ms to every response
+        disable_nagle_algorithm = True
+
+        def _start_request(self):
+            """
+                Counts and delays the request. Returns the API path match and the request body, or (None, None)
+                if the request was answered with an error.
+            """
+            match = _api_path_pattern.match(urlparse(self.path).path)
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if match is None:
+                self._send(404, b'{"error": "Not found."}')
+                return None, None
+            with server.lock:
+                server.request_count += 1
+                failed = error_random.random() < error_rate
+                if failed:
+                    server.error_count += 1
+            time.sleep(latency_seconds)
+            if failed:
+                # Throttled requests may be retried straight away
+                self._send(error_status_code, b'{"error": "Injected failure."}', {'Retry-After': '0'})
+                return None, None
+            return match, body
+
+        def do_GET(self):
+            match, _ = self._start_request()
+            if match is None:
+                return
+            if match.group('data_type') not in data_types:
+                self._send(404, b'{"error": "Not found."}')
+                return
+            query = {key: values[-1] for key, values in parse_qs(urlparse(self.path).query).items()}
+            self._send(200, data_types[match.group('data_type')].get_page(query))
+
+        def _push(self):
+            match, body = self._start_request()
+            if match is None:
+                return
+            payload = json.loads(body or b'{}')
+            with server.lock:
+                server.push_count += 1
+                form_id = f"form-{server.push_count}"
+            self._send(201, json.dumps({'form_id': form_id, 'case_id': payload.get('case_id') if isinstance(payload, dict) else None}).encode('utf-8'))
+
+        do_POST = _push
+        do_PUT = _push
+        do_PATCH = _push
+
+        def _send(self, status_code, body, headers={}):
+            self.send_response(status_code)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeCommCareHandler)
+    server.daemon_threads = True
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    server.request_count = 0
+    server.error_count = 0
+    server.push_count = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,77 @@
+"""
+    An in-process stand-in for the S3 client, for benchmarks. Unlike Boto3ClientMock, objects are kept in a dict
+    and bodies are stored as they are given, so that the stand-in adds as little as possible to the time and
+    memory being measured. Every call is counted, along with the bytes written.
+"""
+import hashlib
+import io
+import threading
+from collections import Counter
+
+from botocore.exceptions import ClientError
+
+
+class FakeS3Client(object):
+
+    def __init__(self):
+        # Object bodies and ETags, by (bucket, key)
+        self.objects = {}
+        self.etags = {}
+        self.call_counts = Counter()
+        self.put_bytes = 0
+        self._lock = threading.Lock()
+
+    def _count(self, operation):
+        with self._lock:
+            self.call_counts[operation] += 1
+
+    def put_object(self, Body, Bucket, Key, IfMatch=None, IfNoneMatch=None, **kwargs):
+        self._count('put_object')
+        body = Body.encode('utf-8') if isinstance(Body, str) else Body.read() if hasattr(Body, 'read') else bytes(Body)
+        with self._lock:
+            existing_etag = self.etags.get((Bucket, Key))
+            if (IfNoneMatch == '*' and existing_etag) or (IfMatch is not None and existing_etag != IfMatch):
+                raise ClientError({'Error': {'Code': 'PreconditionFailed', 'Message': 'At least one of the pre-conditions you specified did not hold.'}}, 'PutObject')
+            etag = f'"{hashlib.md5(body).hexdigest()}"'
+            self.objects[(Bucket, Key)] = body
+            self.etags[(Bucket, Key)] = etag
+            self.put_bytes += len(body)
+        return {'ResponseMetadata': {'HTTPStatusCode': 200}, 'ETag': etag}
+
+    def get_object(self, Bucket, Key):
+        self._count('get_object')
+        with self._lock:
+            body = self.objects.get((Bucket, Key))
+            etag = self.etags.get((Bucket, Key))
+        if body is None:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'The specified key does not exist.'}}, 'GetObject')
+        return {'ResponseMetadata': {'HTTPStatusCode': 200}, 'Body': io.BytesIO(body), 'ContentLength': len(body), 'ETag': etag}
+
+    def list_objects(self, Bucket, Prefix=''):
+        self._count('list_objects')
+        with self._lock:
+            contents = [{'Key': key, 'Size': len(body)} for (bucket, key), body in sorted(self.objects.items()) if bucket == Bucket and key.startswith(Prefix)]
+        response = {'ResponseMetadata': {'HTTPStatusCode': 200}}
+        if contents:
+            response['Contents'] = contents
+        return response
+
+    def list_objects_v2(self, Bucket, Prefix='', MaxKeys=1000, ContinuationToken=None):
+        self._count('list_objects_v2')
+        with self._lock:
+            keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix) and key > (ContinuationToken or ''))
+            contents = [{'Key': key, 'Size': len(self.objects[(Bucket, key)])} for key in keys[:MaxKeys]]
+        response = {'ResponseMetadata': {'HTTPStatusCode': 200}, 'KeyCount': len(contents), 'IsTruncated': len(keys) > MaxKeys}
+        if contents:
+            response['Contents'] = contents
+        if response['IsTruncated']:
+            # The last key listed, from which the next page starts
+            response['NextContinuationToken'] = contents[-1]['Key']
+        return response
+
+    def delete_object(self, Bucket, Key):
+        self._count('delete_object')
+        with self._lock:
+            self.objects.pop((Bucket, Key), None)
+            self.etags.pop((Bucket, Key), None)
+        return {'ResponseMetadata': {'HTTPStatusCode': 204}}
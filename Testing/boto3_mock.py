@@ -1,5 +1,13 @@
+import hashlib
+import io
 import json
 
+from botocore.exceptions import ClientError
+
+
+def generate_etag(raw_body):
+    return f'"{hashlib.md5(raw_body).hexdigest()}"'
+
 
 class Boto3ClientMock():
 
@@ -28,6 +36,15 @@ class Boto3ClientMock():
                 }
             }
 
+    def get_parameters(self, Names):
+        return {
+            'ResponseMetadata': {
+                'HTTPStatusCode': 200
+            },
+            'Parameters': [{'Name': name, 'Value': self.parameters[name]} for name in Names if name in self.parameters],
+            'InvalidParameters': [name for name in Names if name not in self.parameters]
+        }
+
     def put_parameter(self, Name, Value, Overwrite=False):
         if (Name in self.parameters and not Overwrite):
             return {
@@ -56,10 +73,16 @@ class Boto3ClientMock():
                 if object['Key'] == Key:
                     record = object
             if record is None:
+                raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'The specified key does not exist.'}}, 'GetObject')
+            elif 'RawBody' in record:
                 return {
                     'ResponseMetadata': {
-                        'HTTPStatusCode': 400
-                    }
+                        'HTTPStatusCode': 200
+                    },
+                    'ContentLength': len(record['RawBody']),
+                    'ETag': generate_etag(record['RawBody']),
+                    'Key': record['Key'],
+                    'Body': io.BytesIO(record['RawBody'])
                 }
             else:
                 return {
@@ -71,7 +94,7 @@ class Boto3ClientMock():
                     'Body': record['Body']
                 }
 
-    def put_object(self, Body, Bucket, Key):
+    def put_object(self, Body, Bucket, Key, IfMatch=None, IfNoneMatch=None, **kwargs):
         if (Bucket not in self.objects):
             return {
                 'ResponseMetadata': {
@@ -79,15 +102,42 @@ class Boto3ClientMock():
                 }
             }
         else:
+            existing = [item for item in self.objects[Bucket] if item['Key'] == Key]
+            if (IfNoneMatch == '*' and existing) or (IfMatch is not None and (not existing or generate_etag(existing[0]['RawBody']) != IfMatch)):
+                raise ClientError({'Error': {'Code': 'PreconditionFailed', 'Message': 'At least one of the pre-conditions you specified did not hold.'}}, 'PutObject')
+            raw_body = Body.encode('utf-8') if isinstance(Body, str) else Body.read() if hasattr(Body, 'read') else Body
+            try:
+                body = json.loads(raw_body)
+            except ValueError:
+                body = raw_body
+            self.objects[Bucket] = [item for item in self.objects[Bucket] if item['Key'] != Key]
             self.objects[Bucket].append(
                 {
                     'Key': Key,
-                    'Body': json.loads(Body)
+                    'Body': body,
+                    'RawBody': raw_body,
+                    **kwargs
                 }
             )
             return {
                 'ResponseMetadata': {
                     'HTTPStatusCode': 200
+                },
+                'ETag': generate_etag(raw_body)
+            }
+
+    def delete_object(self, Bucket, Key):
+        if (Bucket not in self.objects):
+            return {
+                'ResponseMetadata': {
+                    'HTTPStatusCode': 400
+                }
+            }
+        else:
+            self.objects[Bucket] = [item for item in self.objects[Bucket] if item['Key'] != Key]
+            return {
+                'ResponseMetadata': {
+                    'HTTPStatusCode': 204
                 }
             }
 
@@ -127,3 +177,27 @@ class Boto3ClientMock():
                         'HTTPStatusCode': 200
                     }
                 }
+
+    def list_objects_v2(self, Bucket, Prefix='', MaxKeys=1000, ContinuationToken=None):
+        if (Bucket not in self.objects):
+            return {
+                'ResponseMetadata': {
+                    'HTTPStatusCode': 400
+                }
+            }
+        contents = [item for item in self.objects[Bucket] if item['Key'].startswith(Prefix)]
+        # The continuation token is the index of the first key of the page
+        start = int(ContinuationToken or 0)
+        page = contents[start:start + MaxKeys]
+        response = {
+            'ResponseMetadata': {
+                'HTTPStatusCode': 200
+            },
+            'KeyCount': len(page),
+            'IsTruncated': start + MaxKeys < len(contents)
+        }
+        if page:
+            response['Contents'] = page
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = str(start + MaxKeys)
+        return response
@@ -1,6 +1,49 @@
+import inspect
+from datetime import datetime
 from testing.const import POST
 from testing.util import MockResponse
 
+# Pages served by the mock CommCareHQ in the pull tests, shared by the sync and async pull engines' tests
+CASE_DATA_TYPE = {
+    'name': 'case',
+    'version': 'v0.5',
+    'limit': 2,
+    'uses_indexed_on': True
+}
+CASE_PAGES = [
+    {
+        'meta': {'limit': 2, 'next': '?cursor=1', 'total_count': 3},
+        'objects': [
+            {'id': 'a', 'indexed_on': '2024-01-01T00:10:00.000000Z'},
+            {'id': 'b', 'indexed_on': '2024-01-01T00:20:00.000000Z'}
+        ]
+    },
+    {
+        'meta': {'limit': 2, 'next': None, 'total_count': 3},
+        'objects': [
+            {'id': 'c', 'indexed_on': '2024-01-01T00:30:00.000000Z'}
+        ]
+    }
+]
+FORM_DATA_TYPE = {
+    'name': 'form',
+    'version': 'v0.5',
+    'limit': 2,
+    'uses_indexed_on': True
+}
+FORM_PAGES = [
+    {
+        'meta': {'limit': 2, 'next': None, 'total_count': 1},
+        'objects': [
+            {'id': 'f', 'indexed_on': '2024-01-01T00:15:00.000000Z'}
+        ]
+    }
+]
+INDEXED_ON_OBJECTS = [
+    {'id': str(minute), 'indexed_on': f"2024-01-01T00:{minute:02d}:00.000000Z"}
+    for minute in range(0, 60, 6)
+]
+
 
 def mock_get(url, headers, params):
     json_data = {
@@ -27,3 +70,108 @@ def mock_request(method, url, headers, json):
         }
     response = MockResponse(json_data=json_data)
     return response
+
+
+class MockTransport():
+    """
+        Stand-in for transport.CommCareTransport that routes requests to the mock functions above.
+    """
+
+    def __init__(self, get=mock_get, request=mock_request):
+        self._get = get
+        self._request = request
+
+    def get(self, url, headers=None, params=None, timeout=None):
+        return self._get(url, headers, params)
+
+    def request(self, method, url, headers=None, json=None, timeout=None):
+        return self._request(method, url, headers, json)
+
+
+def generate_mock_get_pages(pages):
+    """
+        Returns a mock get function that serves the given list of json_data pages in order.
+    """
+    remaining_pages = iter(pages)
+
+    def mock_get_pages(url, headers, params):
+        return MockResponse(json_data=next(remaining_pages))
+
+    return mock_get_pages
+
+
+def generate_mock_get_by_data_type(pages_by_data_type):
+    """
+        Returns a mock get function that serves each data type's list of json_data pages in order, picking
+        the data type from the request URL.
+    """
+    remaining_pages = {name: iter(pages) for name, pages in pages_by_data_type.items()}
+
+    def mock_get_by_data_type(url, headers, params):
+        data_type_name = url.rstrip('/').split('/')[-1]
+        return MockResponse(json_data=next(remaining_pages[data_type_name]))
+
+    return mock_get_by_data_type
+
+
+def generate_mock_get_throttled(get_function, throttled_count, status_code=429, retry_after='0'):
+    """
+        Returns a mock get function that answers the first throttled_count requests the way CommCareHQ does
+        when it throttles a client, then hands requests to get_function.
+    """
+    remaining_throttles = [throttled_count]
+
+    def mock_get_throttled(url, headers, params):
+        if remaining_throttles[0]:
+            remaining_throttles[0] -= 1
+            return MockResponse(status_code=status_code, ok=False, headers={'Retry-After': retry_after})
+        return get_function(url, headers, params)
+
+    return mock_get_throttled
+
+
+def generate_mock_get_indexed_on(objects):
+    """
+        Returns a mock get function that serves the given objects the way the CommCare API does for
+        data types that are ordered by indexed_on, including the inclusive indexed_on_start/end bounds.
+    """
+
+    def mock_get_indexed_on(url, headers, params):
+        start = datetime.fromisoformat(params['indexed_on_start'])
+        end = datetime.fromisoformat(params['indexed_on_end'])
+        limit = int(params['limit'])
+        matching = [item for item in objects if start <= datetime.fromisoformat(item['indexed_on'].rstrip('Z')) <= end]
+        page = matching[:limit]
+        json_data = {
+            'meta': {
+                'total_count': len(matching),
+                'limit': limit,
+                'next': '?page=next' if len(matching) > limit else None
+            },
+            'objects': page
+        }
+        return MockResponse(json_data=json_data)
+
+    return mock_get_indexed_on
+
+
+class MockAsyncTransport(MockTransport):
+    """
+        Stand-in for transport.AsyncCommCareTransport that routes requests to the mock functions above.
+        Mock functions may also be coroutine functions, to simulate slow responses.
+    """
+
+    async def _call(self, function, *args):
+        response = function(*args)
+        if inspect.isawaitable(response):
+            response = await response
+        return response
+
+    async def get(self, url, headers=None, params=None, timeout=None):
+        return await self._call(self._get, url, headers, params)
+
+    async def request(self, method, url, headers=None, json=None, timeout=None):
+        return await self._call(self._request, method, url, headers, json)
+
+    async def close(self):
+        pass
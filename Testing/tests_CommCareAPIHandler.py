@@ -1,13 +1,12 @@
-import boto3
 import importlib
 import unittest
 import unittest.mock
 
 from datetime import datetime
-from unittest.mock import MagicMock
 from testing.util import (
     generate_get_boto3_client_mock_function,
-    run_test_cases
+    run_test_cases,
+    use_boto3_client_mocks
 )
 
 get_boto3_client_mock = generate_get_boto3_client_mock_function(
@@ -23,8 +22,6 @@ get_boto3_client_mock = generate_get_boto3_client_mock_function(
     }
 )
 
-boto3.client = MagicMock(side_effect=get_boto3_client_mock)
-
 import CommCareAPIHandler
 importlib.reload(CommCareAPIHandler)
 from CommCareAPIHandler import APIError, CommCareAPIHandler
@@ -35,6 +32,9 @@ def raise_api_error(data_type):
 
 
 class TestCommCareAPIHandler(unittest.TestCase):
+    def setUp(self):
+        self.enterContext(use_boto3_client_mocks(get_boto3_client_mock))
+
     def test_commcareapihandler_init(self):
         print('*** Running test_commcareapihandler_init ***')
         test_data = [
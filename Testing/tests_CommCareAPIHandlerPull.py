@@ -1,17 +1,36 @@
-import boto3
+import gzip
 import importlib
+import importlib.util
+import io
 import requests
 import json
+import threading
 import unittest
 import unittest.mock
 
 from datetime import datetime
 from unittest.mock import MagicMock
-from testing.requests_mock import mock_get, mock_request
+from testing.boto3_mock import Boto3ClientMock
+from testing.requests_mock import (
+    CASE_DATA_TYPE,
+    CASE_PAGES,
+    FORM_DATA_TYPE,
+    FORM_PAGES,
+    INDEXED_ON_OBJECTS,
+    MockTransport,
+    generate_mock_get_by_data_type,
+    generate_mock_get_indexed_on,
+    generate_mock_get_pages,
+    generate_mock_get_throttled,
+    mock_get,
+    mock_request
+)
 from testing.util import (
+    MockResponse,
     fake_json_file_load,
     generate_get_boto3_client_mock_function,
-    run_test_cases
+    run_test_cases,
+    use_boto3_client_mocks
 )
 
 get_boto3_client_mock = generate_get_boto3_client_mock_function(
@@ -27,7 +46,6 @@ get_boto3_client_mock = generate_get_boto3_client_mock_function(
     }
 )
 
-boto3.client = MagicMock(side_effect=get_boto3_client_mock)
 requests.get = MagicMock(side_effect=mock_get)
 requests.post = MagicMock(side_effect=mock_request)
 json.load = MagicMock(side_effect=fake_json_file_load)
@@ -35,11 +53,1025 @@ json.load = MagicMock(side_effect=fake_json_file_load)
 import CommCareAPIHandler
 importlib.reload(CommCareAPIHandler)
 from CommCareAPIHandler import CommCareAPIHandlerPull
+from util import APIError, APILimitCalculator
+from lambda_function import DateRangeTuple
+
+BUCKET = 'commcare-snowflake-data-sync'
+STATE_KEY = 'test_domain/snowflake-copy/state.json'
+LOCATION_DATA_TYPE = {
+    'name': 'location',
+    'version': 'v0.5',
+    'limit': 2
+}
+LOCATION_PAGES = [
+    {
+        'meta': {'limit': 2, 'next': f"?limit=2&offset={offset + 2}" if offset < 4 else None, 'total_count': 6},
+        'objects': [{'id': f"location_{offset}"}, {'id': f"location_{offset + 1}"}]
+    }
+    for offset in range(0, 6, 2)
+]
+
+
+def get_stored_state(s3_mock, data_type_name):
+    """
+        Gets a data type's stored parameters from the state manifest written to the mock S3 bucket.
+    """
+    manifests = [item for item in s3_mock.objects[BUCKET] if item['Key'] == STATE_KEY]
+    return manifests[0]['Body']['data_types'].get(data_type_name, {}) if manifests else {}
+
+
+def generate_mock_get_failing_after(get_function, request_count):
+    """
+        Wraps a mock get function so that every request after the first request_count fails, as if the
+        Lambda function had timed out.
+    """
+    requests_made = []
+
+    def mock_get_failing_after(url, headers, params):
+        requests_made.append(url)
+        if len(requests_made) > request_count:
+            raise Exception("Lambda timed out!")
+        return get_function(url, headers, params)
+
+    return mock_get_failing_after
+
+
+def generate_mock_deadline(checks_allowed):
+    """
+        Returns a mock deadline that allows the first checks_allowed checks, whichever shards make them.
+    """
+    checks = []
+    lock = threading.Lock()
+
+    def allows_next_page():
+        with lock:
+            checks.append(True)
+            return len(checks) <= checks_allowed
+
+    deadline = MagicMock()
+    deadline.allows_next_page.side_effect = allows_next_page
+    return deadline
+
+
+def generate_pull_api(pages, **kwargs):
+    api_kwargs = {
+        'custom_date_range_config': DateRangeTuple(
+            datetime.strptime('2024-01-01 00:00:00', '%Y-%m-%d %H:%M:%S'),
+            datetime.strptime('2024-01-01 01:00:00', '%Y-%m-%d %H:%M:%S')),
+        'use_lag': False,
+        'transport': MockTransport(get=pages if callable(pages) else generate_mock_get_pages(pages) if isinstance(pages, list) else generate_mock_get_by_data_type(pages))
+    }
+    api_kwargs.update(kwargs)
+    return CommCareAPIHandlerPull(
+        False,
+        'test_domain',
+        'test_domain-api-key',
+        datetime.strptime('2024-01-01 01:00:00', '%Y-%m-%d %H:%M:%S'),
+        **api_kwargs
+    )
+
+
+class TestCommCareAPIHandlerPullData(unittest.TestCase):
+    def setUp(self):
+        self.enterContext(use_boto3_client_mocks(get_boto3_client_mock))
+
+    def test_commcareapihandlerpull_pull_data(self):
+        print('*** Running test_commcareapihandlerpull_pull_data ***')
+        test_data = [
+            {
+                'name': 'serial_uploads',
+                'parameters': {
+                    'data_type': CASE_DATA_TYPE,
+                    'pipeline_uploads': False
+                },
+                'return_value': [
+                    'test_domain/snowflake-copy/case/2024/01/01/01/case_2024-01-01T00:00:00_2024-01-01T00:20:00.json',
+                    'test_domain/snowflake-copy/case/2024/01/01/01/case_2024-01-01T00:20:00_2024-01-01T01:00:00.json'
+                ],
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'raw_passthrough',
+                'parameters': {
+                    'data_type': dict(CASE_DATA_TYPE, raw_passthrough=True),
+                    'pipeline_uploads': False
+                },
+                'return_value': [
+                    'test_domain/snowflake-copy/case/2024/01/01/01/case_2024-01-01T00:00:00_2024-01-01T00:20:00.json',
+                    'test_domain/snowflake-copy/case/2024/01/01/01/case_2024-01-01T00:20:00_2024-01-01T01:00:00.json'
+                ],
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'pipelined_uploads',
+                'parameters': {
+                    'data_type': CASE_DATA_TYPE,
+                    'pipeline_uploads': True
+                },
+                'return_value': [
+                    'test_domain/snowflake-copy/case/2024/01/01/01/case_2024-01-01T00:00:00_2024-01-01T00:20:00.json',
+                    'test_domain/snowflake-copy/case/2024/01/01/01/case_2024-01-01T00:20:00_2024-01-01T01:00:00.json'
+                ],
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            s3_mock = Boto3ClientMock(objects={BUCKET: []})
+            api = generate_pull_api(CASE_PAGES, pipeline_uploads=test_case['parameters']['pipeline_uploads'])
+            with use_boto3_client_mocks(s3=s3_mock):
+                api.pull_data(test_case['parameters']['data_type'])
+            self.assertListEqual(
+                test_case['return_value'],
+                sorted(item['Key'] for item in s3_mock.objects[BUCKET])
+            )
+            self.assertListEqual(CASE_PAGES, [item['Body'] for item in sorted(s3_mock.objects[BUCKET], key=lambda item: item['Key'])])
+            self.assertEqual(len(CASE_PAGES), api.request_count)
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_commcareapihandlerpull_compressed_pull_data(self):
+        print('*** Running test_commcareapihandlerpull_compressed_pull_data ***')
+        test_data = [
+            {
+                'name': 'gzip_compression',
+                'parameters': {
+                    'data_type': dict(CASE_DATA_TYPE, compression='gzip')
+                },
+                'return_value': [
+                    'test_domain/snowflake-copy/case/2024/01/01/01/case_2024-01-01T00:00:00_2024-01-01T00:20:00.json.gz',
+                    'test_domain/snowflake-copy/case/2024/01/01/01/case_2024-01-01T00:20:00_2024-01-01T01:00:00.json.gz'
+                ],
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'gzip_compression_raw_passthrough',
+                'parameters': {
+                    'data_type': dict(CASE_DATA_TYPE, compression='gzip', raw_passthrough=True)
+                },
+                'return_value': [
+                    'test_domain/snowflake-copy/case/2024/01/01/01/case_2024-01-01T00:00:00_2024-01-01T00:20:00.json.gz',
+                    'test_domain/snowflake-copy/case/2024/01/01/01/case_2024-01-01T00:20:00_2024-01-01T01:00:00.json.gz'
+                ],
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            s3_mock = Boto3ClientMock(objects={BUCKET: []})
+            api = generate_pull_api(CASE_PAGES)
+            with use_boto3_client_mocks(s3=s3_mock):
+                api.pull_data(test_case['parameters']['data_type'])
+            stored_files = sorted(s3_mock.objects[BUCKET], key=lambda item: item['Key'])
+            self.assertListEqual(test_case['return_value'], [item['Key'] for item in stored_files])
+            for stored_file, page in zip(stored_files, CASE_PAGES):
+                self.assertEqual('gzip', stored_file['ContentEncoding'])
+                self.assertEqual(page, json.loads(gzip.decompress(stored_file['RawBody'])))
+            self.assertIn('case', api.compression_ratios)
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_commcareapihandlerpull_rolled_pull_data(self):
+        print('*** Running test_commcareapihandlerpull_rolled_pull_data ***')
+        test_data = [
+            {
+                'name': 'rolled_into_one_file',
+                'parameters': {
+                    'data_type': dict(CASE_DATA_TYPE, roll_files=True)
+                },
+                'return_value': [
+                    'test_domain/snowflake-copy/case/2024/01/01/01/case_2024-01-01T00:00:00_2024-01-01T01:00:00.json'
+                ],
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'rolled_into_one_file_raw_passthrough',
+                'parameters': {
+                    'data_type': dict(CASE_DATA_TYPE, roll_files=True, raw_passthrough=True)
+                },
+                'return_value': [
+                    'test_domain/snowflake-copy/case/2024/01/01/01/case_2024-01-01T00:00:00_2024-01-01T01:00:00.json'
+                ],
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'small_target_size',
+                'parameters': {
+                    'data_type': dict(CASE_DATA_TYPE, roll_files=True, target_file_size_mb=0.0001)
+                },
+                'return_value': [
+                    'test_domain/snowflake-copy/case/2024/01/01/01/case_2024-01-01T00:00:00_2024-01-01T00:20:00.json',
+                    'test_domain/snowflake-copy/case/2024/01/01/01/case_2024-01-01T00:20:00_2024-01-01T01:00:00.json'
+                ],
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            s3_mock = Boto3ClientMock(objects={BUCKET: []})
+            api = generate_pull_api(CASE_PAGES)
+            with use_boto3_client_mocks(s3=s3_mock):
+                api.pull_data(test_case['parameters']['data_type'])
+            stored_files = sorted(s3_mock.objects[BUCKET], key=lambda item: item['Key'])
+            self.assertListEqual(test_case['return_value'], [item['Key'] for item in stored_files])
+            self.assertListEqual(
+                [item for page in CASE_PAGES for item in page['objects']],
+                [item for stored_file in stored_files for item in stored_file['Body']['objects']]
+            )
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_commcareapihandlerpull_ndjson_pull_data(self):
+        print('*** Running test_commcareapihandlerpull_ndjson_pull_data ***')
+        test_data = [
+            {
+                'name': 'ndjson_with_meta_sidecar',
+                'parameters': {
+                    'data_type': dict(CASE_DATA_TYPE, output_format='ndjson', meta_sidecar=True, roll_files=True)
+                },
+                'return_value': {
+                    'test_domain/snowflake-copy/case/2024/01/01/01/case_2024-01-01T00:00:00_2024-01-01T01:00:00.meta.json':
+                        {'meta': {'limit': 2, 'next': None, 'total_count': 3}},
+                    'test_domain/snowflake-copy/case/2024/01/01/01/case_2024-01-01T00:00:00_2024-01-01T01:00:00.ndjson':
+                        ''.join(json.dumps(item) + '\n' for page in CASE_PAGES for item in page['objects'])
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'ndjson_gzip_raw_passthrough',
+                'parameters': {
+                    'data_type': dict(CASE_DATA_TYPE, output_format='ndjson', compression='gzip', raw_passthrough=True)
+                },
+                'return_value': {
+                    'test_domain/snowflake-copy/case/2024/01/01/01/case_2024-01-01T00:00:00_2024-01-01T00:20:00.ndjson.gz':
+                        ''.join(json.dumps(item) + '\n' for item in CASE_PAGES[0]['objects']),
+                    'test_domain/snowflake-copy/case/2024/01/01/01/case_2024-01-01T00:20:00_2024-01-01T01:00:00.ndjson.gz':
+                        ''.join(json.dumps(item) + '\n' for item in CASE_PAGES[1]['objects'])
+                },
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            s3_mock = Boto3ClientMock(objects={BUCKET: []})
+            api = generate_pull_api(CASE_PAGES)
+            with use_boto3_client_mocks(s3=s3_mock):
+                api.pull_data(test_case['parameters']['data_type'])
+            stored_files = {}
+            for stored_file in s3_mock.objects[BUCKET]:
+                if stored_file['Key'].endswith('.gz'):
+                    stored_files[stored_file['Key']] = gzip.decompress(stored_file['RawBody']).decode('utf-8')
+                elif stored_file['Key'].endswith('.ndjson'):
+                    stored_files[stored_file['Key']] = stored_file['RawBody'].decode('utf-8')
+                else:
+                    stored_files[stored_file['Key']] = stored_file['Body']
+                if '.ndjson' in stored_file['Key']:
+                    self.assertEqual('application/x-ndjson', stored_file['ContentType'])
+            self.assertDictEqual(test_case['return_value'], stored_files)
+
+        run_test_cases(self, test_data, test_function)
+
+    @unittest.skipUnless(importlib.util.find_spec('pyarrow'), "pyarrow is not installed")
+    def test_commcareapihandlerpull_parquet_pull_data(self):
+        print('*** Running test_commcareapihandlerpull_parquet_pull_data ***')
+        import pyarrow.parquet
+        test_data = [
+            {
+                'name': 'parquet_files',
+                'parameters': {
+                    'data_type': dict(CASE_DATA_TYPE, output_format='parquet')
+                },
+                'return_value': [
+                    'test_domain/snowflake-copy/case/2024/01/01/01/case_2024-01-01T00:00:00_2024-01-01T00:20:00.parquet',
+                    'test_domain/snowflake-copy/case/2024/01/01/01/case_2024-01-01T00:20:00_2024-01-01T01:00:00.parquet'
+                ],
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            s3_mock = Boto3ClientMock(objects={BUCKET: []})
+            api = generate_pull_api(CASE_PAGES)
+            with use_boto3_client_mocks(s3=s3_mock):
+                api.pull_data(test_case['parameters']['data_type'])
+            stored_files = sorted(s3_mock.objects[BUCKET], key=lambda item: item['Key'])
+            self.assertListEqual(test_case['return_value'], [item['Key'] for item in stored_files])
+            for stored_file, page in zip(stored_files, CASE_PAGES):
+                self.assertListEqual(page['objects'], pyarrow.parquet.read_table(io.BytesIO(stored_file['RawBody'])).to_pylist())
+            self.assertIn('case', api.parquet_encoders)
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_commcareapihandlerpull_pull_data_for_domain(self):
+        print('*** Running test_commcareapihandlerpull_pull_data_for_domain ***')
+        test_data = [
+            {
+                'name': 'serial_data_types',
+                'parameters': {
+                    'data_type_concurrency': 1,
+                    'request_limit': 100,
+                    'raises_request_limit': False
+                },
+                'return_value': 3,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'concurrent_data_types',
+                'parameters': {
+                    'data_type_concurrency': 2,
+                    'request_limit': 100,
+                    'raises_request_limit': False
+                },
+                'return_value': 3,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'concurrent_data_types_share_request_limit',
+                'parameters': {
+                    'data_type_concurrency': 2,
+                    'request_limit': 2,
+                    'raises_request_limit': True
+                },
+                'return_value': 2,
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            s3_mock = Boto3ClientMock(objects={BUCKET: []})
+            api = generate_pull_api(
+                {'case': CASE_PAGES, 'form': FORM_PAGES},
+                request_limit=test_case['parameters']['request_limit'],
+                data_type_concurrency=test_case['parameters']['data_type_concurrency']
+            )
+            with use_boto3_client_mocks(s3=s3_mock):
+                if test_case['parameters']['raises_request_limit']:
+                    with self.assertRaisesRegex(Exception, "Request limit reached for API Handler"):
+                        api.pull_data_for_domain({'case': CASE_DATA_TYPE, 'form': FORM_DATA_TYPE})
+                else:
+                    api.pull_data_for_domain({'case': CASE_DATA_TYPE, 'form': FORM_DATA_TYPE})
+            self.assertEqual(test_case['return_value'], api.request_count)
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_commcareapihandlerpull_sharded_pull_data(self):
+        print('*** Running test_commcareapihandlerpull_sharded_pull_data ***')
+        test_data = [
+            {
+                'name': 'unsharded',
+                'parameters': {
+                    'data_type': dict(CASE_DATA_TYPE, limit=3)
+                },
+                'return_value': {
+                    'shard_count': 1,
+                    'file_count': 5
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'three_shards',
+                'parameters': {
+                    'data_type': dict(CASE_DATA_TYPE, limit=3, shard_count=3)
+                },
+                'return_value': {
+                    'shard_count': 3,
+                    'file_count': 4
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'shard_count_capped_by_total_count',
+                'parameters': {
+                    'data_type': dict(CASE_DATA_TYPE, limit=20, shard_count=3)
+                },
+                'return_value': {
+                    'shard_count': 1,
+                    'file_count': 1
+                },
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            s3_mock = Boto3ClientMock(objects={BUCKET: []})
+            api = generate_pull_api(generate_mock_get_indexed_on(INDEXED_ON_OBJECTS))
+            data_type = test_case['parameters']['data_type']
+            start_time, end_time = api.get_date_range(data_type)
+            params = api.get_initial_parameters_for_data_type(data_type, start_time, end_time)
+            shard_ranges = api._get_shard_ranges(data_type, params, start_time, end_time)
+            self.assertEqual(test_case['return_value']['shard_count'], len(shard_ranges))
+            self.assertEqual(start_time, shard_ranges[0][0])
+            self.assertEqual(end_time, shard_ranges[-1][1])
+            with use_boto3_client_mocks(s3=s3_mock):
+                api.pull_data(data_type)
+            stored_files = s3_mock.objects[BUCKET]
+            self.assertEqual(test_case['return_value']['file_count'], len(stored_files))
+            stored_ids = {item['id'] for stored_file in stored_files for item in stored_file['Body']['objects']}
+            self.assertSetEqual({item['id'] for item in INDEXED_ON_OBJECTS}, stored_ids)
+            for stored_file in stored_files:
+                self.assertRegex(stored_file['Key'], r"/case_2024-01-01T00:\d\d:00_2024-01-01T0[01]:\d\d:00\.json$")
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_commcareapihandlerpull_adapt_api_limit(self):
+        print('*** Running test_commcareapihandlerpull_adapt_api_limit ***')
+        test_data = [
+            {
+                'name': 'full_page_at_half_max_size_keeps_limit',
+                'parameters': {
+                    'current_limit': 1000,
+                    'page_size_in_bytes': 8000000,
+                    'object_count': 1000
+                },
+                'return_value': 1000,
+                'saved_limit': 1000,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'oversized_page_shrinks_limit',
+                'parameters': {
+                    'current_limit': 1000,
+                    'page_size_in_bytes': 32000000,
+                    'object_count': 1000
+                },
+                'return_value': 250,
+                'saved_limit': 250,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'full_page_growth_is_capped',
+                'parameters': {
+                    'current_limit': 1000,
+                    'page_size_in_bytes': 800000,
+                    'object_count': 1000
+                },
+                'return_value': 2000,
+                'saved_limit': 2000,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'small_last_page_does_not_grow_limit',
+                'parameters': {
+                    'current_limit': 500,
+                    'page_size_in_bytes': 130,
+                    'object_count': 1
+                },
+                'return_value': 500,
+                'saved_limit': None,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'partial_page_can_shrink_limit',
+                'parameters': {
+                    'current_limit': 1000,
+                    'page_size_in_bytes': 3200000,
+                    'object_count': 100
+                },
+                'return_value': 250,
+                'saved_limit': 250,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'limit_is_at_least_one',
+                'parameters': {
+                    'current_limit': 1,
+                    'page_size_in_bytes': 64000000,
+                    'object_count': 1
+                },
+                'return_value': 1,
+                'saved_limit': 1,
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            api = generate_pull_api([])
+            new_limit = api._adapt_api_limit(
+                CASE_DATA_TYPE,
+                test_case['parameters']['current_limit'],
+                test_case['parameters']['page_size_in_bytes'],
+                test_case['parameters']['object_count']
+            )
+            self.assertEqual(test_case['return_value'], new_limit)
+            self.assertEqual(test_case['saved_limit'], api.api_limits.get(CASE_DATA_TYPE['name']))
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_commcareapihandlerpull_auto_determine_limit_short_last_page(self):
+        print('*** Running test_commcareapihandlerpull_auto_determine_limit_short_last_page ***')
+        full_pages = [
+            {
+                'meta': {'limit': 4, 'next': '?cursor=1', 'total_count': 9},
+                'objects': [{'id': f"{page}-{index}", 'indexed_on': f"2024-01-01T00:{page}{index}:00.000000Z", 'notes': 'x' * 1000} for index in range(4)]
+            }
+            for page in range(2)
+        ]
+        last_page = {'meta': {'limit': 4, 'next': None, 'total_count': 1}, 'objects': [{'id': 'c', 'indexed_on': '2024-01-01T00:30:00.000000Z'}]}
+        test_data = [
+            {
+                'name': 'limit_saved_from_last_full_page',
+                'parameters': {
+                    'pages': full_pages + [last_page]
+                },
+                'return_value': 4,
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            s3_mock = Boto3ClientMock(objects={BUCKET: [{'Key': STATE_KEY, 'RawBody': b'{"data_types": {"case": {"api_limit": 4}}}', 'Body': {'data_types': {'case': {'api_limit': 4}}}}]})
+            requested_limits = []
+            mock_get_pages = generate_mock_get_pages(test_case['parameters']['pages'])
+
+            def mock_get_recording_limit(url, headers, params):
+                requested_limits.append(int(params['limit']))
+                return mock_get_pages(url, headers, params)
+
+            api = generate_pull_api(mock_get_recording_limit)
+            # Full pages are about half the maximum file size, so their limit is kept; the last page is tiny
+            with use_boto3_client_mocks(s3=s3_mock), \
+                    unittest.mock.patch.object(APILimitCalculator, 'max_file_size_in_mb', 0.01):
+                api.pull_data_for_domain({'case': dict(CASE_DATA_TYPE, auto_determine_limit=True)})
+            self.assertListEqual([test_case['return_value']] * 3, requested_limits)
+            self.assertEqual(test_case['return_value'], get_stored_state(s3_mock, 'case')['api_limit'])
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_commcareapihandlerpull_auto_determine_limit(self):
+        print('*** Running test_commcareapihandlerpull_auto_determine_limit ***')
+        test_data = [
+            {
+                'name': 'no_stored_limit',
+                'parameters': {
+                    'stored_objects': []
+                },
+                'return_value': 3,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'stored_limit_in_legacy_txt_file',
+                'parameters': {
+                    'stored_objects': [
+                        {
+                            'Key': 'test_domain/snowflake-copy/case/api_limit.txt',
+                            'RawBody': b'5',
+                            'Body': 5
+                        }
+                    ]
+                },
+                'return_value': 5,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'stored_limit_in_state_manifest',
+                'parameters': {
+                    'stored_objects': [
+                        {
+                            'Key': STATE_KEY,
+                            'RawBody': b'{"data_types": {"case": {"api_limit": 4}}}',
+                            'Body': {'data_types': {'case': {'api_limit': 4}}}
+                        }
+                    ]
+                },
+                'return_value': 4,
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            s3_mock = Boto3ClientMock(objects={BUCKET: list(test_case['parameters']['stored_objects'])})
+            requested_limits = []
+            mock_get_indexed_on = generate_mock_get_indexed_on(INDEXED_ON_OBJECTS)
+
+            def mock_get_recording_limit(url, headers, params):
+                requested_limits.append(int(params['limit']))
+                return mock_get_indexed_on(url, headers, params)
+
+            api = generate_pull_api(mock_get_recording_limit)
+            # Pages of this test data are a few hundred bytes, so shrink the maximum file size to match
+            with use_boto3_client_mocks(s3=s3_mock), \
+                    unittest.mock.patch.object(APILimitCalculator, 'max_file_size_in_mb', 0.0012):
+                api.pull_data_for_domain({'case': dict(CASE_DATA_TYPE, limit=3, auto_determine_limit=True)})
+            self.assertEqual(test_case['return_value'], requested_limits[0])
+            self.assertEqual(len(requested_limits), api.request_count)
+            self.assertNotEqual(requested_limits[0], requested_limits[1])
+            self.assertEqual(api.api_limits['case'], get_stored_state(s3_mock, 'case')['api_limit'])
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_commcareapihandlerpull_checkpoint_resume(self):
+        print('*** Running test_commcareapihandlerpull_checkpoint_resume ***')
+        test_data = [
+            {
+                'name': 'indexed_on_resumes_from_last_indexed_on',
+                'parameters': {
+                    'data_type': dict(CASE_DATA_TYPE, limit=3, checkpoint_every=1),
+                    'first_get': generate_mock_get_indexed_on(INDEXED_ON_OBJECTS),
+                    'resumed_get': generate_mock_get_indexed_on(INDEXED_ON_OBJECTS),
+                    'objects': INDEXED_ON_OBJECTS
+                },
+                'return_value': {
+                    'checkpoint': {
+                        'last_successful_job_time': '2024-01-01T00:00:00',
+                        'start_time': '2024-01-01T00:24:00',
+                        'end_time': '2024-01-01T01:00:00',
+                        'cursor': None,
+                        'files_written': 2
+                    },
+                    'first_resumed_params': {'indexed_on_start': '2024-01-01T00:24:00'},
+                    'resumed_request_count': 3
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'cursor_resumes_from_last_cursor',
+                'parameters': {
+                    'data_type': dict(LOCATION_DATA_TYPE, checkpoint_every=1),
+                    'first_get': generate_mock_get_pages(LOCATION_PAGES),
+                    'resumed_get': generate_mock_get_pages(LOCATION_PAGES[2:]),
+                    'objects': [item for page in LOCATION_PAGES for item in page['objects']]
+                },
+                'return_value': {
+                    'checkpoint': {
+                        'last_successful_job_time': '2024-01-01T00:00:00',
+                        'start_time': '2024-01-01T00:00:00',
+                        'end_time': '2024-01-01T01:00:00',
+                        'cursor': '?limit=2&offset=4',
+                        'files_written': 2
+                    },
+                    'first_resumed_params': None,
+                    'resumed_request_count': 1
+                },
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            data_type = test_case['parameters']['data_type']
+            stored_param_path = f"test_domain/snowflake-copy/{data_type['name']}/"
+            s3_mock = Boto3ClientMock(objects={BUCKET: [
+                {'Key': stored_param_path + 'last_successful_job_time.txt', 'RawBody': b'2024-01-01T00:00:00', 'Body': None}
+            ]})
+            first_api = generate_pull_api(generate_mock_get_failing_after(test_case['parameters']['first_get'], 2), custom_date_range_config=None)
+            with use_boto3_client_mocks(s3=s3_mock):
+                with self.assertRaisesRegex(Exception, "Lambda timed out!"):
+                    first_api.pull_data_for_domain({data_type['name']: data_type})
+            self.assertDictEqual(test_case['return_value']['checkpoint'], get_stored_state(s3_mock, data_type['name'])['checkpoint'])
+            self.assertEqual(4, len(s3_mock.objects[BUCKET]))
+
+            resumed_requests = []
+
+            def mock_get_recording_requests(url, headers, params):
+                resumed_requests.append((url, dict(params) if params else None))
+                return test_case['parameters']['resumed_get'](url, headers, params)
+
+            resumed_api = generate_pull_api(mock_get_recording_requests, custom_date_range_config=None)
+            with use_boto3_client_mocks(s3=s3_mock):
+                resumed_api.pull_data_for_domain({data_type['name']: data_type})
+            self.assertEqual(test_case['return_value']['resumed_request_count'], resumed_api.request_count)
+            first_url, first_params = resumed_requests[0]
+            if test_case['return_value']['checkpoint']['cursor']:
+                self.assertTrue(first_url.endswith(test_case['return_value']['checkpoint']['cursor']))
+                self.assertIsNone(first_params)
+            else:
+                self.assertDictEqual(test_case['return_value']['first_resumed_params'], {'indexed_on_start': first_params['indexed_on_start']})
+            self.assertDictEqual({'last_successful_job_time': '2024-01-01T01:00:00'}, get_stored_state(s3_mock, data_type['name']))
+            stored_ids = {item['id'] for stored_file in s3_mock.objects[BUCKET] if stored_file['Key'].endswith('.json') and stored_file['Key'] != STATE_KEY for item in stored_file['Body']['objects']}
+            self.assertSetEqual({item['id'] for item in test_case['parameters']['objects']}, stored_ids)
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_commcareapihandlerpull_deadline(self):
+        print('*** Running test_commcareapihandlerpull_deadline ***')
+        test_data = [
+            {
+                'name': 'stops_before_page_past_deadline',
+                'parameters': {
+                    'pages_allowed': 2
+                },
+                'return_value': {
+                    'status': 'partial',
+                    'request_count': 2,
+                    'run_time': '2024-01-01T00:00:00',
+                    'checkpoint': {
+                        'last_successful_job_time': '2024-01-01T00:00:00',
+                        'start_time': '2024-01-01T00:24:00',
+                        'end_time': '2024-01-01T01:00:00',
+                        'cursor': None,
+                        'files_written': 2
+                    }
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'not_started_past_deadline',
+                'parameters': {
+                    'pages_allowed': -1
+                },
+                'return_value': {
+                    'status': 'not_started',
+                    'request_count': 0,
+                    'run_time': None,
+                    'checkpoint': None
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'completes_before_deadline',
+                'parameters': {
+                    'pages_allowed': 10
+                },
+                'return_value': {
+                    'status': 'complete',
+                    'request_count': 5,
+                    'run_time': '2024-01-01T01:00:00',
+                    'checkpoint': None
+                },
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            s3_mock = Boto3ClientMock(objects={BUCKET: [
+                {'Key': 'test_domain/snowflake-copy/case/last_successful_job_time.txt', 'RawBody': b'2024-01-01T00:00:00', 'Body': None}
+            ]})
+            # One check before the data type starts, then one before each page
+            pages_allowed = test_case['parameters']['pages_allowed']
+            deadline = MagicMock()
+            deadline.allows_next_page.side_effect = [pages_allowed >= 0] + [page_number < pages_allowed for page_number in range(10)]
+            api = generate_pull_api(generate_mock_get_indexed_on(INDEXED_ON_OBJECTS), custom_date_range_config=None, deadline=deadline)
+            with use_boto3_client_mocks(s3=s3_mock):
+                api.pull_data_for_domain({'case': dict(CASE_DATA_TYPE, limit=3)})
+            self.assertDictEqual({'case': test_case['return_value']['status']}, api.data_type_statuses)
+            self.assertEqual(test_case['return_value']['request_count'], api.request_count)
+            self.assertEqual(test_case['return_value']['status'] != 'complete', api.resume_needed)
+            stored_state = get_stored_state(s3_mock, 'case')
+            self.assertEqual(test_case['return_value']['checkpoint'], stored_state.get('checkpoint'))
+            self.assertEqual(test_case['return_value']['run_time'], stored_state.get('last_successful_job_time'))
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_commcareapihandlerpull_sharded_deadline(self):
+        print('*** Running test_commcareapihandlerpull_sharded_deadline ***')
+        test_data = [
+            {
+                'name': 'two_shards',
+                'parameters': {
+                    'data_type': dict(CASE_DATA_TYPE, limit=2, shard_count=2),
+                    'pages_allowed': 2
+                },
+                'return_value': {
+                    'shard_count': 2
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'three_shards',
+                'parameters': {
+                    'data_type': dict(CASE_DATA_TYPE, limit=2, shard_count=3),
+                    'pages_allowed': 3
+                },
+                'return_value': {
+                    'shard_count': 3
+                },
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            s3_mock = Boto3ClientMock(objects={BUCKET: [
+                {'Key': 'test_domain/snowflake-copy/case/last_successful_job_time.txt', 'RawBody': b'2024-01-01T00:00:00', 'Body': None}
+            ]})
+            data_type = test_case['parameters']['data_type']
+            mock_get_indexed_on = generate_mock_get_indexed_on(INDEXED_ON_OBJECTS)
+
+            def pull(checks_allowed):
+                requests_made = []
+
+                def mock_get(url, headers, params):
+                    requests_made.append(dict(params))
+                    return mock_get_indexed_on(url, headers, params)
+
+                # One check before the data type starts, then one before each page of each shard
+                api = generate_pull_api(mock_get, custom_date_range_config=None, deadline=generate_mock_deadline(checks_allowed + 1))
+                with use_boto3_client_mocks(s3=s3_mock):
+                    api.pull_data_for_domain({data_type['name']: data_type})
+                return api, requests_made
+
+            def get_first_requests(requests_made):
+                first_requests = {}
+                for params in requests_made:
+                    first_requests.setdefault(params['indexed_on_end'], params['indexed_on_start'])
+                return first_requests
+
+            pages_allowed = test_case['parameters']['pages_allowed']
+            previous_shards = None
+            for _ in range(2):
+                api, requests_made = pull(pages_allowed)
+                self.assertDictEqual({'case': 'partial'}, api.data_type_statuses)
+                checkpoint = get_stored_state(s3_mock, 'case')['checkpoint']
+                self.assertEqual(test_case['return_value']['shard_count'], len(checkpoint['shards']))
+                if previous_shards is None:
+                    # Only the first run probes the date range to split it into shards
+                    self.assertEqual(1, requests_made[0]['limit'])
+                    self.assertEqual(pages_allowed + 1, len(requests_made))
+                else:
+                    # Every shard picks up where it stopped, and no shard starts over or pulls a finished range
+                    first_requests = get_first_requests(requests_made)
+                    unfinished_shards = {shard['end_time']: shard['start_time'] for shard in previous_shards if shard['start_time'] != shard['end_time']}
+                    self.assertDictEqual({end_time: unfinished_shards.get(end_time) for end_time in first_requests}, first_requests)
+                    self.assertEqual(pages_allowed, len(requests_made))
+                previous_shards = checkpoint['shards']
+
+            api, requests_made = pull(100)
+            self.assertDictEqual({'case': 'complete'}, api.data_type_statuses)
+            self.assertDictEqual({'last_successful_job_time': '2024-01-01T01:00:00'}, get_stored_state(s3_mock, 'case'))
+            stored_ids = {item['id'] for stored_file in s3_mock.objects[BUCKET] if stored_file['Key'].endswith('.json') and stored_file['Key'] != STATE_KEY for item in stored_file['Body']['objects']}
+            self.assertSetEqual({item['id'] for item in INDEXED_ON_OBJECTS}, stored_ids)
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_commcareapihandlerpull_throttled_pull_data(self):
+        print('*** Running test_commcareapihandlerpull_throttled_pull_data ***')
+        test_data = [
+            {
+                'name': 'retried_after_429',
+                'parameters': {
+                    'throttled_count': 2,
+                    'status_code': 429,
+                    'max_throttle_retries': 5
+                },
+                'return_value': [
+                    'test_domain/snowflake-copy/case/2024/01/01/01/case_2024-01-01T00:00:00_2024-01-01T00:20:00.json',
+                    'test_domain/snowflake-copy/case/2024/01/01/01/case_2024-01-01T00:20:00_2024-01-01T01:00:00.json'
+                ],
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'retried_after_503',
+                'parameters': {
+                    'throttled_count': 1,
+                    'status_code': 503,
+                    'max_throttle_retries': 5
+                },
+                'return_value': [
+                    'test_domain/snowflake-copy/case/2024/01/01/01/case_2024-01-01T00:00:00_2024-01-01T00:20:00.json',
+                    'test_domain/snowflake-copy/case/2024/01/01/01/case_2024-01-01T00:20:00_2024-01-01T01:00:00.json'
+                ],
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'gives_up_after_max_retries',
+                'parameters': {
+                    'throttled_count': 3,
+                    'status_code': 429,
+                    'max_throttle_retries': 2
+                },
+                'return_value': None,
+                'expect_exception': True,
+                'exception': APIError("Request failed! Code: 429. Reason: None. Details: {}", 429)
+            }
+        ]
+
+        def test_function(self, test_case):
+            s3_mock = Boto3ClientMock(objects={BUCKET: []})
+            api = generate_pull_api(
+                generate_mock_get_throttled(generate_mock_get_pages(CASE_PAGES), test_case['parameters']['throttled_count'], test_case['parameters']['status_code']),
+                max_throttle_retries=test_case['parameters']['max_throttle_retries']
+            )
+            with use_boto3_client_mocks(s3=s3_mock):
+                api.pull_data(CASE_DATA_TYPE)
+            self.assertListEqual(test_case['return_value'], sorted(item['Key'] for item in s3_mock.objects[BUCKET]))
+            # Retried requests count against the request limit
+            self.assertEqual(len(CASE_PAGES) + test_case['parameters']['throttled_count'], api.request_count)
+            self.assertEqual(test_case['parameters']['throttled_count'], api.retry_count)
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_commcareapihandlerpull_transient_failures(self):
+        print('*** Running test_commcareapihandlerpull_transient_failures ***')
+        test_data = [
+            {
+                'name': 'retried_after_server_error',
+                'parameters': {
+                    'failures': [MockResponse(status_code=502, ok=False)],
+                    'request_limit': 100,
+                    'raises_request_limit': False
+                },
+                'return_value': 3,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'retried_after_connection_reset',
+                'parameters': {
+                    'failures': [requests.exceptions.ConnectionError('Connection reset by peer.')],
+                    'request_limit': 100,
+                    'raises_request_limit': False
+                },
+                'return_value': 3,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'gives_up_after_max_attempts',
+                'parameters': {
+                    'failures': [MockResponse(status_code=500, ok=False, reason='Server Error')] * 4,
+                    'request_limit': 100,
+                    'raises_request_limit': False
+                },
+                'return_value': None,
+                'expect_exception': True,
+                'exception': APIError("Request failed! Code: 500. Reason: Server Error. Details: {}", 500)
+            },
+            {
+                'name': 'retries_respect_request_limit',
+                'parameters': {
+                    'failures': [MockResponse(status_code=500, ok=False)] * 2,
+                    'request_limit': 2,
+                    'raises_request_limit': True
+                },
+                'return_value': None,
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            failures = list(test_case['parameters']['failures'])
+            get_pages = generate_mock_get_pages(CASE_PAGES)
+
+            def mock_get_failing_first(url, headers, params):
+                if failures:
+                    failure = failures.pop(0)
+                    if isinstance(failure, Exception):
+                        raise failure
+                    return failure
+                return get_pages(url, headers, params)
+
+            s3_mock = Boto3ClientMock(objects={BUCKET: []})
+            api = generate_pull_api(mock_get_failing_first, request_limit=test_case['parameters']['request_limit'])
+            with use_boto3_client_mocks(s3=s3_mock), unittest.mock.patch.object(CommCareAPIHandler.time, 'sleep'):
+                if test_case['parameters']['raises_request_limit']:
+                    with self.assertRaisesRegex(Exception, "Request limit reached for API Handler"):
+                        api.pull_data(CASE_DATA_TYPE)
+                    self.assertEqual(2, api.request_count)
+                    return
+                api.pull_data(CASE_DATA_TYPE)
+            self.assertEqual(test_case['return_value'], api.request_count)
+            self.assertEqual(len(test_case['parameters']['failures']), api.retry_count)
+            metrics = api.metrics.summary()
+            self.assertEqual(len(test_case['parameters']['failures']), metrics['domain']['Retries']['count'])
+            self.assertEqual(len(CASE_PAGES), metrics['data_types']['case']['Pages']['count'])
+            self.assertEqual(len(CASE_PAGES), metrics['data_types']['case']['Files']['count'])
+            self.assertEqual(len(CASE_PAGES), metrics['data_types']['case']['ApiRequestLatency']['count'])
+            self.assertListEqual(CASE_PAGES, [item['Body'] for item in sorted(s3_mock.objects[BUCKET], key=lambda item: item['Key'])])
+
+        run_test_cases(self, test_data, test_function)
 
 
 # TODO: Implement CommCareAPIHandlerPull tests
 """
 class TestCommCareAPIHandlerPull(unittest.TestCase):
+    def setUp(self):
+        self.enterContext(use_boto3_client_mocks(get_boto3_client_mock))
+
     def test_commcareapihandlerpull_filepath(self):
         test_data = [
             {
@@ -0,0 +1,220 @@
+import asyncio
+import importlib
+import requests
+import json
+import unittest
+import unittest.mock
+
+from datetime import datetime
+from unittest.mock import MagicMock
+from testing.boto3_mock import Boto3ClientMock
+from testing.requests_mock import (
+    CASE_DATA_TYPE,
+    CASE_PAGES,
+    FORM_DATA_TYPE,
+    FORM_PAGES,
+    INDEXED_ON_OBJECTS,
+    MockAsyncTransport,
+    generate_mock_get_by_data_type,
+    generate_mock_get_indexed_on,
+    generate_mock_get_pages,
+    generate_mock_get_throttled,
+    mock_get,
+    mock_request
+)
+from testing.util import (
+    fake_json_file_load,
+    generate_get_boto3_client_mock_function,
+    run_test_cases,
+    use_boto3_client_mocks
+)
+
+get_boto3_client_mock = generate_get_boto3_client_mock_function(
+    {
+        'ssm': {
+            'parameters': {},
+            'objects': {}
+        },
+        's3': {
+            'parameters': {},
+            'objects': {}
+        }
+    }
+)
+
+requests.get = MagicMock(side_effect=mock_get)
+requests.post = MagicMock(side_effect=mock_request)
+json.load = MagicMock(side_effect=fake_json_file_load)
+
+import CommCareAPIHandler
+importlib.reload(CommCareAPIHandler)
+import CommCareAPIHandlerAsync
+importlib.reload(CommCareAPIHandlerAsync)
+from CommCareAPIHandlerAsync import CommCareAPIHandlerPullAsync
+from lambda_function import DateRangeTuple
+
+BUCKET = 'commcare-snowflake-data-sync'
+
+
+def generate_mock_get_recording_concurrency(get_function, in_flight):
+    """
+        Wraps a mock get function in a slow coroutine that records the largest number of requests that were
+        in flight at once.
+    """
+    async def mock_get_recording_concurrency(url, headers, params):
+        in_flight['current'] += 1
+        in_flight['max'] = max(in_flight['max'], in_flight['current'])
+        response = get_function(url, headers, params)
+        await asyncio.sleep(0.01)
+        in_flight['current'] -= 1
+        return response
+
+    return mock_get_recording_concurrency
+
+
+def generate_pull_api(pages, **kwargs):
+    return CommCareAPIHandlerPullAsync(
+        False,
+        'test_domain',
+        'test_domain-api-key',
+        datetime.strptime('2024-01-01 01:00:00', '%Y-%m-%d %H:%M:%S'),
+        custom_date_range_config=DateRangeTuple(
+            datetime.strptime('2024-01-01 00:00:00', '%Y-%m-%d %H:%M:%S'),
+            datetime.strptime('2024-01-01 01:00:00', '%Y-%m-%d %H:%M:%S')),
+        use_lag=False,
+        async_transport=MockAsyncTransport(get=pages if callable(pages) else generate_mock_get_pages(pages) if isinstance(pages, list) else generate_mock_get_by_data_type(pages)),
+        **kwargs
+    )
+
+
+class TestCommCareAPIHandlerPullAsync(unittest.TestCase):
+    def setUp(self):
+        self.enterContext(use_boto3_client_mocks(get_boto3_client_mock))
+
+    def test_commcareapihandlerpullasync_pull_data_for_domain(self):
+        print('*** Running test_commcareapihandlerpullasync_pull_data_for_domain ***')
+        test_data = [
+            {
+                'name': 'serial_uploads',
+                'parameters': {
+                    'pipeline_uploads': False,
+                    'request_limit': 100,
+                    'raises_request_limit': False,
+                    'throttled_count': 0
+                },
+                'return_value': [
+                    'test_domain/snowflake-copy/case/2024/01/01/01/case_2024-01-01T00:00:00_2024-01-01T00:20:00.json',
+                    'test_domain/snowflake-copy/case/2024/01/01/01/case_2024-01-01T00:20:00_2024-01-01T01:00:00.json',
+                    'test_domain/snowflake-copy/form/2024/01/01/01/form_2024-01-01T00:00:00_2024-01-01T01:00:00.json'
+                ],
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'pipelined_uploads',
+                'parameters': {
+                    'pipeline_uploads': True,
+                    'request_limit': 100,
+                    'raises_request_limit': False,
+                    'throttled_count': 0
+                },
+                'return_value': [
+                    'test_domain/snowflake-copy/case/2024/01/01/01/case_2024-01-01T00:00:00_2024-01-01T00:20:00.json',
+                    'test_domain/snowflake-copy/case/2024/01/01/01/case_2024-01-01T00:20:00_2024-01-01T01:00:00.json',
+                    'test_domain/snowflake-copy/form/2024/01/01/01/form_2024-01-01T00:00:00_2024-01-01T01:00:00.json'
+                ],
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'data_types_share_request_limit',
+                'parameters': {
+                    'pipeline_uploads': False,
+                    'request_limit': 2,
+                    'raises_request_limit': True,
+                    'throttled_count': 0
+                },
+                'return_value': None,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'throttled_requests_retried',
+                'parameters': {
+                    'pipeline_uploads': False,
+                    'request_limit': 100,
+                    'raises_request_limit': False,
+                    'throttled_count': 2
+                },
+                'return_value': [
+                    'test_domain/snowflake-copy/case/2024/01/01/01/case_2024-01-01T00:00:00_2024-01-01T00:20:00.json',
+                    'test_domain/snowflake-copy/case/2024/01/01/01/case_2024-01-01T00:20:00_2024-01-01T01:00:00.json',
+                    'test_domain/snowflake-copy/form/2024/01/01/01/form_2024-01-01T00:00:00_2024-01-01T01:00:00.json'
+                ],
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            s3_mock = Boto3ClientMock(objects={BUCKET: []})
+            api = generate_pull_api(
+                generate_mock_get_throttled(generate_mock_get_by_data_type({'case': CASE_PAGES, 'form': FORM_PAGES}), test_case['parameters']['throttled_count']),
+                request_limit=test_case['parameters']['request_limit'],
+                pipeline_uploads=test_case['parameters']['pipeline_uploads']
+            )
+            with use_boto3_client_mocks(s3=s3_mock):
+                if test_case['parameters']['raises_request_limit']:
+                    with self.assertRaisesRegex(Exception, "Request limit reached for API Handler"):
+                        api.pull_data_for_domain({'case': CASE_DATA_TYPE, 'form': FORM_DATA_TYPE})
+                    self.assertEqual(2, api.request_count)
+                    return
+                api.pull_data_for_domain({'case': CASE_DATA_TYPE, 'form': FORM_DATA_TYPE})
+            stored_files = sorted(s3_mock.objects[BUCKET], key=lambda item: item['Key'])
+            self.assertListEqual(test_case['return_value'], [item['Key'] for item in stored_files])
+            self.assertListEqual(CASE_PAGES + FORM_PAGES, [item['Body'] for item in stored_files])
+            self.assertEqual(3 + test_case['parameters']['throttled_count'], api.request_count)
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_commcareapihandlerpullasync_max_concurrency(self):
+        print('*** Running test_commcareapihandlerpullasync_max_concurrency ***')
+        test_data = [
+            {
+                'name': 'one_request_at_a_time',
+                'parameters': {
+                    'max_concurrency': 1
+                },
+                'return_value': 1,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'shards_requested_concurrently',
+                'parameters': {
+                    'max_concurrency': 2
+                },
+                'return_value': 2,
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            s3_mock = Boto3ClientMock(objects={BUCKET: []})
+            in_flight = {'current': 0, 'max': 0}
+            api = generate_pull_api(
+                generate_mock_get_recording_concurrency(generate_mock_get_indexed_on(INDEXED_ON_OBJECTS), in_flight),
+                max_concurrency=test_case['parameters']['max_concurrency']
+            )
+            with use_boto3_client_mocks(s3=s3_mock):
+                api.pull_data_for_domain({'case': dict(CASE_DATA_TYPE, limit=3, shard_count=3)})
+            self.assertEqual(test_case['return_value'], in_flight['max'])
+            stored_ids = {item['id'] for stored_file in s3_mock.objects[BUCKET] for item in stored_file['Body']['objects']}
+            self.assertSetEqual({item['id'] for item in INDEXED_ON_OBJECTS}, stored_ids)
+
+        run_test_cases(self, test_data, test_function)
+
+
+if __name__ == '__main__':
+    unittest.main()
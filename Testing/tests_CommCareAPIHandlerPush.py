@@ -1,18 +1,20 @@
-import boto3
 import importlib
-import requests
 import json
+import requests
 import unittest
 import unittest.mock
 
 from datetime import datetime
 from unittest.mock import MagicMock
 from testing.const import POST
-from testing.requests_mock import mock_get, mock_request
+from testing.boto3_mock import Boto3ClientMock
+from testing.requests_mock import MockTransport
 from testing.util import (
+    MockResponse,
     fake_json_file_load,
     generate_get_boto3_client_mock_function,
-    run_test_cases
+    run_test_cases,
+    use_boto3_client_mocks
 )
 
 get_boto3_client_mock = generate_get_boto3_client_mock_function(
@@ -55,17 +57,19 @@ get_boto3_client_mock = generate_get_boto3_client_mock_function(
     }
 )
 
-boto3.client = MagicMock(side_effect=get_boto3_client_mock)
-requests.get = MagicMock(side_effect=mock_get)
-requests.request = MagicMock(side_effect=mock_request)
 json.load = MagicMock(side_effect=fake_json_file_load)
 
 import CommCareAPIHandler
 importlib.reload(CommCareAPIHandler)
 from CommCareAPIHandler import CommCareAPIHandlerPush
+import util
+from util import APIError
 
 
 class TestCommCareAPIHandlerPush(unittest.TestCase):
+    def setUp(self):
+        self.enterContext(use_boto3_client_mocks(get_boto3_client_mock))
+
     def __init__(self, methodName):
         super().__init__(methodName)
         self.api = CommCareAPIHandlerPush(
@@ -73,7 +77,8 @@ class TestCommCareAPIHandlerPush(unittest.TestCase):
             'test_domain',
             'test_domain-api-key',
             datetime.strptime(
-                '2024-01-01 00:00:00', '%Y-%m-%d %H:%M:%S')
+                '2024-01-01 00:00:00', '%Y-%m-%d %H:%M:%S'),
+            transport=MockTransport()
         )
 
     def test_commcareapihandlerpush_filepath(self):
@@ -136,7 +141,7 @@ class TestCommCareAPIHandlerPush(unittest.TestCase):
                 'parameters': {
                     'specifier': 'test_specifier_missing'
                 },
-                'return_value': None,
+                'return_value': [],
                 'expect_exception': False,
                 'exception': None
             }
@@ -146,13 +151,76 @@ class TestCommCareAPIHandlerPush(unittest.TestCase):
             request_content = self.api._get_request_content(
                 test_case['parameters']['specifier']
             )
-            if test_case['return_value'] is None:
-                self.assertIsNone(request_content)
-            else:
-                self.assertListEqual(
-                    test_case['return_value'],
-                    request_content
-                )
+            self.assertListEqual(
+                test_case['return_value'],
+                list(request_content)
+            )
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_commcareapihandlerpush_get_request_content_paginated(self):
+        print('*** Running test_commcareapihandlerpush_get_request_content_paginated ***')
+        test_data = [
+            {
+                'name': 'one_key_per_page_read_as_yielded',
+                'parameters': {
+                    'max_keys': 1,
+                    'prefetch_count': 1
+                },
+                'return_value': {
+                    'list_calls_after_first_payload': 2,
+                    'list_calls': 5
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'one_key_per_page_prefetched',
+                'parameters': {
+                    'max_keys': 1,
+                    'prefetch_count': 4
+                },
+                'return_value': {
+                    'list_calls_after_first_payload': 5,
+                    'list_calls': 5
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'single_page',
+                'parameters': {
+                    'max_keys': 1000,
+                    'prefetch_count': 4
+                },
+                'return_value': {
+                    'list_calls_after_first_payload': 1,
+                    'list_calls': 1
+                },
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        payloads = [{'value': f'test_3.{number}'} for number in range(1, 6)]
+
+        def test_function(self, test_case):
+            s3_client = Boto3ClientMock(objects={
+                'commcare-snowflake-data-sync': [
+                    {'Key': f'test_domain/payload/test_specifier_3/2024/01/01/00/test_{number}.json', 'Body': payload}
+                    for number, payload in enumerate(payloads, start=1)
+                ]
+            })
+            with unittest.mock.patch.object(CommCareAPIHandler, 'S3_LIST_MAX_KEYS', test_case['parameters']['max_keys']), \
+                    unittest.mock.patch.object(CommCareAPIHandler, 'PUSH_PREFETCH_COUNT', test_case['parameters']['prefetch_count']), \
+                    unittest.mock.patch.object(s3_client, 'list_objects_v2', wraps=s3_client.list_objects_v2) as list_objects_v2, \
+                    use_boto3_client_mocks(s3=s3_client):
+                request_content = self.api._get_request_content('test_specifier_3')
+                self.assertDictEqual(payloads[0], next(request_content))
+                # Only the keys of the payloads prefetched so far have been listed
+                self.assertEqual(test_case['return_value']['list_calls_after_first_payload'], list_objects_v2.call_count)
+                self.assertListEqual(payloads[1:], list(request_content))
+            self.assertEqual(test_case['return_value']['list_calls'], list_objects_v2.call_count)
 
         run_test_cases(self, test_data, test_function)
 
@@ -260,6 +328,196 @@ class TestCommCareAPIHandlerPush(unittest.TestCase):
 
         run_test_cases(self, test_data, test_function)
 
+    def test_commcareapihandlerpush_make_request_retries(self):
+        print('*** Running test_commcareapihandlerpush_make_request_retries ***')
+        test_data = [
+            {
+                'name': 'post_not_retried_after_server_error',
+                'parameters': {
+                    'method': POST,
+                    'outcomes': [MockResponse(status_code=500, ok=False, reason='Server Error'), MockResponse()]
+                },
+                'return_value': 1,
+                'expect_exception': True,
+                'exception': APIError("Request failed! Code: 500. Reason: Server Error. Details: {}", 500)
+            },
+            {
+                'name': 'put_retried_after_server_error',
+                'parameters': {
+                    'method': 'PUT',
+                    'outcomes': [MockResponse(status_code=502, ok=False), MockResponse()]
+                },
+                'return_value': 2,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'post_retried_after_connect_timeout',
+                'parameters': {
+                    'method': POST,
+                    'outcomes': [requests.exceptions.ConnectTimeout('Connection timed out.'), MockResponse()]
+                },
+                'return_value': 2,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'post_not_retried_after_connection_reset',
+                'parameters': {
+                    'method': POST,
+                    'outcomes': [requests.exceptions.ConnectionError('Connection reset by peer.'), MockResponse()]
+                },
+                'return_value': 1,
+                'expect_exception': True,
+                'exception': requests.exceptions.ConnectionError('Connection reset by peer.')
+            },
+            {
+                'name': 'post_retried_after_429',
+                'parameters': {
+                    'method': POST,
+                    'outcomes': [MockResponse(status_code=429, ok=False, headers={'Retry-After': '0'}), MockResponse()]
+                },
+                'return_value': 2,
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            outcomes = iter(test_case['parameters']['outcomes'])
+            calls = []
+
+            def mock_request_outcomes(method, url, headers, json):
+                calls.append(method)
+                outcome = next(outcomes)
+                if isinstance(outcome, Exception):
+                    raise outcome
+                return outcome
+
+            api = CommCareAPIHandlerPush(
+                False,
+                'test_domain',
+                'test_domain-api-key',
+                datetime.strptime('2024-01-01 00:00:00', '%Y-%m-%d %H:%M:%S'),
+                transport=MockTransport(request=mock_request_outcomes)
+            )
+            try:
+                with unittest.mock.patch.object(CommCareAPIHandler.time, 'sleep'):
+                    api._make_request({}, 'test_name', 'https://www.commcarehq.org/a/test_domain/api/', test_case['parameters']['method'])
+            finally:
+                self.assertEqual(test_case['return_value'], len(calls))
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_commcareapihandlerpush_get_entity_keys(self):
+        print('*** Running test_commcareapihandlerpush_get_entity_keys ***')
+        test_data = [
+            {
+                'name': 'case_id_and_external_id',
+                'parameters': {
+                    'data': {'case_id': 'a', 'external_id': 'x', 'case_type': 'patient'}
+                },
+                'return_value': [('case_id', 'a'), ('external_id', 'x')],
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'indexed_parents',
+                'parameters': {
+                    'data': {
+                        'case_id': 'b',
+                        'indices': {
+                            'parent': {'case_id': 'a', 'case_type': 'patient', 'relationship': 'child'},
+                            'host': {'external_id': 'x', 'case_type': 'household', 'relationship': 'extension'}
+                        }
+                    }
+                },
+                'return_value': [('case_id', 'b'), ('case_id', 'a'), ('external_id', 'x')],
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'bulk_payload',
+                'parameters': {
+                    'data': [{'case_id': 'a'}, {'external_id': 'y', 'indices': {'parent': {'external_id': 'x'}}}, 'not a case']
+                },
+                'return_value': [('case_id', 'a'), ('external_id', 'y'), ('external_id', 'x')],
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            self.assertListEqual(test_case['return_value'], self.api._get_entity_keys(test_case['parameters']['data']))
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_commcareapihandlerpush_push_concurrently(self):
+        print('*** Running test_commcareapihandlerpush_push_concurrently ***')
+        test_data = [
+            {
+                'name': 'all_pushed',
+                'parameters': {
+                    'failing_values': []
+                },
+                'return_value': [],
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'failures_aggregated_and_rest_of_entity_skipped',
+                'parameters': {
+                    'failing_values': ['a1', 'c1']
+                },
+                'return_value': [
+                    {'payload': 1, 'error': 'Request failed! Code: 400. Reason: Bad Request. Details: {}'},
+                    {'payload': 3, 'error': 'Skipped, as payload #1 for the same entity failed.'},
+                    {'payload': 5, 'error': 'Request failed! Code: 400. Reason: Bad Request. Details: {}'},
+                    {'payload': 6, 'error': 'Skipped, as payload #1 for the same entity failed.'}
+                ],
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+        payloads = [
+            {'case_id': 'a', 'value': 'a1'},
+            {'case_id': 'b', 'value': 'b1'},
+            {'case_id': 'a', 'value': 'a2'},
+            {'case_id': 'b', 'value': 'b2'},
+            {'case_id': 'c', 'value': 'c1'},
+            {'case_id': 'd', 'indices': {'parent': {'case_id': 'a', 'case_type': 'patient', 'relationship': 'child'}}, 'value': 'd1'}
+        ]
+
+        def test_function(self, test_case):
+            pushed_values = []
+
+            def mock_request(method, url, headers, json):
+                if json['value'] in test_case['parameters']['failing_values']:
+                    return MockResponse(status_code=400, ok=False, reason='Bad Request')
+                pushed_values.append(json['value'])
+                return MockResponse()
+
+            api = CommCareAPIHandlerPush(
+                False,
+                'test_domain',
+                'test_domain-api-key',
+                datetime.strptime('2024-01-01 00:00:00', '%Y-%m-%d %H:%M:%S'),
+                transport=MockTransport(request=mock_request),
+                push_concurrency=3
+            )
+            # tests_util reloads util, so the APIError raised by process_response may not be the one imported here
+            with unittest.mock.patch.object(CommCareAPIHandler, 'APIError', util.APIError):
+                failures = api._push_concurrently(enumerate(payloads, start=1), 'case', 'https://www.commcarehq.org/a/test_domain/api/', POST, {})
+            self.assertListEqual(test_case['return_value'], failures)
+            failed_payloads = [failure['payload'] for failure in failures]
+            self.assertCountEqual([payload['value'] for index, payload in enumerate(payloads) if index + 1 not in failed_payloads], pushed_values)
+            # Payloads for the same case are pushed in the order they were stored
+            self.assertListEqual([value for value in pushed_values if value.startswith('b')], ['b1', 'b2'])
+            # A child case is pushed after the payloads for the parent its index points to
+            self.assertListEqual([value for value in pushed_values if value[0] in 'ad'], [value for value in ['a1', 'a2', 'd1'] if value in pushed_values])
+
+        run_test_cases(self, test_data, test_function)
+
 
 if __name__ == '__main__':
     unittest.main()
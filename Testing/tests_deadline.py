@@ -0,0 +1,121 @@
+import unittest
+import unittest.mock
+
+from unittest.mock import MagicMock
+from testing.util import run_test_cases
+
+import deadline
+
+
+class TestDeadline(unittest.TestCase):
+    def test_deadline_allows_next_page(self):
+        print('*** Running test_deadline_allows_next_page ***')
+        test_data = [
+            {
+                'name': 'no_pages_yet',
+                'parameters': {
+                    'seconds_remaining': 20,
+                    'page_times': [],
+                    'seconds_elapsed': 0
+                },
+                'return_value': True,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'next_page_fits_before_margin',
+                'parameters': {
+                    'seconds_remaining': 60,
+                    'page_times': [10, 10],
+                    'seconds_elapsed': 20
+                },
+                'return_value': True,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'next_page_runs_into_margin',
+                'parameters': {
+                    'seconds_remaining': 60,
+                    'page_times': [10, 10, 10, 10],
+                    'seconds_elapsed': 40
+                },
+                'return_value': False,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'one_slow_page_smoothed',
+                'parameters': {
+                    'seconds_remaining': 60,
+                    'page_times': [2, 2, 30],
+                    'seconds_elapsed': 34
+                },
+                'return_value': True,
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            with unittest.mock.patch.object(deadline.time, 'monotonic', MagicMock(return_value=0)):
+                pull_deadline = deadline.Deadline(test_case['parameters']['seconds_remaining'], margin_seconds=15)
+            for page_time in test_case['parameters']['page_times']:
+                pull_deadline.record_page(page_time)
+            with unittest.mock.patch.object(deadline.time, 'monotonic', MagicMock(return_value=test_case['parameters']['seconds_elapsed'])):
+                self.assertEqual(test_case['return_value'], pull_deadline.allows_next_page())
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_deadline_from_context(self):
+        print('*** Running test_deadline_from_context ***')
+        test_data = [
+            {
+                'name': 'context_only',
+                'parameters': {
+                    'remaining_time_in_millis': 900000,
+                    'budget_seconds': None
+                },
+                'return_value': 900,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'budget_shorter_than_context',
+                'parameters': {
+                    'remaining_time_in_millis': 900000,
+                    'budget_seconds': 120
+                },
+                'return_value': 120,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'no_context_or_budget',
+                'parameters': {
+                    'remaining_time_in_millis': None,
+                    'budget_seconds': None
+                },
+                'return_value': None,
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            context = None
+            if test_case['parameters']['remaining_time_in_millis'] is not None:
+                context = MagicMock()
+                context.get_remaining_time_in_millis.return_value = test_case['parameters']['remaining_time_in_millis']
+            with unittest.mock.patch.object(deadline.time, 'monotonic', MagicMock(return_value=0)):
+                pull_deadline = deadline.Deadline.from_context(context, test_case['parameters']['budget_seconds'])
+                if test_case['return_value'] is None:
+                    self.assertIsNone(pull_deadline)
+                else:
+                    self.assertEqual(test_case['return_value'], pull_deadline.seconds_remaining())
+
+        run_test_cases(self, test_data, test_function)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,227 @@
+import importlib
+import json
+import os
+import subprocess
+import sys
+import unittest
+import unittest.mock
+
+from unittest.mock import MagicMock
+from testing.util import (
+    generate_get_boto3_client_mock_function,
+    run_test_cases,
+    use_boto3_client_mocks
+)
+
+get_boto3_client_mock = generate_get_boto3_client_mock_function(
+    {
+        'ssm': {
+            'parameters': {},
+            'objects': {}
+        },
+        's3': {
+            'parameters': {},
+            'objects': {}
+        }
+    }
+)
+
+import lambda_function
+importlib.reload(lambda_function)
+from util import APIError
+
+NO_METRICS = {'domain': {}, 'data_types': {}}
+CASE_PAGE_METRICS = {'domain': {}, 'data_types': {'case': {'Pages': {'count': 1, 'sum': 1, 'max': 1, 'unit': 'Count'}}}}
+
+
+class MockAPIHandlerPull():
+    """
+        Stand-in for CommCareAPIHandlerPull whose pulls fail for "failing_domain", and stop at the deadline
+        for "partial_domain". Pulls that do not fail record a single page of cases.
+    """
+
+    def __init__(self, is_staging, domain, api_token_for_domain, event_time, metrics, **kwargs):
+        self.domain = domain
+        self.metrics = metrics
+        self.data_type_statuses = {}
+
+    def pull_data_for_domain(self, api_details):
+        if self.domain == 'failing_domain':
+            raise APIError("Request failed! Code: 500.", 500)
+        self.metrics.record('Pages', 1, data_type_name='case')
+        self.data_type_statuses = {'case': 'partial' if self.domain == 'partial_domain' else 'complete'}
+
+    @property
+    def resume_needed(self):
+        return self.data_type_statuses['case'] != 'complete'
+
+
+class TestLambdaFunction(unittest.TestCase):
+    def setUp(self):
+        self.enterContext(use_boto3_client_mocks(get_boto3_client_mock))
+
+    def test_lambda_function_import(self):
+        print('*** Running test_lambda_function_import ***')
+        test_data = [
+            {
+                'name': 'async_modules_not_loaded',
+                'parameters': {
+                    'modules': ['asyncio', 'aiohttp', 'CommCareAPIHandlerAsync']
+                },
+                'return_value': [],
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            # Imported in a fresh interpreter, as the other tests have already loaded every module
+            script = f"import sys, lambda_function; print([name for name in {test_case['parameters']['modules']!r} if name in sys.modules])"
+            output = subprocess.run([sys.executable, '-c', script], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), capture_output=True, text=True, check=True).stdout
+            self.assertEqual(repr(test_case['return_value']), output.strip().splitlines()[-1])
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_lambda_handler_domains(self):
+        print('*** Running test_lambda_handler_domains ***')
+        test_data = [
+            {
+                'name': 'single_domain',
+                'parameters': {
+                    'event': {
+                        'domain': 'domain_a',
+                        'operation_type': 'cc_to_s3',
+                        'api_info': {}
+                    }
+                },
+                'return_value': {
+                    'statusCode': 200,
+                    'body': {'message': 'CommCare to S3 data pull successful.', 'metrics': CASE_PAGE_METRICS}
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'many_domains_with_one_failing',
+                'parameters': {
+                    'event': {
+                        'domains': [
+                            {'domain': 'domain_a', 'api_info': {}},
+                            {'domain': 'failing_domain', 'api_info': {}},
+                            {'domain': 'domain_b', 'api_info': {}}
+                        ],
+                        'domain_concurrency': 2,
+                        'operation_type': 'cc_to_s3'
+                    }
+                },
+                'return_value': {
+                    'statusCode': 200,
+                    'body': {
+                        'message': 'CommCare to S3 data pull finished for 3 domains with 1 failures.',
+                        'domains': {
+                            'domain_a': {'status': 'success', 'metrics': CASE_PAGE_METRICS},
+                            'failing_domain': {'status': 'failed', 'error': 'Request failed! Code: 500.', 'metrics': NO_METRICS},
+                            'domain_b': {'status': 'success', 'metrics': CASE_PAGE_METRICS}
+                        },
+                        'resume_needed': False,
+                        'metrics': NO_METRICS
+                    }
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'single_domain_stopped_at_deadline',
+                'parameters': {
+                    'event': {
+                        'domain': 'partial_domain',
+                        'operation_type': 'cc_to_s3',
+                        'api_info': {}
+                    }
+                },
+                'return_value': {
+                    'statusCode': 200,
+                    'body': {
+                        'message': 'CommCare to S3 data pull stopped at the deadline. Resume needed.',
+                        'status': 'partial',
+                        'resume_needed': True,
+                        'data_types': {'case': 'partial'},
+                        'metrics': CASE_PAGE_METRICS
+                    }
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'many_domains_with_one_stopped_at_deadline',
+                'parameters': {
+                    'event': {
+                        'domains': [
+                            {'domain': 'domain_a', 'api_info': {}},
+                            {'domain': 'partial_domain', 'api_info': {}}
+                        ],
+                        'operation_type': 'cc_to_s3'
+                    }
+                },
+                'return_value': {
+                    'statusCode': 200,
+                    'body': {
+                        'message': 'CommCare to S3 data pull finished for 2 domains with 0 failures.',
+                        'domains': {
+                            'domain_a': {'status': 'success', 'metrics': CASE_PAGE_METRICS},
+                            'partial_domain': {'status': 'partial', 'data_types': {'case': 'partial'}, 'metrics': CASE_PAGE_METRICS}
+                        },
+                        'resume_needed': True,
+                        'metrics': NO_METRICS
+                    }
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'domains_missing_api_info',
+                'parameters': {
+                    'event': {
+                        'domains': [
+                            {'domain': 'domain_a'}
+                        ],
+                        'operation_type': 'cc_to_s3'
+                    }
+                },
+                'return_value': {
+                    'statusCode': 400,
+                    'body': {'message': 'Every item in domains must have a domain and api_info.'}
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'no_domain',
+                'parameters': {
+                    'event': {
+                        'operation_type': 'cc_to_s3',
+                        'api_info': {}
+                    }
+                },
+                'return_value': {
+                    'statusCode': 400,
+                    'body': {'message': 'domain was missing in event data.'}
+                },
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            with unittest.mock.patch.object(lambda_function, 'CommCareAPIHandlerPull', MockAPIHandlerPull), \
+                    unittest.mock.patch.object(lambda_function, 'get_api_token', MagicMock(return_value='api-key')), \
+                    unittest.mock.patch.object(lambda_function, 'prefetch_api_tokens', MagicMock()):
+                response = lambda_function.lambda_handler(test_case['parameters']['event'], None)
+            self.assertEqual(test_case['return_value']['statusCode'], response['statusCode'])
+            self.assertDictEqual(test_case['return_value']['body'], json.loads(response['body']))
+
+        run_test_cases(self, test_data, test_function)
+
+
+if __name__ == '__main__':
+    unittest.main()
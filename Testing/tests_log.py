@@ -0,0 +1,126 @@
+import io
+import json
+import logging
+import unittest
+import unittest.mock
+
+from unittest.mock import MagicMock
+from testing.util import run_test_cases
+
+from log import JsonFormatter, PayloadSummary, get_logger, truncate
+
+
+class TestLog(unittest.TestCase):
+    def test_json_formatter(self):
+        print('*** Running test_json_formatter ***')
+        test_data = [
+            {
+                'name': 'context_fields_written',
+                'parameters': {
+                    'context': {'domain': 'test-domain'},
+                    'extra': {'data_type': 'case', 'request_number': 3}
+                },
+                'return_value': {'level': 'INFO', 'message': 'Request 3 done.', 'domain': 'test-domain', 'data_type': 'case', 'request_number': 3},
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'no_context',
+                'parameters': {
+                    'context': {},
+                    'extra': {}
+                },
+                'return_value': {'level': 'INFO', 'message': 'Request 3 done.'},
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'extra_none',
+                'parameters': {
+                    'context': {'domain': 'test-domain'},
+                    'extra': None
+                },
+                'return_value': {'level': 'INFO', 'message': 'Request 3 done.', 'domain': 'test-domain'},
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            stream = io.StringIO()
+            handler = logging.StreamHandler(stream)
+            handler.setFormatter(JsonFormatter())
+            logging.getLogger('commcare_sync.test').addHandler(handler)
+            logging.getLogger('commcare_sync.test').setLevel(logging.INFO)
+            try:
+                get_logger('test', **test_case['parameters']['context']).info("Request %s done.", 3, extra=test_case['parameters']['extra'])
+            finally:
+                logging.getLogger('commcare_sync.test').removeHandler(handler)
+            log_record = json.loads(stream.getvalue())
+            self.assertEqual('commcare_sync.test', log_record.pop('logger'))
+            log_record.pop('timestamp')
+            self.assertDictEqual(test_case['return_value'], log_record)
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_payload_summary(self):
+        print('*** Running test_payload_summary ***')
+        test_data = [
+            {
+                'name': 'single_case',
+                'parameters': {
+                    'payload': {'case_id': 'abc', 'properties': {'name': 'x' * 1000}},
+                    'max_ids': 5
+                },
+                'return_value': '1046 bytes, ids: abc',
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'ids_capped',
+                'parameters': {
+                    'payload': [{'id': 1}, {'id': 2}, {'id': 3}],
+                    'max_ids': 2
+                },
+                'return_value': '33 bytes, 3 objects, ids: 1, 2 and 1 more',
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'no_ids',
+                'parameters': {
+                    'payload': {'success': True},
+                    'max_ids': 5
+                },
+                'return_value': '17 bytes',
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            summary = PayloadSummary(test_case['parameters']['payload'], test_case['parameters']['max_ids'])
+            self.assertEqual(test_case['return_value'], str(summary))
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_lazy_formatting(self):
+        print('*** Running test_lazy_formatting ***')
+        logger = logging.getLogger('commcare_sync.test')
+        logger.setLevel(logging.INFO)
+        handler = logging.StreamHandler(io.StringIO())
+        logger.addHandler(handler)
+        # The payload is never summarized when debug records are not written
+        try:
+            with unittest.mock.patch.object(PayloadSummary, '__str__', MagicMock(return_value='')) as str_mock:
+                logger.debug("Request data: %s", PayloadSummary({'case_id': 'abc'}))
+                str_mock.assert_not_called()
+                logger.info("Request data: %s", PayloadSummary({'case_id': 'abc'}))
+                str_mock.assert_called()
+        finally:
+            logger.removeHandler(handler)
+        self.assertEqual('x' * 10 + '... (5 more characters)', truncate('x' * 15, 10))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+import json
+import unittest
+import unittest.mock
+
+from botocore.exceptions import ClientError
+from unittest.mock import MagicMock
+from testing.util import run_test_cases
+
+import metrics
+from metrics import BYTES, MeteredClient, MetricsRecorder
+
+
+class TestMetrics(unittest.TestCase):
+    def test_metrics_recorder_summary(self):
+        print('*** Running test_metrics_recorder_summary ***')
+        test_data = [
+            {
+                'name': 'domain_and_data_type_metrics_kept_apart',
+                'parameters': {
+                    'records': [
+                        ('Retries', 1, 'Count', None),
+                        ('PageBytes', 300, BYTES, 'case'),
+                        ('PageBytes', 200, BYTES, 'case'),
+                        ('PageBytes', 50, BYTES, 'form')
+                    ]
+                },
+                'return_value': {
+                    'domain': {'Retries': {'count': 1, 'sum': 1, 'max': 1, 'unit': 'Count'}},
+                    'data_types': {
+                        'case': {'PageBytes': {'count': 2, 'sum': 500, 'max': 300, 'unit': 'Bytes'}},
+                        'form': {'PageBytes': {'count': 1, 'sum': 50, 'max': 50, 'unit': 'Bytes'}}
+                    }
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'nothing_recorded',
+                'parameters': {
+                    'records': []
+                },
+                'return_value': {'domain': {}, 'data_types': {}},
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            recorder = MetricsRecorder('test-domain')
+            for name, value, unit, data_type_name in test_case['parameters']['records']:
+                recorder.record(name, value, unit, data_type_name)
+            self.assertDictEqual(test_case['return_value'], recorder.summary())
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_metrics_recorder_emit(self):
+        print('*** Running test_metrics_recorder_emit ***')
+        test_data = [
+            {
+                'name': 'one_line_per_data_type',
+                'parameters': {
+                    'value_count': 3
+                },
+                'return_value': [3],
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'values_split_across_lines',
+                'parameters': {
+                    'value_count': 250
+                },
+                'return_value': [100, 100, 50],
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            recorder = MetricsRecorder('test-domain')
+            for value in range(test_case['parameters']['value_count']):
+                recorder.record('PageBytes', value, BYTES, 'case')
+            with unittest.mock.patch('builtins.print') as print_mock:
+                recorder.emit()
+            log_lines = [json.loads(call.args[0]) for call in print_mock.call_args_list]
+            self.assertListEqual(test_case['return_value'], [len(log_line['PageBytes']) for log_line in log_lines])
+            for log_line in log_lines:
+                self.assertEqual('test-domain', log_line['Domain'])
+                self.assertEqual('case', log_line['DataType'])
+                self.assertDictEqual({
+                    'Namespace': metrics.METRICS_NAMESPACE,
+                    'Dimensions': [['Domain', 'DataType']],
+                    'Metrics': [{'Name': 'PageBytes', 'Unit': 'Bytes'}]
+                }, log_line['_aws']['CloudWatchMetrics'][0])
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_metered_client(self):
+        print('*** Running test_metered_client ***')
+        test_data = [
+            {
+                'name': 'call_timed',
+                'parameters': {
+                    'error': None
+                },
+                'return_value': ['S3PutObjectLatency'],
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'failed_call_counted',
+                'parameters': {
+                    'error': ClientError({'Error': {'Code': 'SlowDown', 'Message': 'SlowDown'}}, 'PutObject')
+                },
+                'return_value': ['S3PutObjectErrors', 'S3PutObjectLatency'],
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            recorder = MetricsRecorder('test-domain')
+            client = MagicMock()
+            client.put_object.side_effect = test_case['parameters']['error']
+            metered_client = MeteredClient(client, recorder, 'S3')
+            if test_case['parameters']['error']:
+                with self.assertRaises(ClientError):
+                    metered_client.put_object(Bucket='bucket', Key='key', Body='body')
+            else:
+                metered_client.put_object(Bucket='bucket', Key='key', Body='body')
+            client.put_object.assert_called_once_with(Bucket='bucket', Key='key', Body='body')
+            self.assertListEqual(test_case['return_value'], list(recorder.summary()['domain'].keys()))
+
+        run_test_cases(self, test_data, test_function)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,406 @@
+import gzip
+import importlib.util
+import json
+import sys
+import unittest
+import unittest.mock
+
+from testing.util import run_test_cases
+
+import output
+
+
+class FakePage():
+    def __init__(self, objects, size_in_bytes=10):
+        self.meta = {'limit': 2, 'next': None, 'total_count': len(objects)}
+        self.objects = objects
+        self.object_count = len(objects)
+        self.size_in_bytes = size_in_bytes
+        self.data = {'meta': self.meta, 'objects': objects}
+        self.body = None
+
+    @property
+    def objects_fragment(self):
+        return json.dumps(self.objects)[1:-1].encode('utf-8')
+
+zstandard_installed = importlib.util.find_spec('zstandard') is not None
+pyarrow_installed = importlib.util.find_spec('pyarrow') is not None
+
+
+class TestOutput(unittest.TestCase):
+    def test_resolve_compression(self):
+        print('*** Running test_resolve_compression ***')
+        test_data = [
+            {
+                'name': 'no_compression',
+                'parameters': {
+                    'compression': None
+                },
+                'return_value': None,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'gzip',
+                'parameters': {
+                    'compression': 'gzip'
+                },
+                'return_value': 'gzip',
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'zstd',
+                'parameters': {
+                    'compression': 'zstd'
+                },
+                'return_value': 'zstd' if zstandard_installed else 'gzip',
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'unsupported',
+                'parameters': {
+                    'compression': 'bz2'
+                },
+                'return_value': None,
+                'expect_exception': True,
+                'exception': ValueError("Unsupported compression: bz2. Expected one of: gzip, zstd.")
+            }
+        ]
+
+        def test_function(self, test_case):
+            self.assertEqual(
+                test_case['return_value'],
+                output.resolve_compression(test_case['parameters']['compression'])
+            )
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_resolve_output_format(self):
+        print('*** Running test_resolve_output_format ***')
+        test_data = [
+            {
+                'name': 'json',
+                'parameters': {
+                    'output_format': 'json',
+                    'pyarrow_installed': True
+                },
+                'return_value': 'json',
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'parquet_without_pyarrow',
+                'parameters': {
+                    'output_format': 'parquet',
+                    'pyarrow_installed': False
+                },
+                'return_value': 'json',
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'unsupported',
+                'parameters': {
+                    'output_format': 'xml',
+                    'pyarrow_installed': True
+                },
+                'return_value': None,
+                'expect_exception': True,
+                'exception': ValueError("Unsupported output format: xml. Expected one of: json, ndjson, parquet.")
+            }
+        ]
+        if pyarrow_installed:
+            test_data.append({
+                'name': 'parquet_with_pyarrow',
+                'parameters': {
+                    'output_format': 'parquet',
+                    'pyarrow_installed': True
+                },
+                'return_value': 'parquet',
+                'expect_exception': False,
+                'exception': None
+            })
+
+        def test_function(self, test_case):
+            output.resolve_output_format.cache_clear()
+            hidden_modules = {} if test_case['parameters']['pyarrow_installed'] else {'pyarrow': None}
+            with unittest.mock.patch.dict(sys.modules, hidden_modules):
+                self.assertEqual(
+                    test_case['return_value'],
+                    output.resolve_output_format(test_case['parameters']['output_format'])
+                )
+            output.resolve_output_format.cache_clear()
+
+        run_test_cases(self, test_data, test_function)
+
+    @unittest.skipUnless(pyarrow_installed, "pyarrow is not installed")
+    def test_parquet_encoder(self):
+        print('*** Running test_parquet_encoder ***')
+        import pyarrow.parquet
+        first_page = FakePage([
+            {'id': 'a', 'properties': {'name': 'a'}, 'indices': {}},
+            {'id': 'b', 'properties': {'name': 'b'}, 'indices': {}}
+        ])
+        new_property_page = FakePage([{'id': 'c', 'properties': {'name': 'c', 'age': '3'}, 'indices': {}}])
+        indexed_page = FakePage([{'id': 'g', 'properties': {'name': 'g'}, 'indices': {'parent': {'case_id': 'a'}}}])
+        conflicting_page = FakePage([{'id': 'd', 'properties': {'name': {'first': 'd'}}}])
+        mixed_repeat_page = FakePage([
+            {'id': 'e', 'form': {'visit': {'date': '2024-01-01'}, 'age': '12'}},
+            {'id': 'f', 'form': {'visit': [{'date': '2024-01-02'}, {'date': '2024-01-03'}], 'age': 12}}
+        ])
+        test_data = [
+            {
+                'name': 'struct_columns',
+                'parameters': {
+                    'flatten': False,
+                    'pages': [[first_page]]
+                },
+                'return_value': ['id', 'properties', 'indices'],
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'schema_widened_by_later_file',
+                'parameters': {
+                    'flatten': False,
+                    'pages': [[first_page], [new_property_page]]
+                },
+                'return_value': ['id', 'properties', 'indices'],
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'empty_struct_written_as_null',
+                'parameters': {
+                    'flatten': False,
+                    'pages': [[first_page]]
+                },
+                'return_value': ['id', 'properties', 'indices'],
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'empty_struct_widened_by_later_file',
+                'parameters': {
+                    'flatten': False,
+                    'pages': [[first_page], [indexed_page]]
+                },
+                'return_value': ['id', 'properties', 'indices'],
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'flattened_columns',
+                'parameters': {
+                    'flatten': True,
+                    'pages': [[first_page], [new_property_page]]
+                },
+                'return_value': ['id', 'properties.name', 'properties.age', 'indices'],
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'conflicting_file_coerced_to_cached_schema',
+                'parameters': {
+                    'flatten': True,
+                    'pages': [[first_page], [conflicting_page], [new_property_page]]
+                },
+                'return_value': ['id', 'properties.name', 'properties.age', 'indices'],
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'mixed_repeat_group_coerced',
+                'parameters': {
+                    'flatten': False,
+                    'pages': [[mixed_repeat_page]]
+                },
+                'return_value': ['id', 'form'],
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            encoder = output.ParquetEncoder(flatten=test_case['parameters']['flatten'])
+            for pages in test_case['parameters']['pages']:
+                table = pyarrow.parquet.read_table(encoder.encode(pages))
+            self.assertListEqual(test_case['return_value'], table.column_names)
+            self.assertEqual(sum(page.object_count for page in pages), table.num_rows)
+            if test_case['name'] == 'schema_widened_by_later_file':
+                self.assertDictEqual({'name': 'c', 'age': '3'}, table.to_pylist()[0]['properties'])
+            if test_case['name'] == 'empty_struct_written_as_null':
+                self.assertListEqual([None, None], [row['indices'] for row in table.to_pylist()])
+            if test_case['name'] == 'empty_struct_widened_by_later_file':
+                self.assertDictEqual({'parent': {'case_id': 'a'}}, table.to_pylist()[0]['indices'])
+            if test_case['name'] == 'conflicting_file_coerced_to_cached_schema':
+                self.assertEqual(pyarrow.string(), encoder.schema.field('properties').type.field('name').type)
+            if test_case['name'] == 'mixed_repeat_group_coerced':
+                self.assertListEqual([
+                    {'visit': '{"date": "2024-01-01"}', 'age': '12'},
+                    {'visit': '[{"date": "2024-01-02"}, {"date": "2024-01-03"}]', 'age': '12'}
+                ], [row['form'] for row in table.to_pylist()])
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_encode_file(self):
+        print('*** Running test_encode_file ***')
+        pages = [FakePage([{'id': 'a'}, {'id': 'b'}]), FakePage([{'id': 'c'}])]
+        test_data = [
+            {
+                'name': 'json_single_page',
+                'parameters': {
+                    'pages': pages[:1],
+                    'output_format': 'json',
+                    'compression': None
+                },
+                'decode': json.loads,
+                'return_value': pages[0].data,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'json_merged_pages',
+                'parameters': {
+                    'pages': pages,
+                    'output_format': 'json',
+                    'compression': None
+                },
+                'decode': json.loads,
+                'return_value': {
+                    'meta': {'limit': 2, 'next': None, 'total_count': 3},
+                    'objects': [{'id': 'a'}, {'id': 'b'}, {'id': 'c'}]
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'json_gzip',
+                'parameters': {
+                    'pages': pages,
+                    'output_format': 'json',
+                    'compression': 'gzip'
+                },
+                'decode': lambda body: json.loads(gzip.decompress(body)),
+                'return_value': {
+                    'meta': {'limit': 2, 'next': None, 'total_count': 3},
+                    'objects': [{'id': 'a'}, {'id': 'b'}, {'id': 'c'}]
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'ndjson',
+                'parameters': {
+                    'pages': pages,
+                    'output_format': 'ndjson',
+                    'compression': None
+                },
+                'decode': lambda body: body.decode('utf-8'),
+                'return_value': '{"id": "a"}\n{"id": "b"}\n{"id": "c"}\n',
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'ndjson_gzip',
+                'parameters': {
+                    'pages': pages,
+                    'output_format': 'ndjson',
+                    'compression': 'gzip'
+                },
+                'decode': lambda body: gzip.decompress(body).decode('utf-8'),
+                'return_value': '{"id": "a"}\n{"id": "b"}\n{"id": "c"}\n',
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'unsupported_format',
+                'parameters': {
+                    'pages': pages,
+                    'output_format': 'xml',
+                    'compression': None
+                },
+                'decode': None,
+                'return_value': None,
+                'expect_exception': True,
+                'exception': ValueError("Unsupported output format: xml. Expected one of: json, ndjson.")
+            }
+        ]
+        if zstandard_installed:
+            import zstandard
+            test_data.append({
+                'name': 'ndjson_zstd',
+                'parameters': {
+                    'pages': pages,
+                    'output_format': 'ndjson',
+                    'compression': 'zstd'
+                },
+                'decode': lambda body: zstandard.ZstdDecompressor().decompressobj().decompress(body).decode('utf-8'),
+                'return_value': '{"id": "a"}\n{"id": "b"}\n{"id": "c"}\n',
+                'expect_exception': False,
+                'exception': None
+            })
+
+        def test_function(self, test_case):
+            body = output.encode_file(
+                test_case['parameters']['pages'],
+                test_case['parameters']['output_format'],
+                test_case['parameters']['compression']
+            )
+            self.assertEqual(test_case['return_value'], test_case['decode'](body.read()))
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_file_roller(self):
+        print('*** Running test_file_roller ***')
+        test_data = [
+            {
+                'name': 'no_target_size_flushes_every_page',
+                'parameters': {
+                    'target_size_in_bytes': None,
+                    'page_sizes': [10, 10, 10]
+                },
+                'return_value': [(1, 0, 1), (1, 1, 2), (1, 2, 3)],
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'pages_coalesced_up_to_target_size',
+                'parameters': {
+                    'target_size_in_bytes': 25,
+                    'page_sizes': [10, 10, 10, 10, 10]
+                },
+                'return_value': [(2, 0, 2), (2, 2, 4), (1, 4, 5)],
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'oversized_page_gets_own_file',
+                'parameters': {
+                    'target_size_in_bytes': 25,
+                    'page_sizes': [10, 40, 10]
+                },
+                'return_value': [(1, 0, 1), (1, 1, 2), (1, 2, 3)],
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            flushed_files = []
+            roller = output.FileRoller(
+                lambda pages, start, end: flushed_files.append((len(pages), start, end)),
+                test_case['parameters']['target_size_in_bytes']
+            )
+            for index, page_size in enumerate(test_case['parameters']['page_sizes']):
+                roller.add(FakePage([{'id': index}], page_size), index, index + 1)
+            roller.flush()
+            self.assertListEqual(test_case['return_value'], flushed_files)
+
+        run_test_cases(self, test_data, test_function)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,188 @@
+import json
+import unittest
+import unittest.mock
+
+from testing.util import (
+    MockResponse,
+    generate_get_boto3_client_mock_function,
+    run_test_cases,
+    use_boto3_client_mocks
+)
+
+get_boto3_client_mock = generate_get_boto3_client_mock_function(
+    {
+        'ssm': {
+            'parameters': {},
+            'objects': {}
+        }
+    }
+)
+
+from page import Page
+
+FULL_PAGE = {
+    'meta': {'limit': 2, 'next': '?cursor=1', 'total_count': 3},
+    'objects': [
+        {'id': 'a', 'indexed_on': '2024-01-01T00:10:00.000000Z', 'properties': {'name': 'a'}},
+        {'id': 'b', 'indexed_on': '2024-01-01T00:20:00.000000Z', 'properties': {'name': 'b'}}
+    ]
+}
+LAST_PAGE = {
+    'meta': {'limit': 2, 'next': None, 'total_count': 1},
+    'objects': [
+        {'id': 'c', 'indexed_on': '2024-01-01T00:30:00.000000Z', 'properties': {'name': 'c'}}
+    ]
+}
+OFFSET_LAST_PAGE = {
+    'meta': {'limit': 100, 'next': None, 'offset': 200, 'total_count': 203},
+    'objects': [{'id': 'd'}, {'id': 'e'}, {'id': 'f'}]
+}
+CURSOR_LAST_PAGE = {
+    'meta': {'limit': 100, 'next': None, 'offset': 0, 'total_count': 203},
+    'objects': [{'id': 'd'}, {'id': 'e'}, {'id': 'f'}]
+}
+EMPTY_PAGE = {
+    'meta': {'limit': 2, 'next': None, 'total_count': 0},
+    'objects': []
+}
+
+
+class ObjectsFirstResponse(MockResponse):
+    @property
+    def content(self):
+        return json.dumps({'objects': self.json_data['objects'], 'meta': self.json_data['meta']}).encode('utf-8')
+
+
+class TestPage(unittest.TestCase):
+    def setUp(self):
+        self.enterContext(use_boto3_client_mocks(get_boto3_client_mock))
+
+    def test_page_from_response(self):
+        print('*** Running test_page_from_response ***')
+        test_data = [
+            {
+                'name': 'parsed_full_page',
+                'parameters': {
+                    'response': MockResponse(json_data=FULL_PAGE),
+                    'raw': False
+                },
+                'return_value': {
+                    'object_count': 2,
+                    'last_indexed_on': '2024-01-01T00:20:00.000000Z',
+                    'payload': FULL_PAGE
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'raw_full_page',
+                'parameters': {
+                    'response': MockResponse(json_data=FULL_PAGE),
+                    'raw': True
+                },
+                'return_value': {
+                    'object_count': 2,
+                    'last_indexed_on': '2024-01-01T00:20:00.000000Z',
+                    'payload': json.dumps(FULL_PAGE).encode('utf-8')
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'raw_last_page',
+                'parameters': {
+                    'response': MockResponse(json_data=LAST_PAGE),
+                    'raw': True
+                },
+                'return_value': {
+                    'object_count': 1,
+                    'last_indexed_on': '2024-01-01T00:30:00.000000Z',
+                    'payload': json.dumps(LAST_PAGE).encode('utf-8')
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'raw_offset_last_page',
+                'parameters': {
+                    'response': MockResponse(json_data=OFFSET_LAST_PAGE),
+                    'raw': True
+                },
+                'return_value': {
+                    'object_count': 3,
+                    'last_indexed_on': None,
+                    'payload': json.dumps(OFFSET_LAST_PAGE).encode('utf-8')
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'raw_cursor_last_page_counted',
+                'parameters': {
+                    'response': MockResponse(json_data=CURSOR_LAST_PAGE),
+                    'raw': True
+                },
+                'return_value': {
+                    'object_count': 3,
+                    'last_indexed_on': None,
+                    'payload': json.dumps(CURSOR_LAST_PAGE).encode('utf-8')
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'raw_empty_page',
+                'parameters': {
+                    'response': MockResponse(json_data=EMPTY_PAGE),
+                    'raw': True
+                },
+                'return_value': {
+                    'object_count': 0,
+                    'last_indexed_on': None,
+                    'payload': json.dumps(EMPTY_PAGE).encode('utf-8')
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'raw_objects_before_meta_falls_back_to_parsing',
+                'parameters': {
+                    'response': ObjectsFirstResponse(json_data=FULL_PAGE),
+                    'raw': True
+                },
+                'return_value': {
+                    'object_count': 2,
+                    'last_indexed_on': '2024-01-01T00:20:00.000000Z',
+                    'payload': ObjectsFirstResponse(json_data=FULL_PAGE).content
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'raw_failed_request',
+                'parameters': {
+                    'response': MockResponse(status_code=500, ok=False, reason='Test'),
+                    'raw': True
+                },
+                'return_value': None,
+                'expect_exception': True,
+                'exception': Exception("Request failed! Code: 500. Reason: Test. Details: {}")
+            }
+        ]
+
+        def test_function(self, test_case):
+            page = Page.from_response(test_case['parameters']['response'], raw=test_case['parameters']['raw'])
+            self.assertEqual(len(test_case['parameters']['response'].content), page.size_in_bytes)
+            self.assertEqual(test_case['return_value']['object_count'], page.object_count)
+            if test_case['parameters']['raw']:
+                self.assertEqual(test_case['return_value']['payload'], page.body)
+            else:
+                self.assertEqual(test_case['return_value']['payload'], page.data)
+            if test_case['return_value']['last_indexed_on']:
+                self.assertEqual(test_case['return_value']['last_indexed_on'], page.last_indexed_on)
+
+        run_test_cases(self, test_data, test_function)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,226 @@
+import asyncio
+import unittest
+import unittest.mock
+
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from unittest.mock import MagicMock
+from testing.util import (
+    MockResponse,
+    run_test_cases
+)
+
+import ratelimit
+from const import DEFAULT_MAX_RETRY_AFTER_SECONDS, DEFAULT_THROTTLE_BACKOFF_SECONDS
+from CommCareAPIHandlerAsync import AsyncConcurrencyLimit
+from ratelimit import ConcurrencyLimit, TokenBucket, get_rate_limiter, get_retry_after_seconds
+
+
+class TestRateLimit(unittest.TestCase):
+    def test_get_retry_after_seconds(self):
+        print('*** Running test_get_retry_after_seconds ***')
+        test_data = [
+            {
+                'name': 'seconds',
+                'parameters': {
+                    'headers': {'Retry-After': '7'}
+                },
+                'return_value': 7,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'http_date_in_the_past',
+                'parameters': {
+                    'headers': {'Retry-After': format_datetime(datetime.now(timezone.utc) - timedelta(minutes=1), usegmt=True)}
+                },
+                'return_value': 0,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'capped',
+                'parameters': {
+                    'headers': {'Retry-After': '3600'}
+                },
+                'return_value': DEFAULT_MAX_RETRY_AFTER_SECONDS,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'missing_header',
+                'parameters': {
+                    'headers': {}
+                },
+                'return_value': DEFAULT_THROTTLE_BACKOFF_SECONDS,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'unreadable_header',
+                'parameters': {
+                    'headers': {'Retry-After': 'soon'}
+                },
+                'return_value': DEFAULT_THROTTLE_BACKOFF_SECONDS,
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            response = MockResponse(status_code=429, ok=False, headers=test_case['parameters']['headers'])
+            self.assertEqual(test_case['return_value'], get_retry_after_seconds(response))
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_token_bucket_reserve(self):
+        print('*** Running test_token_bucket_reserve ***')
+        test_data = [
+            {
+                'name': 'paced_after_burst',
+                'parameters': {
+                    'requests_per_second': 2,
+                    'burst': 2,
+                    'pause_seconds': 0
+                },
+                'return_value': [0, 0, 0.5, 1.0],
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'unpaced_without_rate',
+                'parameters': {
+                    'requests_per_second': None,
+                    'burst': None,
+                    'pause_seconds': 0
+                },
+                'return_value': [0, 0, 0, 0],
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'paused_by_retry_after',
+                'parameters': {
+                    'requests_per_second': None,
+                    'burst': None,
+                    'pause_seconds': 3
+                },
+                'return_value': [3, 3, 3, 3],
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            with unittest.mock.patch.object(ratelimit.time, 'monotonic', MagicMock(return_value=100)):
+                bucket = TokenBucket(test_case['parameters']['requests_per_second'], test_case['parameters']['burst'])
+                bucket.pause(test_case['parameters']['pause_seconds'])
+                self.assertListEqual(test_case['return_value'], [bucket.reserve() for _ in range(4)])
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_get_rate_limiter(self):
+        print('*** Running test_get_rate_limiter ***')
+        test_data = [
+            {
+                'name': 'rate_not_carried_over',
+                'parameters': {
+                    'requests_per_second': 0.5,
+                    'pause_seconds': 0
+                },
+                'return_value': [0, 0, 0, 0],
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'pause_carried_over',
+                'parameters': {
+                    'requests_per_second': 0.5,
+                    'pause_seconds': 3
+                },
+                'return_value': [3, 3, 3, 3],
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            with unittest.mock.patch.object(ratelimit, '_rate_limiters', {}), \
+                    unittest.mock.patch.object(ratelimit.time, 'monotonic', MagicMock(return_value=100)):
+                # An invocation paces its requests, and may be throttled
+                rate_limiter = get_rate_limiter('https://www.commcarehq.org', test_case['parameters']['requests_per_second'])
+                for _ in range(4):
+                    rate_limiter.reserve()
+                rate_limiter.pause(test_case['parameters']['pause_seconds'])
+                # A later warm invocation gives no rate
+                rate_limiter = get_rate_limiter('https://www.commcarehq.org')
+                self.assertListEqual(test_case['return_value'], [rate_limiter.reserve() for _ in range(4)])
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_concurrency_limit(self):
+        print('*** Running test_concurrency_limit ***')
+        test_data = [
+            {
+                'name': 'halved_when_throttled',
+                'parameters': {
+                    'maximum': 8,
+                    'outcomes': [True, True]
+                },
+                'return_value': 2,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'grows_back_by_one_per_limit_of_successes',
+                'parameters': {
+                    'maximum': 8,
+                    'outcomes': [True, True] + [False] * 2 + [False] * 3
+                },
+                'return_value': 4,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'never_below_one',
+                'parameters': {
+                    'maximum': 2,
+                    'outcomes': [True, True, True]
+                },
+                'return_value': 1,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'never_above_maximum',
+                'parameters': {
+                    'maximum': 2,
+                    'outcomes': [False] * 10
+                },
+                'return_value': 2,
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            concurrency_limit = ConcurrencyLimit(test_case['parameters']['maximum'])
+            for throttled in test_case['parameters']['outcomes']:
+                concurrency_limit.acquire()
+                concurrency_limit.release(throttled)
+            self.assertEqual(test_case['return_value'], concurrency_limit.limit)
+
+            async def run_async():
+                async_concurrency_limit = AsyncConcurrencyLimit(test_case['parameters']['maximum'])
+                for throttled in test_case['parameters']['outcomes']:
+                    await async_concurrency_limit.acquire()
+                    await async_concurrency_limit.release(throttled)
+                return async_concurrency_limit.limit
+
+            self.assertEqual(test_case['return_value'], asyncio.run(run_async()))
+
+        run_test_cases(self, test_data, test_function)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import io
+import unittest
+import unittest.mock
+
+from botocore.exceptions import ClientError, EndpointConnectionError
+from unittest.mock import MagicMock
+from testing.util import run_test_cases
+
+import retry
+from retry import RetryingClient, RetryPolicy
+
+
+def s3_error(code, status_code=400):
+    return ClientError({'Error': {'Code': code, 'Message': code}, 'ResponseMetadata': {'HTTPStatusCode': status_code}}, 'PutObject')
+
+
+class TestRetry(unittest.TestCase):
+    def test_retry_policy_get_delay_seconds(self):
+        print('*** Running test_retry_policy_get_delay_seconds ***')
+        test_data = [
+            {
+                'name': 'doubled_each_attempt',
+                'parameters': {
+                    'base_delay_seconds': 0.5,
+                    'max_delay_seconds': 20,
+                    'attempts': [1, 2, 3, 4]
+                },
+                'return_value': [0.5, 1, 2, 4],
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'capped_at_max_delay',
+                'parameters': {
+                    'base_delay_seconds': 1,
+                    'max_delay_seconds': 5,
+                    'attempts': [3, 4, 10]
+                },
+                'return_value': [4, 5, 5],
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            retry_policy = RetryPolicy(10, test_case['parameters']['base_delay_seconds'], test_case['parameters']['max_delay_seconds'])
+            # Full jitter: delays are drawn between 0 and the backoff
+            with unittest.mock.patch.object(retry.random, 'uniform', MagicMock(side_effect=lambda low, high: (low, high))):
+                delays = [retry_policy.get_delay_seconds(attempt) for attempt in test_case['parameters']['attempts']]
+            self.assertListEqual([(0, delay) for delay in test_case['return_value']], delays)
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_retrying_client(self):
+        print('*** Running test_retrying_client ***')
+        test_data = [
+            {
+                'name': 'slow_down_retried',
+                'parameters': {
+                    'errors': [s3_error('SlowDown', 503), s3_error('SlowDown', 503)]
+                },
+                'return_value': 2,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'connection_error_retried',
+                'parameters': {
+                    'errors': [EndpointConnectionError(endpoint_url='https://s3.amazonaws.com')]
+                },
+                'return_value': 1,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'missing_key_not_retried',
+                'parameters': {
+                    'errors': [s3_error('NoSuchKey', 404)]
+                },
+                'return_value': 0,
+                'expect_exception': True,
+                'exception': s3_error('NoSuchKey', 404)
+            },
+            {
+                'name': 'precondition_failed_not_retried',
+                'parameters': {
+                    'errors': [s3_error('PreconditionFailed', 412)]
+                },
+                'return_value': 0,
+                'expect_exception': True,
+                'exception': s3_error('PreconditionFailed', 412)
+            },
+            {
+                'name': 'gives_up_after_max_attempts',
+                'parameters': {
+                    'errors': [s3_error('InternalError', 500)] * 3
+                },
+                'return_value': 2,
+                'expect_exception': True,
+                'exception': s3_error('InternalError', 500)
+            }
+        ]
+
+        def test_function(self, test_case):
+            errors = list(test_case['parameters']['errors'])
+            sent_bodies = []
+
+            def put_object(**kwargs):
+                sent_bodies.append(kwargs['Body'].read())
+                if errors:
+                    raise errors.pop(0)
+                return {'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+            client = MagicMock()
+            client.put_object.side_effect = put_object
+            on_retry = MagicMock()
+            retrying_client = RetryingClient(client, RetryPolicy(max_attempts=3), on_retry=on_retry)
+            try:
+                with unittest.mock.patch.object(retry.time, 'sleep'):
+                    retrying_client.put_object(Body=io.BytesIO(b'{}'), Bucket='bucket', Key='key')
+            finally:
+                self.assertEqual(test_case['return_value'], on_retry.call_count)
+                # A stream body is sent in full by every attempt
+                self.assertListEqual([b'{}'] * (test_case['return_value'] + 1), sent_bodies)
+            # Other calls are passed straight through
+            retrying_client.head_object(Bucket='bucket', Key='key')
+            client.head_object.assert_called_once_with(Bucket='bucket', Key='key')
+
+        run_test_cases(self, test_data, test_function)
+
+
+if __name__ == '__main__':
+    unittest.main()
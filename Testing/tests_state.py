@@ -0,0 +1,215 @@
+import json
+import unittest
+import unittest.mock
+
+from botocore.exceptions import ParamValidationError
+from testing.boto3_mock import Boto3ClientMock
+from testing.util import run_test_cases
+from state import StateManifest
+
+BUCKET = 'commcare-snowflake-data-sync'
+STATE_KEY = 'test_domain/snowflake-copy/state.json'
+
+
+def legacy_key(stored_parameter_name, data_type_name):
+    return f"test_domain/snowflake-copy/{data_type_name}/{stored_parameter_name}.txt"
+
+
+def generate_stored_object(key, body):
+    raw_body = body.encode('utf-8') if isinstance(body, str) else json.dumps(body).encode('utf-8')
+    return {'Key': key, 'RawBody': raw_body, 'Body': body}
+
+
+class TestStateManifest(unittest.TestCase):
+    def test_state_manifest_get(self):
+        print('*** Running test_state_manifest_get ***')
+        test_data = [
+            {
+                'name': 'legacy_txt_file_without_manifest',
+                'parameters': {
+                    'stored_objects': [
+                        generate_stored_object(legacy_key('last_successful_job_time', 'case'), '2024-01-01T00:00:00')
+                    ]
+                },
+                'return_value': {
+                    'value': '2024-01-01T00:00:00',
+                    'get_object_calls': 4
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'manifest_entry_preferred_over_legacy_txt_file',
+                'parameters': {
+                    'stored_objects': [
+                        generate_stored_object(STATE_KEY, {'data_types': {'case': {'last_successful_job_time': '2024-01-02T00:00:00'}}}),
+                        generate_stored_object(legacy_key('last_successful_job_time', 'case'), '2024-01-01T00:00:00')
+                    ]
+                },
+                'return_value': {
+                    'value': '2024-01-02T00:00:00',
+                    'get_object_calls': 1
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'missing_everywhere',
+                'parameters': {
+                    'stored_objects': []
+                },
+                'return_value': {
+                    'value': None,
+                    'get_object_calls': 4
+                },
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            s3_mock = Boto3ClientMock(objects={BUCKET: list(test_case['parameters']['stored_objects'])})
+            with unittest.mock.patch.object(s3_mock, 'get_object', wraps=s3_mock.get_object) as get_object:
+                state = StateManifest(s3_mock, BUCKET, STATE_KEY, legacy_key)
+                # Repeated reads are served from memory
+                for _ in range(3):
+                    self.assertEqual(test_case['return_value']['value'], state.get('case', 'last_successful_job_time'))
+            self.assertEqual(test_case['return_value']['get_object_calls'], get_object.call_count)
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_state_manifest_save(self):
+        print('*** Running test_state_manifest_save ***')
+        test_data = [
+            {
+                'name': 'legacy_values_migrated_into_new_manifest',
+                'parameters': {
+                    'stored_objects': [
+                        generate_stored_object(legacy_key('last_successful_job_time', 'case'), '2024-01-01T00:00:00')
+                    ],
+                    'changes': [('case', 'api_limit', 100)],
+                    'concurrent_manifest': None
+                },
+                'return_value': {
+                    'put_object_calls': 1,
+                    'manifest': {'data_types': {'case': {'last_successful_job_time': '2024-01-01T00:00:00', 'api_limit': 100}}}
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'unchanged_values_not_written',
+                'parameters': {
+                    'stored_objects': [
+                        generate_stored_object(STATE_KEY, {'data_types': {'case': {'api_limit': 100}}})
+                    ],
+                    'changes': [('case', 'api_limit', 100)],
+                    'concurrent_manifest': None
+                },
+                'return_value': {
+                    'put_object_calls': 0,
+                    'manifest': {'data_types': {'case': {'api_limit': 100}}}
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'concurrent_write_not_lost',
+                'parameters': {
+                    'stored_objects': [
+                        generate_stored_object(STATE_KEY, {'data_types': {'case': {'api_limit': 100}}})
+                    ],
+                    'changes': [('case', 'api_limit', 200), ('case', 'checkpoint', None)],
+                    'concurrent_manifest': {'data_types': {'case': {'api_limit': 100}, 'form': {'api_limit': 50}}}
+                },
+                'return_value': {
+                    'put_object_calls': 3,
+                    'manifest': {'data_types': {'case': {'api_limit': 200}, 'form': {'api_limit': 50}}}
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'migrated_values_not_written_over_concurrent_manifest',
+                'parameters': {
+                    'stored_objects': [
+                        generate_stored_object(legacy_key('last_successful_job_time', 'case'), '2024-01-01T00:00:00'),
+                        generate_stored_object(legacy_key('api_limit', 'case'), '100')
+                    ],
+                    'changes': [('case', 'checkpoint', {'cursor': '?offset=10'})],
+                    'concurrent_manifest': {'data_types': {'case': {'last_successful_job_time': '2024-01-02T00:00:00'}}}
+                },
+                'return_value': {
+                    'put_object_calls': 3,
+                    'manifest': {'data_types': {'case': {'last_successful_job_time': '2024-01-02T00:00:00', 'checkpoint': {'cursor': '?offset=10'}}}}
+                },
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            s3_mock = Boto3ClientMock(objects={BUCKET: list(test_case['parameters']['stored_objects'])})
+            state = StateManifest(s3_mock, BUCKET, STATE_KEY, legacy_key)
+            for data_type_name, name, value in test_case['parameters']['changes']:
+                state.set(data_type_name, name, value)
+            with unittest.mock.patch.object(s3_mock, 'put_object', wraps=s3_mock.put_object) as put_object:
+                if test_case['parameters']['concurrent_manifest']:
+                    s3_mock.put_object(Body=json.dumps(test_case['parameters']['concurrent_manifest']), Bucket=BUCKET, Key=STATE_KEY)
+                state.save()
+                # A second save with nothing changed does not write again
+                state.save()
+            self.assertEqual(test_case['return_value']['put_object_calls'], put_object.call_count)
+            manifest = [item for item in s3_mock.objects[BUCKET] if item['Key'] == STATE_KEY][0]
+            self.assertDictEqual(test_case['return_value']['manifest'], manifest['Body'])
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_state_manifest_save_without_conditional_writes(self):
+        print('*** Running test_state_manifest_save_without_conditional_writes ***')
+        test_data = [
+            {
+                'name': 'written_unconditionally',
+                'parameters': {
+                    'stored_objects': [
+                        generate_stored_object(STATE_KEY, {'data_types': {'case': {'api_limit': 100}}})
+                    ],
+                    'changes': [('case', 'api_limit', 200), ('form', 'api_limit', 50)]
+                },
+                'return_value': {
+                    'put_object_calls': 3,
+                    'manifest': {'data_types': {'case': {'api_limit': 200}, 'form': {'api_limit': 50}}}
+                },
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            s3_mock = Boto3ClientMock(objects={BUCKET: list(test_case['parameters']['stored_objects'])})
+            put_object = s3_mock.put_object
+
+            # Versions of botocore without conditional writes reject their parameters before sending the request
+            def put_object_without_conditions(**kwargs):
+                if 'IfMatch' in kwargs or 'IfNoneMatch' in kwargs:
+                    raise ParamValidationError(report='Unknown parameter in input: "IfMatch"')
+                return put_object(**kwargs)
+
+            state = StateManifest(s3_mock, BUCKET, STATE_KEY, legacy_key)
+            with unittest.mock.patch.object(s3_mock, 'put_object', side_effect=put_object_without_conditions) as mock_put_object:
+                data_type_name, name, value = test_case['parameters']['changes'][0]
+                state.set(data_type_name, name, value)
+                state.save()
+                # Later saves skip the conditional write
+                for data_type_name, name, value in test_case['parameters']['changes'][1:]:
+                    state.set(data_type_name, name, value)
+                    state.save()
+            self.assertEqual(test_case['return_value']['put_object_calls'], mock_put_object.call_count)
+            manifest = [item for item in s3_mock.objects[BUCKET] if item['Key'] == STATE_KEY][0]
+            self.assertDictEqual(test_case['return_value']['manifest'], manifest['Body'])
+
+        run_test_cases(self, test_data, test_function)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+import asyncio
+import importlib
+import unittest
+import unittest.mock
+
+from requests.exceptions import JSONDecodeError
+from unittest.mock import MagicMock
+from testing.util import (
+    MockResponse,
+    run_test_cases
+)
+
+import transport
+importlib.reload(transport)
+import CommCareAPIHandlerAsync
+importlib.reload(CommCareAPIHandlerAsync)
+
+
+class TestTransport(unittest.TestCase):
+    def test_get_transport(self):
+        print('*** Running test_get_transport ***')
+        test_data = [
+            {
+                'name': 'same_pool_size_reuses_transport',
+                'parameters': {
+                    'pool_sizes': (5, 5)
+                },
+                'return_value': True,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'different_pool_size_creates_transport',
+                'parameters': {
+                    'pool_sizes': (5, 6)
+                },
+                'return_value': False,
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            first_size, second_size = test_case['parameters']['pool_sizes']
+            first = transport.get_transport(first_size)
+            second = transport.get_transport(second_size)
+            self.assertEqual(test_case['return_value'], first is second)
+            self.assertEqual(second_size, second.pool_size)
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_commcaretransport_session(self):
+        print('*** Running test_commcaretransport_session ***')
+        test_data = [
+            {
+                'name': 'pooled_adapter_and_gzip',
+                'parameters': {
+                    'pool_size': 7
+                },
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            commcare_transport = transport.CommCareTransport(pool_size=test_case['parameters']['pool_size'])
+            adapter = commcare_transport.session.get_adapter('https://www.commcarehq.org')
+            self.assertEqual(test_case['parameters']['pool_size'], adapter._pool_maxsize)
+            self.assertIn('gzip', commcare_transport.session.headers['Accept-Encoding'])
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_commcaretransport_timeout(self):
+        print('*** Running test_commcaretransport_timeout ***')
+        test_data = [
+            {
+                'name': 'default_timeout',
+                'parameters': {
+                    'timeout': None
+                },
+                'return_value': (1, 2),
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'per_request_timeout',
+                'parameters': {
+                    'timeout': 30
+                },
+                'return_value': 30,
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            commcare_transport = transport.CommCareTransport(timeout=(1, 2))
+            commcare_transport.session.get = MagicMock(return_value=MockResponse())
+            commcare_transport.get('https://www.commcarehq.org', timeout=test_case['parameters']['timeout'])
+            self.assertEqual(
+                test_case['return_value'],
+                commcare_transport.session.get.call_args.kwargs['timeout']
+            )
+
+        run_test_cases(self, test_data, test_function)
+
+
+    def test_async_response(self):
+        print('*** Running test_async_response ***')
+        test_data = [
+            {
+                'name': 'ok_json',
+                'parameters': {
+                    'status_code': 200,
+                    'content': b'{"meta": {}}'
+                },
+                'return_value': True,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'not_ok_not_json',
+                'parameters': {
+                    'status_code': 502,
+                    'content': b'Bad Gateway'
+                },
+                'return_value': False,
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            response = CommCareAPIHandlerAsync.AsyncResponse(test_case['parameters']['status_code'], None, test_case['parameters']['content'])
+            self.assertEqual(test_case['return_value'], response.ok)
+            if response.ok:
+                self.assertDictEqual({'meta': {}}, response.json())
+            else:
+                self.assertRaises(JSONDecodeError, response.json)
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_asynccommcaretransport_without_aiohttp(self):
+        print('*** Running test_asynccommcaretransport_without_aiohttp ***')
+        test_data = [
+            {
+                'name': 'get_runs_on_sync_transport',
+                'parameters': {
+                    'timeout': 30
+                },
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            with unittest.mock.patch.object(CommCareAPIHandlerAsync, 'aiohttp', None):
+                async_transport = CommCareAPIHandlerAsync.AsyncCommCareTransport(pool_size=3)
+            self.assertIs(transport.get_transport(3), async_transport._sync_transport)
+            async_transport._sync_transport = transport.CommCareTransport(pool_size=3)
+            async_transport._sync_transport.session.get = MagicMock(return_value=MockResponse())
+            response = asyncio.run(async_transport.get('https://www.commcarehq.org', params={'limit': 1}, timeout=test_case['parameters']['timeout']))
+            self.assertTrue(response.ok)
+            self.assertEqual(test_case['parameters']['timeout'], async_transport._sync_transport.session.get.call_args.kwargs['timeout'])
+
+        run_test_cases(self, test_data, test_function)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+import asyncio
+import threading
+import unittest
+import unittest.mock
+
+from testing.util import run_test_cases
+from CommCareAPIHandlerAsync import AsyncUploader
+from uploader import BackgroundUploader, InlineUploader
+
+
+class TestUploader(unittest.TestCase):
+    def test_uploader_submit(self):
+        print('*** Running test_uploader_submit ***')
+        test_data = [
+            {
+                'name': 'inline_uploads_all',
+                'uploader_class': InlineUploader,
+                'parameters': {
+                    'values': [1, 2, 3]
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'background_uploads_all',
+                'uploader_class': BackgroundUploader,
+                'parameters': {
+                    'values': [1, 2, 3, 4, 5, 6]
+                },
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            uploaded = []
+            with test_case['uploader_class'](uploaded.append) as uploader:
+                for value in test_case['parameters']['values']:
+                    uploader.submit(value)
+                uploader.flush()
+            self.assertListEqual(test_case['parameters']['values'], sorted(uploaded))
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_background_uploader_error(self):
+        print('*** Running test_background_uploader_error ***')
+        test_data = [
+            {
+                'name': 'error_raised_on_flush',
+                'parameters': {
+                    'values': [1, 2]
+                },
+                'expect_exception': True,
+                'exception': Exception("Upload of 2 failed!")
+            },
+            {
+                'name': 'error_raised_on_next_submit',
+                'parameters': {
+                    'values': [2, 3, 4]
+                },
+                'expect_exception': True,
+                'exception': Exception("Upload of 2 failed!")
+            }
+        ]
+
+        def upload(value):
+            if value == 2:
+                raise Exception(f"Upload of {value} failed!")
+
+        def test_function(self, test_case):
+            with BackgroundUploader(upload, max_workers=1, max_pending=1) as uploader:
+                for value in test_case['parameters']['values']:
+                    uploader.submit(value)
+                uploader.flush()
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_background_uploader_backpressure(self):
+        print('*** Running test_background_uploader_backpressure ***')
+        test_data = [
+            {
+                'name': 'submit_blocks_when_full',
+                'parameters': {
+                    'max_pending': 2
+                },
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            release = threading.Event()
+            max_pending = test_case['parameters']['max_pending']
+            with BackgroundUploader(lambda value: release.wait(), max_workers=1, max_pending=max_pending) as uploader:
+                for value in range(max_pending):
+                    uploader.submit(value)
+                blocked_submit = threading.Thread(target=uploader.submit, args=(max_pending,))
+                blocked_submit.start()
+                blocked_submit.join(timeout=0.2)
+                self.assertTrue(blocked_submit.is_alive())
+                release.set()
+                blocked_submit.join()
+                uploader.flush()
+
+        run_test_cases(self, test_data, test_function)
+
+
+    def test_async_uploader(self):
+        print('*** Running test_async_uploader ***')
+        test_data = [
+            {
+                'name': 'serial_uploads_all',
+                'parameters': {
+                    'values': [1, 3, 4],
+                    'max_pending': 1
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'concurrent_uploads_all',
+                'parameters': {
+                    'values': [1, 3, 4, 5, 6],
+                    'max_pending': 3
+                },
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'serial_error_raised_on_submit',
+                'parameters': {
+                    'values': [1, 2, 3],
+                    'max_pending': 1
+                },
+                'expect_exception': True,
+                'exception': Exception("Upload of 2 failed!")
+            },
+            {
+                'name': 'concurrent_error_raised_on_flush',
+                'parameters': {
+                    'values': [1, 2],
+                    'max_pending': 3
+                },
+                'expect_exception': True,
+                'exception': Exception("Upload of 2 failed!")
+            }
+        ]
+
+        def test_function(self, test_case):
+            uploaded = []
+
+            def upload(value):
+                if value == 2:
+                    raise Exception(f"Upload of {value} failed!")
+                uploaded.append(value)
+
+            async def run_uploads():
+                async with AsyncUploader(upload, max_pending=test_case['parameters']['max_pending']) as uploader:
+                    for value in test_case['parameters']['values']:
+                        await uploader.submit(value)
+                    await uploader.flush()
+
+            asyncio.run(run_uploads())
+            self.assertListEqual(test_case['parameters']['values'], sorted(uploaded))
+
+        run_test_cases(self, test_data, test_function)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,13 +1,13 @@
-import boto3
 import importlib
 import unittest
 import unittest.mock
 
-from unittest.mock import MagicMock
+from testing.boto3_mock import Boto3ClientMock
 from testing.util import (
     MockResponse,
     generate_get_boto3_client_mock_function,
-    run_test_cases
+    run_test_cases,
+    use_boto3_client_mocks
 )
 
 get_boto3_client_mock = generate_get_boto3_client_mock_function(
@@ -23,8 +23,6 @@ get_boto3_client_mock = generate_get_boto3_client_mock_function(
     }
 )
 
-boto3.client = MagicMock(side_effect=get_boto3_client_mock)
-
 import util
 importlib.reload(util)
 
@@ -34,6 +32,9 @@ def raise_api_error(data_type):
 
 
 class TestUtil(unittest.TestCase):
+    def setUp(self):
+        self.enterContext(use_boto3_client_mocks(get_boto3_client_mock))
+
     def test_process_response(self):
         print('*** Running test_process_response ***')
         test_data = [
@@ -193,6 +194,97 @@ class TestUtil(unittest.TestCase):
 
         run_test_cases(self, test_data, test_function)
 
+    def test_api_token_cache(self):
+        print('*** Running test_api_token_cache ***')
+        test_data = [
+            {
+                'name': 'reused_within_ttl',
+                'parameters': {
+                    'ttl_seconds': 900,
+                    'invalidate': False
+                },
+                'return_value': 1,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'read_again_after_ttl',
+                'parameters': {
+                    'ttl_seconds': 0,
+                    'invalidate': False
+                },
+                'return_value': 2,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'read_again_after_invalidation',
+                'parameters': {
+                    'ttl_seconds': 900,
+                    'invalidate': True
+                },
+                'return_value': 2,
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            ssm_mock = Boto3ClientMock(parameters={'test_domain_pass-api-key': 'test_1'})
+            with use_boto3_client_mocks(ssm=ssm_mock), \
+                    unittest.mock.patch.dict(util._api_token_cache, clear=True), \
+                    unittest.mock.patch.object(util, 'API_TOKEN_CACHE_TTL_SECONDS', test_case['parameters']['ttl_seconds']), \
+                    unittest.mock.patch.object(ssm_mock, 'get_parameter', wraps=ssm_mock.get_parameter) as get_parameter:
+                self.assertEqual('test_1', util.get_api_token('test_domain_pass'))
+                if test_case['parameters']['invalidate']:
+                    util.invalidate_api_token('test_1')
+                self.assertEqual('test_1', util.get_api_token('test_domain_pass'))
+            self.assertEqual(test_case['return_value'], get_parameter.call_count)
+
+        run_test_cases(self, test_data, test_function)
+
+    def test_prefetch_api_tokens(self):
+        print('*** Running test_prefetch_api_tokens ***')
+        test_data = [
+            {
+                'name': 'batched_by_ten',
+                'parameters': {
+                    'specifiers': [f"specifier_{i}" for i in range(12)],
+                    'cached_specifiers': []
+                },
+                'return_value': 2,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'cached_tokens_not_read_again',
+                'parameters': {
+                    'specifiers': [f"specifier_{i}" for i in range(12)],
+                    'cached_specifiers': [f"specifier_{i}" for i in range(3)]
+                },
+                'return_value': 1,
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            specifiers = test_case['parameters']['specifiers']
+            ssm_mock = Boto3ClientMock(parameters={f"test_domain-{specifier}-api-key": specifier for specifier in specifiers})
+            with use_boto3_client_mocks(ssm=ssm_mock), \
+                    unittest.mock.patch.dict(util._api_token_cache, clear=True):
+                for specifier in test_case['parameters']['cached_specifiers']:
+                    util.get_api_token('test_domain', specifier)
+                with unittest.mock.patch.object(ssm_mock, 'get_parameters', wraps=ssm_mock.get_parameters) as get_parameters, \
+                        unittest.mock.patch.object(ssm_mock, 'get_parameter', wraps=ssm_mock.get_parameter) as get_parameter:
+                    util.prefetch_api_tokens([('test_domain', specifier) for specifier in specifiers])
+                    for specifier in specifiers:
+                        self.assertEqual(specifier, util.get_api_token('test_domain', specifier))
+            self.assertEqual(test_case['return_value'], get_parameters.call_count)
+            self.assertEqual(0, get_parameter.call_count)
+
+        run_test_cases(self, test_data, test_function)
+
     def test_put_value_parameter_store(self):
         print('*** Running test_process_response ***')
         test_data = [
@@ -245,6 +337,56 @@ class TestUtil(unittest.TestCase):
 
         run_test_cases(self, test_data, test_function)
 
+    def test_determine_new_api_limit(self):
+        print('*** Running test_determine_new_api_limit ***')
+        test_data = [
+            {
+                'name': 'uncompressed_size',
+                'parameters': {
+                    'current_limit': 1000,
+                    'size_in_bytes': 16000000,
+                    'compression_ratio': 1.0
+                },
+                'return_value': 500,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'compressed_size',
+                'parameters': {
+                    'current_limit': 1000,
+                    'size_in_bytes': 16000000,
+                    'compression_ratio': 0.1
+                },
+                'return_value': 5000,
+                'expect_exception': False,
+                'exception': None
+            },
+            {
+                'name': 'capped_at_max_limit',
+                'parameters': {
+                    'current_limit': 1000,
+                    'size_in_bytes': 1000000,
+                    'compression_ratio': 0.1
+                },
+                'return_value': util.APILimitCalculator.max_limit,
+                'expect_exception': False,
+                'exception': None
+            }
+        ]
+
+        def test_function(self, test_case):
+            self.assertEqual(
+                test_case['return_value'],
+                util.APILimitCalculator.determine_new_api_limit(
+                    test_case['parameters']['current_limit'],
+                    test_case['parameters']['size_in_bytes'],
+                    test_case['parameters']['compression_ratio']
+                )
+            )
+
+        run_test_cases(self, test_data, test_function)
+
 
 if __name__ == '__main__':
     unittest.main()
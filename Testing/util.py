@@ -1,3 +1,7 @@
+import clients
+import json
+
+from contextlib import contextmanager
 from testing.boto3_mock import Boto3ClientMock
 
 
@@ -19,6 +23,19 @@ def generate_get_boto3_client_mock_function(input_dict: dict):
     return get_boto3_client_mock
 
 
+@contextmanager
+def use_boto3_client_mocks(client_factory=None, **client_mocks):
+    """
+        Makes clients.get_client return mocks inside the with block: either those created by client_factory,
+        or the ones given by service name, e.g. use_boto3_client_mocks(s3=s3_mock).
+    """
+    previous_client_factory = clients.set_client_factory(client_factory or client_mocks.__getitem__)
+    try:
+        yield
+    finally:
+        clients.set_client_factory(previous_client_factory)
+
+
 def run_test_cases(self, test_data, test_function):
     for test_case in test_data:
         with self.subTest(test_case['name']):
@@ -32,11 +49,16 @@ def run_test_cases(self, test_data, test_function):
 
 
 class MockResponse:
-    def __init__(self, status_code=200, ok=True, reason=None, json_data={}):
+    def __init__(self, status_code=200, ok=True, reason=None, json_data={}, headers={}):
         self.status_code = status_code
         self.ok = ok
         self.reason = reason
         self.json_data = json_data
+        self.headers = headers
+
+    @property
+    def content(self):
+        return json.dumps(self.json_data).encode('utf-8')
 
     def json(self):
         return self.json_data
@@ -0,0 +1,44 @@
+import threading
+
+# AWS clients created so far, by service name. Kept at module level so that warm Lambda invocations reuse them.
+_clients = {}
+_client_factory = None
+_lock = threading.Lock()
+
+
+def default_client_factory(service_name):
+    # boto3 is imported on first use rather than at import time, as importing it is a large part of a cold start
+    import boto3
+    return boto3.client(service_name)
+
+
+def get_client(service_name):
+    """
+        Returns the client for an AWS service, creating it on first use.
+    """
+    with _lock:
+        if service_name not in _clients:
+            _clients[service_name] = (_client_factory or default_client_factory)(service_name)
+        return _clients[service_name]
+
+
+def set_client_factory(client_factory):
+    """
+        Replaces the function that creates clients from a service name, e.g. with one returning stand-ins in
+        tests or local runs, and forgets the clients created so far. None restores boto3. Returns the factory
+        that was replaced.
+    """
+    global _client_factory
+    with _lock:
+        previous_client_factory = _client_factory
+        _client_factory = client_factory
+        _clients.clear()
+    return previous_client_factory
+
+
+def get_s3_client():
+    return get_client('s3')
+
+
+def get_ssm_client():
+    return get_client('ssm')
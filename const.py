@@ -1 +1,81 @@
 CASE = 'case'
+
+# HTTP transport defaults used for requests made to CommCareHQ
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 120
+
+# Time an API token read from the parameter store is reused by warm Lambda invocations before being read again
+API_TOKEN_CACHE_TTL_SECONDS = 900
+# Maximum number of names SSM accepts in a single get_parameters call
+SSM_GET_PARAMETERS_BATCH_SIZE = 10
+
+# Most an automatically-determined API limit may grow by from one page to the next. The first page of a run is
+#   requested with the limit saved by the last run, so the limit is raised in steps rather than in one jump.
+API_LIMIT_MAX_GROWTH_FACTOR = 2
+
+# Maximum number of CommCareHQ requests in flight at once for the async pull engine
+DEFAULT_MAX_CONCURRENCY = 10
+
+# Maximum number of domains pulled at once when an event lists several domains
+DEFAULT_DOMAIN_CONCURRENCY = 4
+
+# Number of times a request throttled by CommCareHQ (429 or 503) is retried before it counts as an API error
+DEFAULT_MAX_THROTTLE_RETRIES = 5
+# Wait before retrying a throttled request that came without a Retry-After header
+DEFAULT_THROTTLE_BACKOFF_SECONDS = 5
+# Longest Retry-After that is honoured, so that a single response cannot stall a pull for the rest of the hour
+DEFAULT_MAX_RETRY_AFTER_SECONDS = 120
+
+# Number of times a call to CommCareHQ or S3 is made in total before a transient failure (a 5xx, a connection
+#   reset or an S3 SlowDown) is given up on
+DEFAULT_RETRY_ATTEMPTS = 4
+# Backoff before the first retry of a transient failure, doubled for each retry after it, up to the maximum
+DEFAULT_RETRY_BASE_DELAY_SECONDS = 0.5
+DEFAULT_RETRY_MAX_DELAY_SECONDS = 20
+
+# Background S3 upload defaults used when pipelined uploads are enabled
+DEFAULT_UPLOAD_WORKERS = 2
+DEFAULT_MAX_PENDING_UPLOADS = 4
+
+# Target size of files written when a data type rolls several pages into one file. This stays just
+#   under the 16MB file size that the Snowflake pipeline can handle.
+DEFAULT_TARGET_FILE_SIZE_MB = 15
+
+# Maximum number of rows per Parquet row group. Pulled files are at most a few tens of thousands of objects,
+#   so this keeps each Parquet file to a single row group.
+DEFAULT_PARQUET_ROW_GROUP_SIZE = 100000
+
+# Time kept in reserve before a deadline, for flushing pending uploads and saving checkpoints after the last page
+DEFAULT_DEADLINE_MARGIN_SECONDS = 15
+# Weight given to the latest page time in the running estimate of how long a page takes
+DEFAULT_PAGE_TIME_SMOOTHING = 0.3
+
+# Statuses of a data type's pull, reported in the lambda_handler response
+PULL_COMPLETE = 'complete'
+PULL_PARTIAL = 'partial'
+PULL_NOT_STARTED = 'not_started'
+
+# Number of times the state manifest write is retried after losing to a concurrent write
+DEFAULT_STATE_SAVE_ATTEMPTS = 3
+
+# CloudWatch namespace of the metrics emitted in Embedded Metric Format
+METRICS_NAMESPACE = 'CommCareSnowflakeDataSync'
+# Maximum number of values EMF accepts for a single metric in one log line
+EMF_MAX_VALUES_PER_METRIC = 100
+
+# Level of the log records written when LOG_LEVEL is not set in the environment
+DEFAULT_LOG_LEVEL = 'INFO'
+# Number of ids listed when a request or response body is logged as a summary instead of in full
+LOG_PAYLOAD_MAX_IDS = 5
+# Length past which logged values, such as error details, are truncated
+LOG_VALUE_MAX_LENGTH = 1000
+
+# Number of payloads pushed to CommCareHQ at the same time. 1 pushes them one after the other.
+DEFAULT_PUSH_CONCURRENCY = 1
+# Payload fields identifying the entity a pushed payload changes. Payloads sharing one are pushed in order.
+PUSH_ENTITY_KEY_FIELDS = ('case_id', 'external_id')
+# Number of payload files downloaded from S3 ahead of the payload being pushed
+PUSH_PREFETCH_COUNT = 4
+# Number of keys asked for in each page of an S3 listing. S3 returns at most 1000.
+S3_LIST_MAX_KEYS = 1000
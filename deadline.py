@@ -0,0 +1,49 @@
+import threading
+import time
+
+from const import DEFAULT_DEADLINE_MARGIN_SECONDS, DEFAULT_PAGE_TIME_SMOOTHING
+
+
+class Deadline(object):
+
+    """
+        Tracks the time left before a hard deadline, such as the Lambda timeout, and estimates from the page
+        times observed so far whether another page can be fetched and stored before it. Page times are
+        smoothed with an exponentially weighted moving average, so a single slow page does not stop a pull
+        early. margin_seconds are kept in reserve for flushing uploads and saving checkpoints.
+    """
+
+    def __init__(self, seconds_remaining, margin_seconds=DEFAULT_DEADLINE_MARGIN_SECONDS, smoothing=DEFAULT_PAGE_TIME_SMOOTHING):
+        self.expires_at = time.monotonic() + seconds_remaining
+        self.margin_seconds = margin_seconds
+        self.smoothing = smoothing
+        self.page_time_estimate = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_context(cls, context, budget_seconds=None, margin_seconds=DEFAULT_DEADLINE_MARGIN_SECONDS):
+        """
+            Returns the deadline for a Lambda invocation: the earlier of the invocation's own timeout and
+            budget_seconds from now. Returns None if there is neither.
+        """
+        seconds_remaining = []
+        if hasattr(context, 'get_remaining_time_in_millis'):
+            seconds_remaining.append(context.get_remaining_time_in_millis() / 1000)
+        if budget_seconds is not None:
+            seconds_remaining.append(float(budget_seconds))
+        if not seconds_remaining:
+            return None
+        return cls(min(seconds_remaining), margin_seconds)
+
+    def seconds_remaining(self):
+        return self.expires_at - time.monotonic()
+
+    def record_page(self, seconds):
+        with self._lock:
+            if self.page_time_estimate is None:
+                self.page_time_estimate = seconds
+            else:
+                self.page_time_estimate = self.smoothing * seconds + (1 - self.smoothing) * self.page_time_estimate
+
+    def allows_next_page(self):
+        return self.seconds_remaining() - (self.page_time_estimate or 0) > self.margin_seconds
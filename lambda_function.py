@@ -1,33 +1,77 @@
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import json
 
 from CommCareAPIHandler import CommCareAPIHandlerPull, CommCareAPIHandlerPush
+from const import DEFAULT_DEADLINE_MARGIN_SECONDS, DEFAULT_DOMAIN_CONCURRENCY, DEFAULT_MAX_CONCURRENCY, DEFAULT_PUSH_CONCURRENCY, DEFAULT_RETRY_ATTEMPTS
+from deadline import Deadline
+from log import configure_logging, get_logger, truncate
+from metrics import MetricsRecorder
 from util import (
     get_api_token,
+    prefetch_api_tokens,
 )
 
 # Date format: %Y-%m-%dT%H:%M:%S.%fZ
 DateRangeTuple = namedtuple('DateRangeTuple', ['start_time', 'end_time'])
 
+logger = get_logger(__name__)
+
 def err(msg):
-    print(f"Error: {msg}")
+    logger.error(msg)
     return {
             'statusCode': 400,
             'body': json.dumps({'message': msg})
         }
 
+def pull_domain(api_handler_class, domain, is_staging, api_info, event_time, pull_options, metrics):
+    api_token_for_domain = get_api_token(domain, metrics=metrics)
+    logger.info("Got API token.", extra={'domain': domain})
+    api_handler = api_handler_class(is_staging, domain, api_token_for_domain, event_time, request_limit=1000, metrics=metrics, **pull_options)
+    api_handler.pull_data_for_domain(api_info)
+    logger.info("Data pull finished.", extra={'domain': domain})
+    return api_handler
+
+def pull_domains(api_handler_class, domain_events, is_staging, event_time, pull_options, domain_concurrency, metrics):
+    """
+        Pulls each domain listed in domain_events, with at most domain_concurrency domains being pulled at once.
+        A domain failing does not stop the others; returns a status for every domain, with a summary of its
+        metrics. Domains stopped at the deadline are "partial", along with the status of each of their data types.
+    """
+    def pull_listed_domain(domain_event):
+        domain = domain_event['domain']
+        domain_metrics = MetricsRecorder(domain)
+        try:
+            api_handler = pull_domain(api_handler_class, domain, domain_event.get('is_staging', is_staging), domain_event['api_info'], event_time, pull_options, domain_metrics)
+            if api_handler.resume_needed:
+                return domain, {'status': 'partial', 'data_types': api_handler.data_type_statuses, 'metrics': domain_metrics.summary()}
+            return domain, {'status': 'success', 'metrics': domain_metrics.summary()}
+        except Exception as e:
+            logger.exception("Data pull failed. Details: %s", truncate(e), extra={'domain': domain})
+            return domain, {'status': 'failed', 'error': str(e), 'metrics': domain_metrics.summary()}
+
+    prefetch_api_tokens([(domain_event['domain'], None) for domain_event in domain_events], metrics)
+    logger.info("Pulling %s domains with %s workers...", len(domain_events), domain_concurrency)
+    with ThreadPoolExecutor(max_workers=domain_concurrency, thread_name_prefix='domain') as executor:
+        return dict(executor.map(pull_listed_domain, domain_events))
+
 def lambda_handler(event, context):
+    # Log records are written as JSON at LOG_LEVEL, or at the event's log_level if it has one
+    configure_logging(event.get('log_level'))
     event_time = datetime.now()
-    print(f"Loaded current event time: {event_time}.")
+    logger.info("Loaded current event time: %s.", event_time)
 
     # -- Parse parameters from event payload
-    domain = event['domain']
-    print(f"Processing domain: {domain}...")
+    domain = event.get('domain')
+    if domain:
+        logger.info("Processing domain: %s...", domain, extra={'domain': domain})
+    elif 'domains' not in event:
+        return err('domain was missing in event data.')
 
     is_staging = event.get('is_staging')
     if is_staging:
-        print("Noticed that this is a staging domain...")
+        logger.info("Noticed that this is a staging domain...")
 
     if 'operation_type' not in event:
         return err('Operation type was not specified in event data.')
@@ -36,48 +80,122 @@ def lambda_handler(event, context):
     if 'test_mode' in event:
         test_mode = bool(event['test_mode'])
 
+    # Pace requests to CommCareHQ to at most this many per second. Throttled requests are retried either way.
+    requests_per_second = float(event['requests_per_second']) if event.get('requests_per_second') else None
+    # Number of times a request to CommCareHQ or S3 is made in total before a transient failure is given up on
+    retry_attempts = int(event.get('retry_attempts', DEFAULT_RETRY_ATTEMPTS))
+
     ## -- S3 to CommCare
     if event['operation_type'] == 'cc_to_s3':
 
-        api_token_for_domain = get_api_token(domain)
-        print("Got API token for domain.")
-
         # Custom date range processing
         if 'custom_date_range' in event:
             use_lag = False
             custom_date_range_config = event['custom_date_range']
             custom_date_range_tuple = DateRangeTuple(datetime.strptime(custom_date_range_config['start_time'], "%Y-%m-%dT%H:%M:%S.%fZ"),
                 datetime.strptime(custom_date_range_config['end_time'], "%Y-%m-%dT%H:%M:%S.%fZ"))
-            print(f"Specific date range specified. Details: {custom_date_range_tuple}")
+            logger.info("Specific date range specified. Details: %s", custom_date_range_tuple)
         else:
             use_lag = event.get('use_lag') != 0
             custom_date_range_tuple = None
         
+        pull_options = {
+            'custom_date_range_config': custom_date_range_tuple,
+            'test_mode': test_mode,
+            'use_lag': use_lag,
+            'requests_per_second': requests_per_second,
+            'retry_attempts': retry_attempts,
+            # Upload files to S3 in the background while the next page is fetched
+            'pipeline_uploads': bool(event.get('pipeline_uploads')),
+            # Stop starting new pages when they would not finish before the Lambda timeout or time budget
+            'deadline': Deadline.from_context(context, event.get('time_budget_seconds'), float(event.get('deadline_margin_seconds', DEFAULT_DEADLINE_MARGIN_SECONDS)))
+        }
+        if event.get('use_async'):
+            # Pull every data type at once on an event loop, with at most max_concurrency requests in flight.
+            #   Imported here so that synchronous pulls do not pay for asyncio and aiohttp on a cold start.
+            from CommCareAPIHandlerAsync import CommCareAPIHandlerPullAsync
+            api_handler_class = CommCareAPIHandlerPullAsync
+            pull_options['max_concurrency'] = int(event.get('max_concurrency', DEFAULT_MAX_CONCURRENCY))
+            logger.info("Using the async pull engine with a max concurrency of %s...", pull_options['max_concurrency'])
+        else:
+            # Number of data types to pull at the same time
+            api_handler_class = CommCareAPIHandlerPull
+            pull_options['data_type_concurrency'] = int(event.get('data_type_concurrency', 1))
+
+        # Several domains, each with its own api_info, pulled in a single invocation
+        if 'domains' in event:
+            if any('domain' not in domain_event or 'api_info' not in domain_event for domain_event in event['domains']):
+                return err('Every item in domains must have a domain and api_info.')
+            domain_concurrency = int(event.get('domain_concurrency', DEFAULT_DOMAIN_CONCURRENCY))
+            # Metrics of the invocation as a whole, i.e. the batched API token lookup
+            invocation_metrics = MetricsRecorder()
+            domain_statuses = pull_domains(api_handler_class, event['domains'], is_staging, event_time, pull_options, domain_concurrency, invocation_metrics)
+            invocation_metrics.emit()
+            failed_domain_count = sum(1 for status in domain_statuses.values() if status['status'] == 'failed')
+            logger.info("Data pull for %s domains finished with %s failures.", len(domain_statuses), failed_domain_count)
+            return {
+                'statusCode': 200,
+                'body': json.dumps({
+                    'message': f"CommCare to S3 data pull finished for {len(domain_statuses)} domains with {failed_domain_count} failures.",
+                    'domains': domain_statuses,
+                    'resume_needed': any(status['status'] == 'partial' for status in domain_statuses.values()),
+                    'metrics': invocation_metrics.summary()
+                })
+            }
+
         if 'api_info' not in event:
             return err('api_details was missing in event data.')
-    
-        CommCareAPIHandlerPull(is_staging, domain, api_token_for_domain, event_time, request_limit=1000,
-            custom_date_range_config=custom_date_range_tuple, test_mode=test_mode, use_lag=use_lag).pull_data_for_domain(event['api_info'])
-        
-        print(f"Data pull for domain: {domain} finished.")
+
+        metrics = MetricsRecorder(domain)
+        api_handler = pull_domain(api_handler_class, domain, is_staging, event['api_info'], event_time, pull_options, metrics)
+        if api_handler.resume_needed:
+            return {
+                'statusCode': 200,
+                'body': json.dumps({
+                    'message': 'CommCare to S3 data pull stopped at the deadline. Resume needed.',
+                    'status': 'partial',
+                    'resume_needed': True,
+                    'data_types': api_handler.data_type_statuses,
+                    'metrics': metrics.summary()
+                })
+            }
         return {
             'statusCode': 200,
-            'body': json.dumps({'message': 'CommCare to S3 data pull successful.'})
+            'body': json.dumps({'message': 'CommCare to S3 data pull successful.', 'metrics': metrics.summary()})
         }
 
     ## -- CommCare to S3
     elif event['operation_type'] == 's3_to_cc':
+        if not domain:
+            return err('domain was missing in event data.')
         if 'specifiers' not in event:
             return err('"specifiers" were missing in event data.')
         specifier_data = event['specifiers']
+        prefetch_api_tokens([(domain, specifier) for specifier in specifier_data])
+        # Number of payloads pushed at the same time. Payloads changing the same case are still pushed in order.
+        push_concurrency = int(event.get('push_concurrency', DEFAULT_PUSH_CONCURRENCY))
+        specifier_metrics = {}
+        push_failures = {}
         for specifier in specifier_data:
-            api_token_for_domain = get_api_token(domain, specifier=specifier)
-            CommCareAPIHandlerPush(is_staging, domain, api_token_for_domain, event_time, request_limit=1000, test_mode=test_mode).push_data_for_domain(specifier_data[specifier], specifier)
+            specifier_metrics[specifier] = MetricsRecorder(domain)
+            api_token_for_domain = get_api_token(domain, specifier=specifier, metrics=specifier_metrics[specifier])
+            api_handler = CommCareAPIHandlerPush(is_staging, domain, api_token_for_domain, event_time, request_limit=1000, test_mode=test_mode, requests_per_second=requests_per_second,
+                                                 retry_attempts=retry_attempts, metrics=specifier_metrics[specifier], push_concurrency=push_concurrency)
+            api_handler.push_data_for_domain(specifier_data[specifier], specifier)
+            if api_handler.push_failures.get(specifier):
+                push_failures[specifier] = api_handler.push_failures[specifier]
 
-        print(f"Data push for domain: {domain} finished.")
+        logger.info("Data push finished.", extra={'domain': domain})
+        body = {
+            'message': 'S3 to CommCare data push successful.',
+            'metrics': {specifier: metrics.summary() for specifier, metrics in specifier_metrics.items()}
+        }
+        if push_failures:
+            failed_payload_count = sum(len(failures) for failures in push_failures.values())
+            body.update({'message': f"S3 to CommCare data push finished with {failed_payload_count} failed payloads.", 'failures': push_failures})
         return {
             'statusCode': 200,
-            'body': json.dumps({'message': 'S3 to CommCare data push successful.'})
+            'body': json.dumps(body)
         }
 
     else:
@@ -0,0 +1,97 @@
+import json
+import logging
+import os
+import sys
+
+from const import DEFAULT_LOG_LEVEL, LOG_PAYLOAD_MAX_IDS, LOG_VALUE_MAX_LENGTH
+
+# Every logger of the package is a child of this one
+LOGGER_NAME = 'commcare_sync'
+# Fields given through a log call's extra, or a ContextLogger, that are written as keys of their own
+CONTEXT_FIELDS = ('domain', 'data_type', 'specifier', 'request_number')
+# Keys identifying the objects of a request or response body, listed in payload summaries
+PAYLOAD_ID_FIELDS = ('case_id', 'form_id', 'id')
+
+
+class JsonFormatter(logging.Formatter):
+
+    """
+        Formats log records as single line JSON objects, so that CloudWatch Logs Insights can filter and
+        aggregate them by level, domain, data type and request number.
+    """
+
+    def format(self, record):
+        log_record = {
+            'timestamp': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for field in CONTEXT_FIELDS:
+            if getattr(record, field, None) is not None:
+                log_record[field] = getattr(record, field)
+        if record.exc_info:
+            log_record['exception'] = self.formatException(record.exc_info)
+        return json.dumps(log_record, default=str)
+
+
+class ContextLogger(logging.LoggerAdapter):
+
+    """
+        Adds the same context fields (e.g. the domain) to every record logged, merged with any given in extra.
+    """
+
+    def process(self, msg, kwargs):
+        kwargs['extra'] = {**self.extra, **(kwargs.get('extra') or {})}
+        return msg, kwargs
+
+
+def configure_logging(level=None):
+    """
+        Writes the package's log records to stdout as JSON, at the given level, or LOG_LEVEL from the environment.
+        The records are not passed on to the root logger, which the Lambda runtime formats as plain text.
+    """
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(str(level or os.environ.get('LOG_LEVEL') or DEFAULT_LOG_LEVEL).upper())
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(JsonFormatter())
+        logger.addHandler(handler)
+        logger.propagate = False
+    return logger
+
+
+def get_logger(name, **context):
+    logger = logging.getLogger(f"{LOGGER_NAME}.{name}")
+    return ContextLogger(logger, context) if context else logger
+
+
+def truncate(value, max_length=LOG_VALUE_MAX_LENGTH):
+    text = str(value)
+    if len(text) <= max_length:
+        return text
+    return f"{text[:max_length]}... ({len(text) - max_length} more characters)"
+
+
+class PayloadSummary(object):
+
+    """
+        Stands in for a request or response body in a log call: it is formatted as the body's size and the ids
+        of its objects rather than its full content, and only when the record is actually written.
+    """
+
+    def __init__(self, payload, max_ids=LOG_PAYLOAD_MAX_IDS):
+        self.payload = payload
+        self.max_ids = max_ids
+
+    def __str__(self):
+        objects = self.payload if isinstance(self.payload, list) else [self.payload]
+        ids = [obj[field] for obj in objects if isinstance(obj, dict) for field in PAYLOAD_ID_FIELDS if obj.get(field)]
+        summary = f"{len(json.dumps(self.payload, default=str))} bytes"
+        if isinstance(self.payload, list):
+            summary += f", {len(self.payload)} objects"
+        if ids:
+            summary += f", ids: {', '.join(str(id) for id in ids[:self.max_ids])}"
+            if len(ids) > self.max_ids:
+                summary += f" and {len(ids) - self.max_ids} more"
+        return summary
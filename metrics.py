@@ -0,0 +1,131 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from const import EMF_MAX_VALUES_PER_METRIC, METRICS_NAMESPACE
+
+# CloudWatch units of the metrics recorded
+BYTES = 'Bytes'
+COUNT = 'Count'
+MILLISECONDS = 'Milliseconds'
+
+
+class MetricsRecorder(object):
+
+    """
+        Collects the metrics of a domain's pull or push: the latency and size of every call made to CommCareHQ,
+        S3 and SSM, along with page, file and retry counts. Metrics recorded with a data type are kept apart
+        from those of the domain as a whole.
+
+        emit() writes them as CloudWatch Embedded Metric Format (EMF) log lines, which CloudWatch turns into
+        metrics with Domain and DataType dimensions. summary() condenses them for the lambda_handler response.
+    """
+
+    def __init__(self, domain=None, namespace=METRICS_NAMESPACE):
+        self.domain = domain
+        self.namespace = namespace
+        # Recorded values by data type (None for the domain as a whole), then by metric name
+        self.values = {}
+        self.units = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, value, unit=COUNT, data_type_name=None):
+        with self._lock:
+            self.values.setdefault(data_type_name, {}).setdefault(name, []).append(value)
+            self.units[name] = unit
+
+    @contextmanager
+    def time(self, name, data_type_name=None):
+        """
+            Records the time spent in the with block, in milliseconds, whether or not it raises.
+        """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start_time) * 1000, MILLISECONDS, data_type_name)
+
+    def summary(self):
+        """
+            Returns the count, sum and maximum of each metric, for the domain and for each data type.
+        """
+        def summarize(metric_values):
+            return {
+                name: {'count': len(values), 'sum': round(sum(values), 3), 'max': round(max(values), 3), 'unit': self.units[name]}
+                for name, values in sorted(metric_values.items())
+            }
+
+        with self._lock:
+            return {
+                'domain': summarize(self.values.get(None, {})),
+                'data_types': {name: summarize(metric_values) for name, metric_values in self.values.items() if name is not None}
+            }
+
+    def _get_log_lines(self):
+        timestamp = int(time.time() * 1000)
+        log_lines = []
+        with self._lock:
+            for data_type_name, metric_values in self.values.items():
+                dimensions = {}
+                if self.domain:
+                    dimensions['Domain'] = self.domain
+                if data_type_name:
+                    dimensions['DataType'] = data_type_name
+                # EMF takes at most EMF_MAX_VALUES_PER_METRIC values per metric in a single log line
+                line_count = max(-(-len(values) // EMF_MAX_VALUES_PER_METRIC) for values in metric_values.values())
+                for line_number in range(line_count):
+                    start = line_number * EMF_MAX_VALUES_PER_METRIC
+                    line_values = {
+                        name: values[start:start + EMF_MAX_VALUES_PER_METRIC]
+                        for name, values in metric_values.items() if values[start:start + EMF_MAX_VALUES_PER_METRIC]
+                    }
+                    log_lines.append({
+                        '_aws': {
+                            'Timestamp': timestamp,
+                            'CloudWatchMetrics': [{
+                                'Namespace': self.namespace,
+                                'Dimensions': [list(dimensions.keys())],
+                                'Metrics': [{'Name': name, 'Unit': self.units[name]} for name in line_values]
+                            }]
+                        },
+                        **dimensions,
+                        **line_values
+                    })
+        return log_lines
+
+    def emit(self):
+        """
+            Prints every metric recorded so far as EMF log lines.
+        """
+        for log_line in self._get_log_lines():
+            print(json.dumps(log_line))
+
+
+class MeteredClient(object):
+
+    """
+        Wraps a boto3 client so that the latency of each call is recorded as <prefix><Operation>Latency (e.g.
+        S3PutObjectLatency), and each failed call as <prefix><Operation>Errors.
+    """
+
+    def __init__(self, client, metrics, prefix):
+        self.client = client
+        self.metrics = metrics
+        self.prefix = prefix
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+        if not callable(method):
+            return method
+        operation = ''.join(part.capitalize() for part in name.split('_'))
+
+        def metered_method(*args, **kwargs):
+            try:
+                with self.metrics.time(f"{self.prefix}{operation}Latency"):
+                    return method(*args, **kwargs)
+            except Exception:
+                self.metrics.record(f"{self.prefix}{operation}Errors", 1)
+                raise
+
+        return metered_method
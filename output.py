@@ -0,0 +1,352 @@
+import gzip
+import io
+import json
+import threading
+from contextlib import nullcontext
+from functools import lru_cache
+
+from const import DEFAULT_PARQUET_ROW_GROUP_SIZE
+from log import get_logger
+
+logger = get_logger(__name__)
+
+# Output formats for pulled files, keyed by the data type's "output_format" value.
+# "json" writes the API response layout ({"meta": ..., "objects": [...]}); "ndjson" writes one object per line;
+# "parquet" writes the objects as a columnar table and needs the optional pyarrow package.
+JSON = 'json'
+NDJSON = 'ndjson'
+PARQUET = 'parquet'
+FILE_EXTENSIONS = {
+    JSON: '.json',
+    NDJSON: '.ndjson',
+    PARQUET: '.parquet',
+}
+CONTENT_TYPES = {
+    JSON: 'application/json',
+    NDJSON: 'application/x-ndjson',
+    PARQUET: 'application/vnd.apache.parquet',
+}
+
+# Compression settings for pulled files, keyed by the data type's "compression" value.
+# Snowflake COPY reads both formats natively.
+GZIP = 'gzip'
+ZSTD = 'zstd'
+COMPRESSION_SUFFIXES = {
+    GZIP: '.gz',
+    ZSTD: '.zst',
+}
+
+
+def _get_zstd_compressor():
+    # Compressors are not safe to share between upload threads, so a new one is made per file
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard.ZstdCompressor()
+
+
+@lru_cache(maxsize=None)
+def resolve_compression(compression):
+    """
+        Returns the compression that will actually be used for the given setting. zstd is an optional
+        dependency, so gzip is used instead when the zstandard package is not installed.
+    """
+    if compression not in (None, GZIP, ZSTD):
+        raise ValueError(f"Unsupported compression: {compression}. Expected one of: {GZIP}, {ZSTD}.")
+    if compression == ZSTD and _get_zstd_compressor() is None:
+        logger.warning("zstandard is not installed. Using %s compression instead.", GZIP)
+        return GZIP
+    return compression
+
+
+@lru_cache(maxsize=None)
+def resolve_output_format(output_format):
+    """
+        Returns the output format that will actually be used for the given setting. Parquet needs the optional
+        pyarrow package, so JSON is written instead when it is not installed.
+    """
+    if output_format not in FILE_EXTENSIONS:
+        raise ValueError(f"Unsupported output format: {output_format}. Expected one of: {', '.join(FILE_EXTENSIONS)}.")
+    if output_format == PARQUET:
+        try:
+            import pyarrow
+        except ImportError:
+            logger.warning("pyarrow is not installed. Writing %s files instead of %s.", JSON, PARQUET)
+            return JSON
+    return output_format
+
+
+def _open_compressed_stream(buffer, compression):
+    """
+        Opens a writable stream over buffer that compresses everything written to it with an already-resolved
+        compression setting. Closing the stream finishes the compressed data but leaves buffer open.
+    """
+    if compression == GZIP:
+        return gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=6)
+    elif compression == ZSTD:
+        return _get_zstd_compressor().stream_writer(buffer, closefd=False)
+    return nullcontext(buffer)
+
+
+def file_meta(pages):
+    """
+        The meta block for a file made of one or more pages: the last page's meta, with total_count set to
+        the number of objects in the file.
+    """
+    return dict(pages[-1].meta, total_count=sum(page.object_count for page in pages))
+
+
+def _write_json(stream, pages):
+    # A single page is written exactly as it was received (or decoded) from the API
+    if len(pages) == 1:
+        page = pages[0]
+        stream.write(page.body if page.body is not None else json.dumps(page.data).encode('utf-8'))
+        return
+    stream.write(b'{"meta": ' + json.dumps(file_meta(pages)).encode('utf-8') + b', "objects": [')
+    for index, page in enumerate(pages):
+        if index:
+            stream.write(b', ')
+        stream.write(page.objects_fragment)
+    stream.write(b']}')
+
+
+def _write_ndjson(stream, pages):
+    for page in pages:
+        for item in page.objects:
+            stream.write(json.dumps(item).encode('utf-8'))
+            stream.write(b'\n')
+
+
+def encode_file(pages, output_format=JSON, compression=None):
+    """
+        Writes one or more pages as a single JSON or NDJSON file body, compressing the data as it is written
+        so that only the compressed body is held in memory in full. Returns the buffer holding the body,
+        rewound, so that it can be uploaded without being copied. Parquet files are written by ParquetEncoder.
+    """
+    if output_format not in (JSON, NDJSON):
+        raise ValueError(f"Unsupported output format: {output_format}. Expected one of: {JSON}, {NDJSON}.")
+    buffer = io.BytesIO()
+    with _open_compressed_stream(buffer, compression) as stream:
+        if output_format == NDJSON:
+            _write_ndjson(stream, pages)
+        else:
+            _write_json(stream, pages)
+    buffer.seek(0)
+    return buffer
+
+
+def _has_empty_structs(data_type):
+    import pyarrow
+    if pyarrow.types.is_struct(data_type):
+        return data_type.num_fields == 0 or any(_has_empty_structs(field.type) for field in data_type)
+    if pyarrow.types.is_list(data_type):
+        return _has_empty_structs(data_type.value_type)
+    return False
+
+
+def _empty_structs_to_null(data_type):
+    # Parquet cannot store a struct without fields (such as a case's empty "indices"), so those are written as null
+    import pyarrow
+    if pyarrow.types.is_struct(data_type):
+        if data_type.num_fields == 0:
+            return pyarrow.null()
+        return pyarrow.struct([field.with_type(_empty_structs_to_null(field.type)) for field in data_type])
+    if pyarrow.types.is_list(data_type):
+        return pyarrow.list_(_empty_structs_to_null(data_type.value_type))
+    return data_type
+
+
+def _get_null_plan(data_type):
+    """
+        Returns where the null-typed fields of a value of data_type are: True if the value is null-typed
+        itself, a dict of plans by field name for a struct, a list holding the plan of its items for a list, or
+        None if it has no null-typed fields.
+    """
+    import pyarrow
+    if pyarrow.types.is_null(data_type):
+        return True
+    if pyarrow.types.is_struct(data_type):
+        plans = {field.name: _get_null_plan(field.type) for field in data_type}
+        return {name: plan for name, plan in plans.items() if plan is not None} or None
+    if pyarrow.types.is_list(data_type):
+        plan = _get_null_plan(data_type.value_type)
+        return None if plan is None else [plan]
+    return None
+
+
+def _apply_null_plan(value, plan):
+    # Sets the values of null-typed fields (see _get_null_plan), such as empty dicts, to None
+    if value is None or plan is True:
+        return None
+    if isinstance(plan, dict) and isinstance(value, dict):
+        return {name: _apply_null_plan(item, plan[name]) if name in plan else item for name, item in value.items()}
+    if isinstance(plan, list) and isinstance(value, list):
+        return [_apply_null_plan(item, plan[0]) for item in value]
+    return value
+
+
+def _to_json_string(value):
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+
+def _has_consistent_type(values, cached_type):
+    import pyarrow
+    try:
+        value_type = pyarrow.array(values).type
+        if cached_type is not None:
+            pyarrow.unify_schemas([pyarrow.schema([('_', cached_type)]), pyarrow.schema([('_', value_type)])], promote_options='permissive')
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+        return False
+    return True
+
+
+def _coerce_conflicting_fields(objects, cached_type, path, coerced_paths):
+    """
+        Returns the objects (dicts or None) with the values of each field whose types conflict, between
+        objects or with the field's type in the cached_type struct, written as JSON strings. Nested dicts are
+        checked field by field, so that only the conflicting part of a block is coerced. The path (a tuple of
+        names) of each coerced field is added to coerced_paths.
+    """
+    import pyarrow
+    names = list(dict.fromkeys(name for obj in objects if obj for name in obj))
+    columns = {}
+    for name in names:
+        values = [obj.get(name) if obj else None for obj in objects]
+        field_type = None
+        if cached_type is not None and cached_type.get_field_index(name) != -1:
+            field_type = cached_type.field(name).type
+        field_path = path + (name,)
+        nested = any(isinstance(value, dict) for value in values) and all(value is None or isinstance(value, dict) for value in values)
+        if nested and (field_type is None or pyarrow.types.is_struct(field_type)):
+            values = _coerce_conflicting_fields(values, field_type, field_path, coerced_paths)
+        elif not _has_consistent_type(values, field_type):
+            values = [_to_json_string(value) for value in values]
+            coerced_paths.append(field_path)
+        columns[name] = values
+    return [None if obj is None else {name: columns[name][index] for name in names} for index, obj in enumerate(objects)]
+
+
+def _with_string_fields(data_type, paths):
+    # Gives the fields at the given paths (tuples of names) of a struct type a string type
+    import pyarrow
+    fields = []
+    for field in data_type:
+        field_paths = [path[1:] for path in paths if path[0] == field.name]
+        if () in field_paths:
+            field = field.with_type(pyarrow.string())
+        elif field_paths and pyarrow.types.is_struct(field.type):
+            field = field.with_type(_with_string_fields(field.type, field_paths))
+        fields.append(field)
+    return pyarrow.struct(fields)
+
+
+class ParquetEncoder(object):
+
+    """
+        Converts the objects of one or more pages into a Parquet file.
+
+        The schema is inferred from the data and cached, so that every file written for a data type shares
+        one schema, widened as new fields (such as new case properties) appear. Fields whose values cannot share
+        a type, within a file (such as a form repeat group that is a dict in one submission and a list in
+        another) or with the cached schema, are written as JSON strings, and the cached schema takes a string
+        type for them from then on.
+
+        Nested blocks (a case's "properties", a form's "form") are written as struct columns, or as flattened
+        "parent.child" columns when flatten is set. Files are written with a single row group of up to
+        row_group_size rows, which keeps each file a single unit of work for Snowflake's Parquet reader.
+    """
+
+    def __init__(self, flatten=False, row_group_size=DEFAULT_PARQUET_ROW_GROUP_SIZE, compression=None):
+        self.flatten = flatten
+        self.row_group_size = row_group_size
+        # Parquet compresses internally. Snappy is the default, and is what Snowflake expects when unspecified.
+        self.compression = compression or 'snappy'
+        self.schema = None
+        self._lock = threading.Lock()
+
+    def _build_table(self, objects):
+        """
+            Returns the schema of the objects, which is the cached schema widened to their inferred schema, and
+            the objects as a table with that schema.
+        """
+        import pyarrow
+        inferred_type = pyarrow.struct(list(pyarrow.Table.from_pylist(objects).schema))
+        has_empty_structs = _has_empty_structs(inferred_type)
+        inferred_schema = pyarrow.schema(list(_empty_structs_to_null(inferred_type) if has_empty_structs else inferred_type))
+        schema = inferred_schema if self.schema is None else pyarrow.unify_schemas([self.schema, inferred_schema], promote_options='permissive')
+        if has_empty_structs:
+            null_plan = _get_null_plan(pyarrow.struct(list(schema)))
+            objects = [_apply_null_plan(obj, null_plan) for obj in objects]
+        return schema, pyarrow.Table.from_pylist(objects, schema=schema)
+
+    def _to_table(self, objects):
+        import pyarrow
+        with self._lock:
+            try:
+                schema, table = self._build_table(objects)
+            except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+                coerced_paths = []
+                objects = _coerce_conflicting_fields(objects, pyarrow.struct(list(self.schema)) if self.schema else None, (), coerced_paths)
+                logger.warning("Fields with conflicting types are written as JSON strings: %s", ', '.join('.'.join(path) for path in coerced_paths))
+                if self.schema is not None:
+                    self.schema = pyarrow.schema(list(_with_string_fields(pyarrow.struct(list(self.schema)), coerced_paths)))
+                schema, table = self._build_table(objects)
+            self.schema = schema
+        if self.flatten:
+            while any(pyarrow.types.is_struct(field.type) for field in table.schema):
+                table = table.flatten()
+        return table
+
+    def encode(self, pages):
+        import pyarrow.parquet
+        table = self._to_table([item for page in pages for item in page.objects])
+        buffer = io.BytesIO()
+        pyarrow.parquet.write_table(table, buffer, row_group_size=self.row_group_size, compression=self.compression)
+        buffer.seek(0)
+        return buffer
+
+
+class FileRoller(object):
+
+    """
+        Buffers pages between pagination and the uploader so that several small pages can be written as a
+        single S3 object. Pages are passed on to flush_function, along with the start of the first page and
+        the end of the last one, once adding another page would take the file over target_size_in_bytes, and
+        when pagination ends.
+
+        Without a target size, every page is flushed as soon as it is added. file_count counts the files
+        flushed so far, starting from the given count when a pull is resumed from a checkpoint.
+    """
+
+    def __init__(self, flush_function, target_size_in_bytes=None, file_count=0):
+        self.flush_function = flush_function
+        self.target_size_in_bytes = target_size_in_bytes
+        self.file_count = file_count
+        self.pages = []
+        self.size_in_bytes = 0
+        self.start = None
+        self.end = None
+
+    def add(self, page, start, end, size_in_bytes=None):
+        size_in_bytes = page.size_in_bytes if size_in_bytes is None else size_in_bytes
+        if self.pages and self.size_in_bytes + size_in_bytes > self.target_size_in_bytes:
+            self.flush()
+        if not self.pages:
+            self.start = start
+        self.pages.append(page)
+        self.size_in_bytes += size_in_bytes
+        self.end = end
+        if self.target_size_in_bytes is None:
+            self.flush()
+
+    def flush(self):
+        if self.pages:
+            self.file_count += 1
+            self.flush_function(self.pages, self.start, self.end)
+        self.pages = []
+        self.size_in_bytes = 0
+        self.start = None
+        self.end = None
@@ -0,0 +1,115 @@
+import json
+import re
+
+from util import process_raw_response, process_response
+
+# The CommCare API returns {"meta": {...}, "objects": [...]}, with the meta block first
+_meta_start_pattern = re.compile(rb'\s*\{\s*"meta"\s*:\s*')
+_empty_objects_pattern = re.compile(rb'"objects"\s*:\s*\[\s*\]\s*\}\s*$')
+_indexed_on_pattern = re.compile(rb'"indexed_on"\s*:\s*"([^"]+)"')
+_objects_start_pattern = re.compile(rb'"objects"\s*:\s*\[')
+# Bytes read when decoding the meta block, or checking for an empty objects array, without parsing the whole body
+_meta_max_bytes = 65536
+_tail_bytes = 64
+
+
+class Page(object):
+
+    """
+        A single page of results from the CommCare API.
+
+        A page is either parsed in full (data holds the decoded response), or kept as the original response
+        body (body holds the undecoded bytes) with only the fields needed for pagination extracted from it:
+        the meta block, the number of objects and the last object's indexed_on.
+    """
+
+    def __init__(self, meta, size_in_bytes, data=None, body=None, object_count=None, last_indexed_on=None):
+        self.meta = meta
+        self.size_in_bytes = size_in_bytes
+        self.data = data
+        self.body = body
+        self.object_count = len(data['objects']) if data is not None else object_count
+        self._last_indexed_on = last_indexed_on
+
+    @classmethod
+    def from_response(cls, response, raw=False):
+        if not raw:
+            data = process_response(response)
+            return cls(data['meta'], len(response.content), data=data)
+        body = process_raw_response(response)
+        meta = cls._extract_meta(body)
+        if meta is None:
+            # Unexpected layout: fall back to parsing the body, but still pass the original bytes through
+            data = json.loads(body)
+            return cls(data['meta'], len(body), data=data, body=body)
+        return cls(meta, len(body), body=body, object_count=cls._count_objects(meta, body))
+
+    @staticmethod
+    def _extract_meta(body):
+        match = _meta_start_pattern.match(body)
+        if not match:
+            return None
+        try:
+            meta, _ = json.JSONDecoder().raw_decode(body[match.end():match.end() + _meta_max_bytes].decode('utf-8', errors='ignore'))
+        except json.JSONDecodeError:
+            return None
+        return meta if isinstance(meta, dict) else None
+
+    @staticmethod
+    def _count_objects(meta, body):
+        """
+            Infers the number of objects in a page from its meta block: every page but the last is full, and
+            the last page holds what is left of the total count after its offset. Offset and cursor queries
+            count their total over the whole query, indexed_on queries over what is left. When the meta block
+            cannot tell (such as a cursor page without an offset), the last page's objects are counted instead.
+        """
+        if _empty_objects_pattern.search(body[-_tail_bytes:]):
+            return 0
+        limit = int(meta['limit'])
+        if meta.get('next'):
+            return limit
+        if meta.get('total_count') is not None:
+            remaining_count = int(meta['total_count']) - int(meta.get('offset') or 0)
+            if 0 <= remaining_count <= limit:
+                return remaining_count
+        return len(json.loads(body)['objects'])
+
+    @property
+    def objects(self):
+        """
+            The page's decoded objects. Raw bodies are decoded on first use.
+        """
+        if self.data is None:
+            self.data = json.loads(self.body)
+        return self.data['objects']
+
+    @property
+    def objects_fragment(self):
+        """
+            The page's objects as JSON bytes without the surrounding array brackets, so that the objects of
+            several pages can be joined into one array. Raw bodies are sliced rather than re-encoded.
+        """
+        if self.data is None:
+            match = _objects_start_pattern.search(self.body)
+            # The objects array is expected to be the last value in the body, i.e. the body ends with "]}"
+            body_end = _skip_whitespace_backwards(self.body, len(self.body))
+            array_end = _skip_whitespace_backwards(self.body, body_end - 1)
+            if match and self.body[body_end - 1:body_end] == b'}' and self.body[array_end - 1:array_end] == b']':
+                return self.body[match.end():array_end - 1].strip()
+        return json.dumps(self.objects)[1:-1].encode('utf-8')
+
+    @property
+    def last_indexed_on(self):
+        if self.data is not None:
+            return self.data['objects'][-1]['indexed_on']
+        if self._last_indexed_on is None:
+            # indexed_on is a top-level field of every object, so its last occurrence belongs to the last object
+            match = _indexed_on_pattern.match(self.body, self.body.rfind(b'"indexed_on"'))
+            self._last_indexed_on = match.group(1).decode('utf-8')
+        return self._last_indexed_on
+
+
+def _skip_whitespace_backwards(body, end):
+    while end > 0 and body[end - 1:end].isspace():
+        end -= 1
+    return end
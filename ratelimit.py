@@ -0,0 +1,160 @@
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from const import DEFAULT_MAX_RETRY_AFTER_SECONDS, DEFAULT_THROTTLE_BACKOFF_SECONDS
+from log import get_logger
+
+# Responses CommCareHQ sends when it is throttling requests, and which are worth retrying after a wait
+THROTTLE_STATUS_CODES = (429, 503)
+
+# Rate limiters are kept at module level so that every handler pulling from the same host shares one,
+#   across domains and across warm Lambda invocations (which share its Retry-After pause, but not its rate).
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+logger = get_logger(__name__)
+
+
+def get_retry_after_seconds(response):
+    """
+        Returns how long a throttled response asks the client to wait, from its Retry-After header (either
+        a number of seconds or an HTTP date), capped at DEFAULT_MAX_RETRY_AFTER_SECONDS.
+    """
+    retry_after = (getattr(response, 'headers', None) or {}).get('Retry-After')
+    if retry_after is None:
+        return DEFAULT_THROTTLE_BACKOFF_SECONDS
+    try:
+        seconds = float(retry_after)
+    except ValueError:
+        try:
+            seconds = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return DEFAULT_THROTTLE_BACKOFF_SECONDS
+    return min(max(seconds, 0), DEFAULT_MAX_RETRY_AFTER_SECONDS)
+
+
+class TokenBucket(object):
+
+    """
+        Paces the requests made to a single host. Each request takes a token; tokens refill at
+        requests_per_second up to burst. Without requests_per_second, requests are not paced at all until the
+        host throttles them, at which point pause() holds back every request until its Retry-After has passed.
+    """
+
+    def __init__(self, requests_per_second=None, burst=None):
+        self.requests_per_second = requests_per_second
+        self.burst = burst or max(1, requests_per_second or 1)
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+        self.paused_until = 0
+        self._lock = threading.Lock()
+
+    def set_rate(self, requests_per_second=None, burst=None):
+        """
+            Replaces the rate and burst, keeping any pause in place. Without requests_per_second, requests are
+            no longer paced.
+        """
+        burst = burst or max(1, requests_per_second or 1)
+        with self._lock:
+            if (requests_per_second, burst) == (self.requests_per_second, self.burst):
+                return
+            self.requests_per_second = requests_per_second
+            self.burst = burst
+            self.tokens = min(self.tokens, burst)
+
+    def reserve(self):
+        """
+            Takes a token, and returns how many seconds the caller must wait before making its request.
+            Tokens may be taken ahead of time, in which case later callers wait in turn.
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait_seconds = max(0, self.paused_until - now)
+            if self.requests_per_second:
+                self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.requests_per_second)
+                self.updated_at = now
+                self.tokens -= 1
+                if self.tokens < 0:
+                    wait_seconds = max(wait_seconds, -self.tokens / self.requests_per_second)
+            return wait_seconds
+
+    def acquire(self):
+        wait_seconds = self.reserve()
+        if wait_seconds:
+            time.sleep(wait_seconds)
+
+    async def acquire_async(self):
+        import asyncio
+        wait_seconds = self.reserve()
+        if wait_seconds:
+            await asyncio.sleep(wait_seconds)
+
+    def pause(self, seconds):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def get_rate_limiter(host, requests_per_second=None, burst=None):
+    """
+        Returns the shared rate limiter for a host, creating it on first use, and sets it to the rate given, or
+        to no pacing without one. A rate therefore only applies to the invocation that asks for it; the pause
+        after a throttled response is what carries over to later warm invocations.
+    """
+    with _rate_limiters_lock:
+        if host not in _rate_limiters:
+            _rate_limiters[host] = TokenBucket(requests_per_second, burst)
+        else:
+            _rate_limiters[host].set_rate(requests_per_second, burst)
+        return _rate_limiters[host]
+
+
+class AdaptiveConcurrency(object):
+
+    """
+        Adapts the number of requests allowed in flight with additive increase, multiplicative decrease (AIMD):
+        the limit is halved whenever a request is throttled, and grows by one after a full limit's worth of
+        requests succeed, up to maximum.
+    """
+
+    def __init__(self, maximum, minimum=1):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = maximum
+        self.in_flight = 0
+        self._successes = 0
+
+    def _record(self, throttled):
+        if throttled:
+            self.limit = max(self.minimum, self.limit // 2)
+            self._successes = 0
+            logger.warning("Request was throttled. Lowering concurrency limit to %s.", self.limit)
+        elif self.limit < self.maximum:
+            self._successes += 1
+            if self._successes >= self.limit:
+                self.limit += 1
+                self._successes = 0
+
+
+class ConcurrencyLimit(AdaptiveConcurrency):
+
+    """
+        An AdaptiveConcurrency shared by threads. acquire() before each request, and release() after it with
+        whether it was throttled.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        with self._condition:
+            self.in_flight -= 1
+            self._record(throttled)
+            self._condition.notify_all()
@@ -0,0 +1,89 @@
+import random
+import time
+from botocore.exceptions import ClientError, HTTPClientError, ConnectionError as BotoCoreConnectionError
+
+from const import DEFAULT_RETRY_ATTEMPTS, DEFAULT_RETRY_BASE_DELAY_SECONDS, DEFAULT_RETRY_MAX_DELAY_SECONDS
+from log import get_logger
+
+# CommCareHQ responses that signal a transient server failure. 503 is handled as throttling instead.
+RETRYABLE_STATUS_CODES = (500, 502, 504)
+
+# Request methods that can be sent twice without changing the outcome. Other requests (i.e. form submissions
+#   made by pushes) are only retried when CommCareHQ cannot have processed them.
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE')
+
+# S3 error codes that signal a transient failure
+RETRYABLE_S3_ERROR_CODES = ('SlowDown', 'InternalError', 'ServiceUnavailable', 'RequestTimeout', 'Throttling')
+# Errors raised by botocore when a connection to S3 fails, times out or is reset
+S3_CONNECTION_ERRORS = (BotoCoreConnectionError, HTTPClientError)
+
+logger = get_logger(__name__)
+
+
+class RetryPolicy(object):
+
+    """
+        How often, and after how long, a transiently failed call is retried: up to max_attempts calls in total,
+        with exponential backoff and full jitter between them, so that clients that failed together do not
+        retry together.
+    """
+
+    def __init__(self, max_attempts=DEFAULT_RETRY_ATTEMPTS, base_delay_seconds=DEFAULT_RETRY_BASE_DELAY_SECONDS, max_delay_seconds=DEFAULT_RETRY_MAX_DELAY_SECONDS):
+        self.max_attempts = max_attempts
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+
+    def allows_retry(self, attempt):
+        """
+            Whether a call that has failed attempt times may be made again.
+        """
+        return attempt < self.max_attempts
+
+    def get_delay_seconds(self, attempt):
+        return random.uniform(0, min(self.max_delay_seconds, self.base_delay_seconds * 2 ** (attempt - 1)))
+
+
+def is_retryable_s3_error(error):
+    if isinstance(error, S3_CONNECTION_ERRORS):
+        return True
+    return error.response['Error']['Code'] in RETRYABLE_S3_ERROR_CODES or error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0) >= 500
+
+
+class RetryingClient(object):
+
+    """
+        Wraps a boto3 client so that the S3 calls made by the pull and push retry transient errors, such as
+        SlowDown, under a RetryPolicy. on_retry is called before each retry. Other calls go straight to the
+        wrapped client.
+    """
+
+    retried_methods = ('get_object', 'put_object', 'list_objects', 'list_objects_v2', 'delete_object')
+
+    def __init__(self, client, retry_policy, on_retry=None):
+        self.client = client
+        self.retry_policy = retry_policy
+        self.on_retry = on_retry
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+        if name not in self.retried_methods:
+            return method
+        return lambda **kwargs: self._call(name, method, kwargs)
+
+    def _call(self, name, method, kwargs):
+        attempt = 1
+        while True:
+            # A file body given as a stream has been read by the failed attempt, so rewind it for the retry
+            if attempt > 1 and hasattr(kwargs.get('Body'), 'seek'):
+                kwargs['Body'].seek(0)
+            try:
+                return method(**kwargs)
+            except (ClientError, *S3_CONNECTION_ERRORS) as e:
+                if not (is_retryable_s3_error(e) and self.retry_policy.allows_retry(attempt)):
+                    raise
+                delay_seconds = self.retry_policy.get_delay_seconds(attempt)
+                logger.warning("S3 %s failed with a transient error: %s. Retry %s of %s in %.2f seconds...", name, e, attempt, self.retry_policy.max_attempts - 1, delay_seconds)
+            if self.on_retry:
+                self.on_retry()
+            time.sleep(delay_seconds)
+            attempt += 1
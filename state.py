@@ -0,0 +1,162 @@
+import json
+import threading
+from botocore.exceptions import ClientError, ParamValidationError
+
+from const import DEFAULT_STATE_SAVE_ATTEMPTS
+from log import get_logger
+
+# Stored parameters that were kept in per-parameter .txt objects before the state manifest
+LEGACY_PARAMETER_NAMES = ('last_successful_job_time', 'api_limit', 'checkpoint')
+
+# Error codes S3 returns when a conditional write loses to another writer
+CONDITIONAL_WRITE_ERROR_CODES = ('PreconditionFailed', 'ConditionalRequestConflict')
+
+logger = get_logger(__name__)
+
+
+class MissingStateError(Exception):
+    pass
+
+
+class StateManifest(object):
+
+    """
+        The pull state of every data type of a domain (last successful job time, API limit and checkpoint),
+        kept in a single JSON object in S3:
+
+            {"data_types": {"case": {"last_successful_job_time": "2024-01-01T00:00:00", "api_limit": 1000}}}
+
+        The manifest is read on first use and changed in memory. save() writes it back only if something
+        changed, conditionally on the ETag that was read, so that a concurrent run's changes are not lost:
+        if the manifest changed in the meantime, it is read again and this run's changes are re-applied on
+        top before retrying.
+
+        Data types with no entry in the manifest are migrated from the legacy per-parameter .txt objects: all
+        of them are read the first time the data type is used, and copied into the manifest on the next save.
+        Migrated values are not changes of this run: if another run has added the data type to the manifest
+        in the meantime, its values are kept.
+
+        Versions of botocore from before S3 supported conditional writes reject the IfMatch and IfNoneMatch
+        parameters; with those, the manifest is written unconditionally.
+    """
+
+    def __init__(self, s3_client, bucket, key, legacy_key_function):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.legacy_key_function = legacy_key_function
+        self.data = None
+        self.etag = None
+        # Values set (or deleted, as None) since the manifest was read, per (data type, parameter name)
+        self._changes = {}
+        # Values read from the legacy .txt objects, per (data type, parameter name)
+        self._migrated = {}
+        self._migrated_data_types = set()
+        self._conditional_writes = True
+        self._lock = threading.RLock()
+
+    def _load(self):
+        logger.info("Loading state manifest with key: %s...", self.key)
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self.key)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'NoSuchKey':
+                raise
+            logger.info("No state manifest found. Falling back to stored parameter .txt files.")
+            self.data = {'data_types': {}}
+            self.etag = None
+            return
+        self.data = json.loads(response['Body'].read().decode('utf-8'))
+        self.etag = response.get('ETag')
+        # A data type added to the manifest by another run since it was migrated keeps that run's values
+        self._migrated = {key: value for key, value in self._migrated.items() if key[0] not in self.data['data_types']}
+        logger.debug("State manifest loaded.")
+
+    def _ensure_loaded(self):
+        if self.data is None:
+            self._load()
+
+    def _migrate(self, data_type_name):
+        for name in LEGACY_PARAMETER_NAMES:
+            key = self.legacy_key_function(name, data_type_name)
+            logger.info("Loading legacy stored parameter with key: %s...", key)
+            try:
+                self._migrated[(data_type_name, name)] = self.s3_client.get_object(Bucket=self.bucket, Key=key)['Body'].read().decode('utf-8')
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'NoSuchKey':
+                    raise
+        self._migrated_data_types.add(data_type_name)
+
+    def get(self, data_type_name, name):
+        """
+            Gets a stored parameter of a data type, or None if there isn't one.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            if data_type_name not in self.data['data_types'] and data_type_name not in self._migrated_data_types:
+                self._migrate(data_type_name)
+            if (data_type_name, name) in self._changes:
+                return self._changes[(data_type_name, name)]
+            if (data_type_name, name) in self._migrated:
+                return self._migrated[(data_type_name, name)]
+            return self.data['data_types'].get(data_type_name, {}).get(name)
+
+    def set(self, data_type_name, name, value):
+        """
+            Sets a stored parameter of a data type in memory. Setting a parameter to its current value is
+            not a change.
+        """
+        with self._lock:
+            if self.get(data_type_name, name) != value:
+                self._changes[(data_type_name, name)] = value
+
+    def delete(self, data_type_name, name):
+        self.set(data_type_name, name, None)
+
+    def _apply_changes(self):
+        for (data_type_name, name), value in self._migrated.items():
+            self.data['data_types'].setdefault(data_type_name, {})[name] = value
+        for (data_type_name, name), value in self._changes.items():
+            data_type_state = self.data['data_types'].setdefault(data_type_name, {})
+            if value is None:
+                data_type_state.pop(name, None)
+            else:
+                data_type_state[name] = value
+
+    def save(self, max_attempts=DEFAULT_STATE_SAVE_ATTEMPTS):
+        """
+            Writes the manifest to S3 if anything changed since it was read.
+        """
+        with self._lock:
+            if not self._changes and not self._migrated:
+                logger.debug("State manifest unchanged. Skipping write.")
+                return
+            self._ensure_loaded()
+            for _ in range(max_attempts):
+                self._apply_changes()
+                logger.info("Saving state manifest with key: %s...", self.key)
+                try:
+                    response = self._put()
+                except ClientError as e:
+                    if e.response['Error']['Code'] not in CONDITIONAL_WRITE_ERROR_CODES:
+                        raise
+                    logger.warning("State manifest was changed by another run. Reloading and re-applying changes...")
+                    self._load()
+                    continue
+                self.etag = response.get('ETag')
+                self._changes = {}
+                self._migrated = {}
+                logger.debug("State manifest saved.")
+                return
+            raise Exception(f"Could not save state manifest with key: {self.key} after {max_attempts} attempts.")
+
+    def _put(self):
+        body = json.dumps(self.data)
+        if self._conditional_writes:
+            condition = {'IfMatch': self.etag} if self.etag else {'IfNoneMatch': '*'}
+            try:
+                return self.s3_client.put_object(Body=body, Bucket=self.bucket, Key=self.key, ContentType='application/json', **condition)
+            except ParamValidationError:
+                logger.warning("Conditional writes are not supported by this version of botocore. Writing state manifest unconditionally.")
+                self._conditional_writes = False
+        return self.s3_client.put_object(Body=body, Bucket=self.bucket, Key=self.key, ContentType='application/json')
@@ -0,0 +1,48 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+from const import DEFAULT_CONNECT_TIMEOUT, DEFAULT_POOL_SIZE, DEFAULT_READ_TIMEOUT
+
+# Errors raised when a request fails before a response arrives: the connection failed, was reset or timed out
+TRANSIENT_REQUEST_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+# The subset of those raised before the request could reach CommCareHQ, which makes any request safe to retry
+CONNECT_ERRORS = (requests.exceptions.ConnectTimeout,)
+
+# Transports are kept at module level so that pooled connections survive across warm Lambda invocations.
+_transports = {}
+
+
+class CommCareTransport(object):
+
+    """
+        A pooled, keep-alive HTTP transport for requests made to CommCareHQ. Reusing a single
+        requests.Session means consecutive pages only pay the TCP+TLS handshake once per connection
+        instead of once per request.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=(DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+
+    def get(self, url, headers=None, params=None, timeout=None):
+        return self.session.get(url, headers=headers, params=params, timeout=timeout or self.timeout)
+
+    def request(self, method, url, headers=None, json=None, timeout=None):
+        return self.session.request(method, url, headers=headers, json=json, timeout=timeout or self.timeout)
+
+    def close(self):
+        self.session.close()
+
+
+def get_transport(pool_size=DEFAULT_POOL_SIZE):
+    """
+        Returns the shared transport for the given pool size, creating it on first use.
+    """
+    if pool_size not in _transports:
+        _transports[pool_size] = CommCareTransport(pool_size=pool_size)
+    return _transports[pool_size]
@@ -0,0 +1,76 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from const import DEFAULT_MAX_PENDING_UPLOADS, DEFAULT_UPLOAD_WORKERS
+
+
+class InlineUploader(object):
+
+    """
+        Runs each upload as soon as it is submitted, in the calling thread. This is the default,
+        strictly serial behaviour of CommCareAPIHandlerPull.
+    """
+
+    def __init__(self, upload_function):
+        self.upload_function = upload_function
+
+    def submit(self, *args):
+        self.upload_function(*args)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class BackgroundUploader(InlineUploader):
+
+    """
+        Runs uploads on a bounded pool of background threads so that the next CommCare page can be
+        fetched while the previous one is being written to S3.
+
+        At most max_pending uploads may be queued or in flight at once; submit() blocks until a slot
+        frees up, which keeps memory bounded when S3 is slower than the API. The first upload error is
+        re-raised in the submitting thread on the next submit() or flush().
+    """
+
+    def __init__(self, upload_function, max_workers=DEFAULT_UPLOAD_WORKERS, max_pending=DEFAULT_MAX_PENDING_UPLOADS):
+        super().__init__(upload_function)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='s3-upload')
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._futures = []
+        self._error = None
+
+    def _on_done(self, future):
+        if future.exception() is not None and self._error is None:
+            self._error = future.exception()
+        self._slots.release()
+
+    def raise_if_failed(self):
+        if self._error is not None:
+            raise self._error
+
+    def submit(self, *args):
+        self.raise_if_failed()
+        self._slots.acquire()
+        future = self._executor.submit(self.upload_function, *args)
+        self._futures.append(future)
+        future.add_done_callback(self._on_done)
+
+    def flush(self):
+        """
+            Waits for every submitted upload to finish, raising the first upload error if there was one.
+        """
+        wait(self._futures)
+        self._futures = []
+        self.raise_if_failed()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
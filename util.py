@@ -1,9 +1,20 @@
-import boto3
 import json
 import requests
+import threading
+import time
 
+from clients import get_ssm_client
+from const import API_TOKEN_CACHE_TTL_SECONDS, SSM_GET_PARAMETERS_BATCH_SIZE
+from log import get_logger
+from metrics import MeteredClient
 from requests.exceptions import JSONDecodeError
-ssm_client = boto3.client('ssm')
+
+# API tokens read from the parameter store, by parameter name, as (token, expiry time). Kept at module level
+#   so that warm Lambda invocations reuse them instead of going back to SSM.
+_api_token_cache = {}
+_api_token_cache_lock = threading.Lock()
+
+logger = get_logger(__name__)
 
 class APIError(Exception):
     def __init__(self, message, error_code):
@@ -26,19 +37,89 @@ def process_response(response, is_boto=False):
             error = APIError(f"Request failed! Code: {response.status_code}.", response.status_code)
         raise error
 
-def get_value_from_parameter_store(param_name):
-    print(f"Getting value from parameter store with name: {param_name}")
-    response = ssm_client.get_parameter(Name=param_name)
+def process_raw_response(response):
+    # Same as process_response, but returns the undecoded response body
+    if response.ok:
+        return response.content
+    process_response(response)
+
+def _get_ssm_client(metrics=None):
+    # The latency of parameter store calls is recorded when a MetricsRecorder is given
+    return MeteredClient(get_ssm_client(), metrics, 'SSM') if metrics else get_ssm_client()
+
+def get_value_from_parameter_store(param_name, metrics=None):
+    logger.info("Getting value from parameter store with name: %s", param_name)
+    response = _get_ssm_client(metrics).get_parameter(Name=param_name)
     process_response(response, is_boto=True)
     return response['Parameter']['Value']
 
-def get_api_token(domain, specifier=None):
-    param_name = domain +  (("-" + specifier) if specifier else "")  + '-api-key'
-    return get_value_from_parameter_store(param_name)
+def get_values_from_parameter_store(param_names, metrics=None):
+    # Gets several values with as few SSM calls as possible. Names that do not exist are left out of the result.
+    values = {}
+    for i in range(0, len(param_names), SSM_GET_PARAMETERS_BATCH_SIZE):
+        batch = param_names[i:i + SSM_GET_PARAMETERS_BATCH_SIZE]
+        logger.info("Getting values from parameter store with names: %s", batch)
+        response = _get_ssm_client(metrics).get_parameters(Names=batch)
+        process_response(response, is_boto=True)
+        for parameter in response['Parameters']:
+            values[parameter['Name']] = parameter['Value']
+        if response.get('InvalidParameters'):
+            logger.warning("Parameters not found in parameter store: %s", response['InvalidParameters'])
+    return values
+
+def api_token_parameter_name(domain, specifier=None):
+    return domain +  (("-" + specifier) if specifier else "")  + '-api-key'
+
+def _get_cached_api_token(param_name):
+    with _api_token_cache_lock:
+        cached = _api_token_cache.get(param_name)
+        if cached is None:
+            return None
+        api_token, expiry_time = cached
+        if time.monotonic() >= expiry_time:
+            del _api_token_cache[param_name]
+            return None
+        return api_token
+
+def _cache_api_token(param_name, api_token):
+    with _api_token_cache_lock:
+        _api_token_cache[param_name] = (api_token, time.monotonic() + API_TOKEN_CACHE_TTL_SECONDS)
+
+def get_api_token(domain, specifier=None, metrics=None):
+    param_name = api_token_parameter_name(domain, specifier)
+    api_token = _get_cached_api_token(param_name)
+    if metrics:
+        metrics.record('ApiTokenCacheHits' if api_token is not None else 'ApiTokenCacheMisses', 1)
+    if api_token is None:
+        api_token = get_value_from_parameter_store(param_name, metrics)
+        _cache_api_token(param_name, api_token)
+    return api_token
+
+def prefetch_api_tokens(domains_and_specifiers, metrics=None):
+    """
+        Reads the API tokens of several (domain, specifier) pairs that are not already cached in batched
+        parameter store calls, so that the get_api_token calls that follow are served from the cache.
+        Missing tokens are not an error here; get_api_token raises for them as usual.
+    """
+    param_names = [api_token_parameter_name(domain, specifier) for domain, specifier in domains_and_specifiers]
+    uncached_param_names = [name for name in dict.fromkeys(param_names) if _get_cached_api_token(name) is None]
+    if not uncached_param_names:
+        return
+    for param_name, api_token in get_values_from_parameter_store(uncached_param_names, metrics).items():
+        _cache_api_token(param_name, api_token)
+
+def invalidate_api_token(api_token):
+    # Drops a token from the cache, e.g. after CommCareHQ rejected it, so that the next lookup reads it from SSM again
+    with _api_token_cache_lock:
+        for param_name in [name for name, (cached_token, _) in _api_token_cache.items() if cached_token == api_token]:
+            logger.info("Invalidating cached API token with name: %s", param_name)
+            del _api_token_cache[param_name]
 
 def put_value_parameter_store(param_name, param_value, overwrite=False):
-    response = ssm_client.put_parameter(Name=param_name, Value=param_value, Overwrite=overwrite)
+    response = get_ssm_client().put_parameter(Name=param_name, Value=param_value, Overwrite=overwrite)
     process_response(response, is_boto=True)
+    with _api_token_cache_lock:
+        _api_token_cache.pop(param_name, None)
 
 class APILimitCalculator(object):
 
@@ -57,19 +138,21 @@ class APILimitCalculator(object):
     max_limit = 10000
 
     @classmethod
-    def determine_new_api_limit(cls, current_limit, size_of_test_request_in_bytes):
+    def determine_new_api_limit(cls, current_limit, size_of_test_request_in_bytes, compression_ratio=1.0):
         """
             Calculates the appropriate API limit for this data type, based on the file size of
-            a test request made to the API.
+            a page received from the API with the current limit. When the maximum file size applies
+            to compressed files, compression_ratio (compressed size / uncompressed size) converts the
+            uncompressed page size into the size of the file that will be written.
         """
-        size_in_mb = size_of_test_request_in_bytes / 1000000
-        print(f"Calculated file size with current limit to be: {size_in_mb}MB.")
-        calculated_new_limit = cls.calculate_new_api_limit(size_in_mb, current_limit)
+        size_in_mb = size_of_test_request_in_bytes * compression_ratio / 1000000
+        logger.debug("Calculated file size with current limit to be: %sMB.", size_in_mb)
+        calculated_new_limit = max(1, cls.calculate_new_api_limit(size_in_mb, current_limit))
         if calculated_new_limit < cls.max_limit:
-            print(f"New appropriate limit calculated to be: {calculated_new_limit}.")
+            logger.debug("New appropriate limit calculated to be: %s.", calculated_new_limit)
             return calculated_new_limit
         else:
-            print(f"New calculated limit was above the maximum ({cls.max_limit}). Using max limit instead...")
+            logger.debug("New calculated limit was above the maximum (%s). Using max limit instead...", cls.max_limit)
             return cls.max_limit
 
     @classmethod